@@ -0,0 +1,179 @@
+"""
+截图到请求的延迟基准：对比原来的定时轮询剪贴板 + 临时PNG文件，与 dataChanged 事件 + 内存中的 PixelBuffer
+
+用法（在项目根目录执行，不需要显示器）:
+    python -m benchmarks.bench_capture
+    python -m benchmarks.bench_capture --size 2560x1440 --repeat 20
+
+测量从截图写入剪贴板到图文请求体（build_image_messages）准备好的时间：
+    原流程: 每500ms轮询剪贴板 -> 保存临时PNG -> 预览 -> ImageAgent按路径重新读取、解码 -> 预处理
+    新流程: dataChanged -> 转换为RGBA8888 -> 预览 -> PixelBuffer直接引用像素内存 -> 预处理
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QTimer
+from PySide6.QtGui import QColor, QFont, QImage, QPainter, QPixmap
+from PySide6.QtWidgets import QApplication
+
+from core.ImageAgent import build_image_messages
+from core.ImagePrep import ImagePreprocessor
+from core.Screenshot import Screenshot
+
+QUESTION = "这段代码为什么会报错？"
+POLL_INTERVAL_MS = 500  # 原 Screenshot.capture_to_clipboard 的轮询间隔
+
+
+def synthesize_screenshot(width, height, seed) -> QImage:
+    """生成编辑器风格的代码截图，每张内容不同，避免命中预处理缓存"""
+    rng = random.Random(seed)
+    image = QImage(width, height, QImage.Format.Format_RGB32)
+    image.fill(QColor("#1e1e1e"))
+    painter = QPainter(image)
+    painter.setFont(QFont("monospace", 14))
+    colors = [QColor("#d4d4d4"), QColor("#569cd6"), QColor("#ce9178"), QColor("#6a9955")]
+    words = ["def", "return", "for", "in", "range(n)", "total", "+=", "i", "if", "x", "==", "None:"]
+    for row, y in enumerate(range(30, height - 20, 24)):
+        painter.setPen(QColor("#858585"))
+        painter.drawText(10, y, f"{row + 1:>4}")
+        x = 70 + 28 * rng.randint(0, 3)
+        for _ in range(rng.randint(2, 8)):
+            word = rng.choice(words)
+            painter.setPen(rng.choice(colors))
+            painter.drawText(x, y, word)
+            x += 12 * (len(word) + 1)
+    painter.end()
+    return image
+
+
+def old_pipeline(clipboard, temp_path):
+    """原流程：剪贴板图片保存为临时PNG，预览，ImageAgent再按路径读取"""
+    image = clipboard.image()
+    image.save(temp_path, "PNG")
+    QPixmap.fromImage(image)  # 预览
+    prepared = ImagePreprocessor.instance().prepare(temp_path)
+    return prepared, build_image_messages(prepared, QUESTION)
+
+
+def new_pipeline(clipboard):
+    """新流程：只转换一次格式，预览，PixelBuffer直接交给预处理"""
+    image = clipboard.image()
+    if image.format() != QImage.Format.Format_RGBA8888:
+        image = image.convertToFormat(QImage.Format.Format_RGBA8888)
+    QPixmap.fromImage(image)  # 预览
+    prepared = ImagePreprocessor.instance().prepare(Screenshot.qt_image_to_buffer(image))
+    return prepared, build_image_messages(prepared, QUESTION)
+
+
+class CaptureRun:
+    """依次把截图写入剪贴板，记录每张截图从写入到请求体准备好的时间"""
+
+    def __init__(self, app, images, polling, seed=0):
+        self.app = app
+        self.images = images
+        self.polling = polling
+        self.rng = random.Random(seed)
+        self.clipboard = QApplication.clipboard()
+        self.temp_path = os.path.join(tempfile.gettempdir(), f"bench_capture_{os.getpid()}.png")
+        self.sent = None
+        self.samples = []  # (总用时, 等待发现截图的时间)
+        self.prepared = []
+        if polling:
+            self.timer = QTimer()
+            self.timer.timeout.connect(self.on_poll)
+        else:
+            self.clipboard.dataChanged.connect(self.on_changed)
+
+    def start(self):
+        if self.polling:
+            self.timer.start(POLL_INTERVAL_MS)
+        self.next()
+
+    def next(self):
+        self.clipboard.clear()
+        if len(self.samples) == len(self.images):
+            if self.polling:
+                self.timer.stop()
+            else:
+                self.clipboard.dataChanged.disconnect(self.on_changed)
+            if os.path.exists(self.temp_path):
+                os.unlink(self.temp_path)
+            self.app.quit()
+            return
+        # 截图的时刻与轮询的相位无关
+        delay = self.rng.uniform(0, POLL_INTERVAL_MS) if self.polling else 0
+        QTimer.singleShot(int(delay), self.capture)
+
+    def capture(self):
+        self.sent = time.perf_counter()
+        self.clipboard.setImage(self.images[len(self.samples)])
+
+    def on_poll(self):
+        mime_data = self.clipboard.mimeData()
+        if self.sent is None or mime_data is None or not mime_data.hasImage():
+            return
+        found = time.perf_counter()
+        prepared, _ = old_pipeline(self.clipboard, self.temp_path)
+        self.record(found, prepared)
+
+    def on_changed(self):
+        if self.sent is None:
+            return
+        found = time.perf_counter()
+        prepared, _ = new_pipeline(self.clipboard)
+        self.record(found, prepared)
+
+    def record(self, found, prepared):
+        self.samples.append((time.perf_counter() - self.sent, found - self.sent))
+        self.prepared.append(prepared)
+        self.sent = None
+        QTimer.singleShot(0, self.next)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(app, images, polling):
+    ImagePreprocessor.configure()  # 两种流程各自从空缓存开始
+    capture = CaptureRun(app, images, polling)
+    QTimer.singleShot(0, capture.start)
+    app.exec()
+    return capture
+
+
+def main():
+    parser = argparse.ArgumentParser(description="截图到请求的延迟基准")
+    parser.add_argument("--size", default="1920x1080", help="截图尺寸，如 2560x1440")
+    parser.add_argument("--repeat", type=int, default=10, help="每种流程的截图次数")
+    args = parser.parse_args()
+    width, height = (int(value) for value in args.size.lower().split("x"))
+
+    app = QApplication(sys.argv[:1])
+    images = [synthesize_screenshot(width, height, seed) for seed in range(args.repeat)]
+    old = run(app, images, polling=True)
+    new = run(app, images, polling=False)
+
+    if [p.data for p in old.prepared] != [p.data for p in new.prepared]:
+        print("两种流程的预处理结果不一致！")
+    print(f"截图: {width}x{height}，每种流程 {args.repeat} 次")
+    for name, capture in (("轮询 + 临时PNG", old), ("dataChanged + PixelBuffer", new)):
+        total = [sample[0] for sample in capture.samples]
+        waiting = [sample[1] for sample in capture.samples]
+        processing = [t - w for t, w in capture.samples]
+        print(f"  {name}:")
+        print(f"    总延迟(ms):   p50 {percentile(total, 0.5) * 1000:8.1f}  p95 {percentile(total, 0.95) * 1000:8.1f}")
+        print(f"    发现截图(ms): p50 {percentile(waiting, 0.5) * 1000:8.1f}  p95 {percentile(waiting, 0.95) * 1000:8.1f}")
+        print(f"    处理(ms):     p50 {percentile(processing, 0.5) * 1000:8.1f}  p95 {percentile(processing, 0.95) * 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+SSE解析微基准：对比原来 StreamWorker 中基于 iter_lines + json.loads 的循环与 core.SSEParser
+
+用法（在项目根目录执行）:
+    python -m benchmarks.bench_sse                  # 使用合成的DeepSeek-R1形状的流
+    python -m benchmarks.bench_sse r1_1.sse r1_2.sse  # 使用录制的原始流
+
+录制原始流可以直接保存接口的响应体，例如:
+    curl -N https://api.siliconflow.cn/v1/chat/completions -H "Authorization: Bearer $KEY" \\
+         -H "Content-Type: application/json" -d @request.json > r1_1.sse
+"""
+
+import json
+import random
+import sys
+import time
+
+from core.SSEParser import SSEParser
+
+
+def synthesize_r1_stream(reasoning_chunks=4000, content_chunks=1500, seed=0) -> bytes:
+    """生成与SiliconFlow上DeepSeek-R1流式响应格式相同的数据：先输出思考过程，再输出回答"""
+    rng = random.Random(seed)
+    words = ["首先", "我们", "需要", "分析", "代码", "的", "循环", "边界", "条件", "，", "。",
+             "i", " +=", " 1", "\n", "```", "python", " return", " x", "数组", "下标"]
+    lines = []
+
+    def event(content, reasoning):
+        payload = {
+            "id": "0194f1a2b3c4d5e6f7a8b9c0d1e2f3a4",
+            "object": "chat.completion.chunk",
+            "created": 1739000000,
+            "model": "Pro/deepseek-ai/DeepSeek-R1",
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": content, "reasoning_content": reasoning, "role": "assistant"},
+                    "finish_reason": None,
+                }
+            ],
+            "system_fingerprint": "",
+            "usage": {"prompt_tokens": 180, "completion_tokens": len(lines), "total_tokens": 180 + len(lines)},
+        }
+        return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+    for _ in range(reasoning_chunks):
+        lines.append(event(None, rng.choice(words)))
+    for _ in range(content_chunks):
+        lines.append(event(rng.choice(words), None))
+    lines.append(b"data: [DONE]\n\n")
+    return b"".join(lines)
+
+
+def split_like_network(raw: bytes, seed=0) -> list:
+    """把原始数据切成大小不一的片段，模拟网络分批到达"""
+    rng = random.Random(seed)
+    pieces = []
+    i = 0
+    while i < len(raw):
+        size = rng.randint(64, 2048)
+        pieces.append(raw[i:i + size])
+        i += size
+    return pieces
+
+
+def _iter_lines(pieces):
+    """与 requests.Response.iter_lines() 相同的按行切分逻辑"""
+    pending = None
+    for chunk in pieces:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def old_loop(pieces) -> list:
+    """原 StreamWorker.run 中的解析循环（去掉了print）"""
+    result = []
+    for chunk in _iter_lines(pieces):
+        if chunk:
+            chunk_str = chunk.decode("utf-8").strip()
+            if chunk_str == "[DONE]":
+                break
+            if chunk_str.startswith("data:"):
+                try:
+                    chunk_data = json.loads(chunk_str[5:])
+                    content = chunk_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
+                    if content:
+                        result.append(content)
+                except json.JSONDecodeError:
+                    pass
+    return result
+
+
+def new_loop(pieces) -> list:
+    result = []
+    parser = SSEParser()
+    for chunk in pieces:
+        for delta in parser.feed(chunk):
+            if delta.content:
+                result.append(delta.content)
+        if parser.done:
+            break
+    return result
+
+
+def bench(funcs, pieces, repeat=15) -> list:
+    """
+    交替运行各函数，返回每个函数多次运行中的最短用时（秒）
+    交替运行使机器负载的波动同时影响两边，加速比比先后分别计时更稳定
+    """
+    best = [float("inf")] * len(funcs)
+    for _ in range(repeat):
+        for i, func in enumerate(funcs):
+            start = time.perf_counter()
+            func(pieces)
+            best[i] = min(best[i], time.perf_counter() - start)
+    return best
+
+
+def main(paths):
+    if paths:
+        streams = []
+        for path in paths:
+            with open(path, "rb") as f:
+                streams.append((path, f.read()))
+    else:
+        streams = [("合成R1流", synthesize_r1_stream())]
+
+    for name, raw in streams:
+        pieces = split_like_network(raw)
+        if old_loop(pieces) != new_loop(pieces):
+            print(f"{name}: 两种解析结果不一致！")
+            continue
+        events = raw.count(b"\ndata:") + raw.startswith(b"data:")
+        old_time, new_time = bench((old_loop, new_loop), pieces)
+        print(f"{name}: {len(raw) / 1024:.0f} KiB, {events} 个事件")
+        print(f"  iter_lines + json.loads: {old_time * 1000:8.2f} ms  ({old_time / events * 1e6:.2f} us/事件)")
+        print(f"  SSEParser:               {new_time * 1000:8.2f} ms  ({new_time / events * 1e6:.2f} us/事件)")
+        print(f"  加速比: {old_time / new_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,206 @@
+"""
+压测：启动本地模拟接口，通过真实的agent类并发发起N个对话，统计吞吐量和延迟分位数
+不访问网络，不消耗API额度，也不会写入正式的回答缓存和指标文件
+
+用法（在项目根目录执行）:
+    python -m benchmarks.load_test --kind chat --conversations 8 --turns 2
+    python -m benchmarks.load_test --kind debug --conversations 10
+    python -m benchmarks.load_test --kind image --conversations 10 --error-rate 0.2 --retry-after 0.1
+
+--kind chat 走 MyChatAgent（含记忆、缓存、重试和Signals转发），debug 和 image 分别直接驱动
+StructuredAgentThread 和 ImageWorker；模拟接口的参数见 benchmarks.mock_server
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from functools import partial
+
+from camel.models import ModelFactory
+from camel.types import ModelPlatformType
+from PIL import Image
+from PySide6.QtCore import QCoreApplication, QTimer
+
+from benchmarks.mock_server import MockServer, add_config_arguments, config_from_args
+from core.Agent_1 import MyChatAgent
+from core.Agent_2 import StructuredAgentThread
+from core.HttpClient import HttpClient
+from core.ImageAgent import ImageWorker
+from core.ImageCache import ImageCache
+from core.Metrics import Metrics
+from core.RateLimiter import RPM_LIMIT, TPM_LIMIT, RateLimiter
+from core.ResponseCache import ResponseCache
+from core.Signals import Signals
+from core.SingleFlight import SingleFlight
+from core.StreamEngine import StreamEngine
+
+FIRST_WINDOW_ID = 100  # 每个对话使用独立的窗口id，避免与真实窗口混淆并互相抢占
+
+
+@dataclass
+class RequestRecord:
+    conversation: int
+    sent: float
+    first: float = None  # 收到第一段回答的时间
+    done: float = None
+    chunks: int = 0
+    error: bool = False
+
+
+@dataclass
+class Conversation:
+    index: int
+    turns_left: int
+    records: list = field(default_factory=list)
+
+
+def percentile(values, q):
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class LoadTest:
+    def __init__(self, app, kind, model, conversations, turns):
+        self.app = app
+        self.kind = kind
+        self.model = model
+        self.conversations = [Conversation(i, turns) for i in range(conversations)]
+        self.running = conversations
+        self.workers = {}  # 对话 -> 进行中的worker，防止被回收
+        self.image = Image.new("RGB", (640, 480), "white")
+        if kind == "chat":
+            self.chat_agent = MyChatAgent(model)
+            Signals.instance().agent_stream_signal.connect(self.on_stream)
+
+    def start(self):
+        self.started = time.perf_counter()
+        for conversation in self.conversations:
+            self.send(conversation)
+
+    def send(self, conversation: Conversation):
+        turn = len(conversation.records)
+        prompt = f"[压测 对话{conversation.index} 第{turn + 1}轮] 帮我找出这段代码的错误：for i in range(1, n): total += i"
+        conversation.records.append(RequestRecord(conversation.index, time.perf_counter()))
+        conversation.turns_left -= 1
+        if self.kind == "chat":
+            self.chat_agent.receive_message(prompt, FIRST_WINDOW_ID + conversation.index)
+            return
+        if self.kind == "debug":
+            worker = StructuredAgentThread(self.model, prompt, FIRST_WINDOW_ID + conversation.index)
+            worker.result_ready.connect(partial(self.on_result, conversation))
+        else:
+            worker = ImageWorker(self.model, self.image, prompt, id=FIRST_WINDOW_ID + conversation.index)
+            worker.message_received.connect(self.on_stream)
+            worker.finished.connect(lambda id: self.on_stream(id, "<EOS>"))
+        self.workers[conversation.index] = worker
+        worker.start()
+
+    def on_stream(self, id: int, content: str):
+        index = id - FIRST_WINDOW_ID
+        if not 0 <= index < len(self.conversations):
+            return
+        conversation = self.conversations[index]
+        record = conversation.records[-1]
+        if content == "<EOS>":
+            self.finish(conversation)
+            return
+        if record.first is None:
+            record.first = time.perf_counter()
+        record.chunks += 1
+        record.error = record.error or content.startswith("[ERROR]")
+
+    def on_result(self, conversation: Conversation, result: list, *args):
+        record = conversation.records[-1]
+        record.first = time.perf_counter()
+        record.chunks = 1
+        record.error = any(str(item).startswith("[ERROR]") for item in result)
+        self.finish(conversation)
+
+    def finish(self, conversation: Conversation):
+        conversation.records[-1].done = time.perf_counter()
+        if conversation.turns_left > 0:
+            self.send(conversation)
+            return
+        self.workers.pop(conversation.index, None)
+        self.running -= 1
+        if self.running == 0:
+            self.elapsed = time.perf_counter() - self.started
+            self.app.quit()
+
+    def report(self):
+        records = [r for c in self.conversations for r in c.records]
+        done = [r for r in records if r.done is not None]
+        ok = [r for r in done if not r.error]
+        elapsed = getattr(self, "elapsed", time.perf_counter() - self.started)
+        ttft = [r.first - r.sent for r in ok if r.first is not None]
+        latency = [r.done - r.sent for r in ok]
+
+        print(f"类型: {self.kind}，对话: {len(self.conversations)}，请求: {len(records)}，"
+              f"完成: {len(done)}，失败: {len(done) - len(ok)}，总用时: {elapsed:.2f}s")
+        print(f"吞吐量: {len(done) / elapsed:.2f} 请求/s，{sum(r.chunks for r in ok) / elapsed:.1f} 分片/s")
+        for name, values in (("首token", ttft), ("总延迟", latency)):
+            print(f"{name}(s): p50 {percentile(values, 0.5):.3f}  p95 {percentile(values, 0.95):.3f}  "
+                  f"p99 {percentile(values, 0.99):.3f}  max {max(values, default=float('nan')):.3f}")
+        print("各阶段（来自 core.Metrics）:")
+        for row in Metrics.instance().snapshot():
+            if row["metric"] in ("queue_seconds", "connect_seconds", "ttft_seconds", "tokens_per_second"):
+                print(f"  {row['metric']:<18} {row['model']:<16} 窗口{row['window']:<5} n={row['count']:<5} "
+                      f"p50 {row['p50']:.3f}  p95 {row['p95']:.3f}")
+
+
+def create_model(kind, url):
+    """与 core.Model.init_models 相同的模型参数，只是指向模拟接口"""
+    config = {"stream": True} if kind == "image" else {"temperature": 0.5, "max_tokens": 10000, "stream": True}
+    return ModelFactory.create(
+        model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+        model_type=f"mock-{kind}",
+        url=url,
+        api_key="mock",
+        model_config_dict=config,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="通过真实agent类对模拟接口压测")
+    parser.add_argument("--kind", choices=("chat", "debug", "image"), default="chat")
+    parser.add_argument("--conversations", type=int, default=20, help="并发对话数")
+    parser.add_argument("--turns", type=int, default=1, help="每个对话的轮数")
+    parser.add_argument("--concurrency", type=int, default=None, help="StreamEngine并发上限，默认与对话数相同")
+    parser.add_argument("--timeout", type=float, default=300, help="最长运行时间（秒）")
+    parser.add_argument("--rpm", type=int, default=RPM_LIMIT, help="客户端限流的每分钟请求数")
+    parser.add_argument("--tpm", type=int, default=TPM_LIMIT, help="客户端限流的每分钟token数")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    concurrency = args.concurrency or args.conversations
+    app = QCoreApplication(sys.argv[:1])
+    server = MockServer(config_from_args(args)).start()
+    cache_dir = tempfile.mkdtemp(prefix="bugsy_load_test_")
+    ResponseCache.configure(path=os.path.join(cache_dir, "llm_cache.sqlite"))
+    ImageCache.configure(path=os.path.join(cache_dir, "image_cache.sqlite"))
+    Metrics.configure(path=None)
+    HttpClient.configure(pool_maxsize=max(16, concurrency))
+    StreamEngine.configure(max_concurrency=concurrency)
+    RateLimiter.configure(rpm=args.rpm, tpm=args.tpm)
+
+    test = LoadTest(app, args.kind, create_model(args.kind, server.url), args.conversations, args.turns)
+    QTimer.singleShot(0, test.start)
+    QTimer.singleShot(int(args.timeout * 1000), app.quit)
+    app.exec()
+
+    test.report()
+    print(f"模拟接口: 收到 {server.requests} 个请求，注入 {server.errors} 个错误")
+    if args.kind == "chat":
+        print(f"请求合并: {SingleFlight.instance().stats()}")
+    print(f"客户端限流: {RateLimiter.instance().stats()}")
+    StreamEngine.instance().shutdown()
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+本地模拟的OpenAI兼容接口（/v1/chat/completions），用于离线测试和压测，不消耗API额度
+
+支持流式（分块传输的SSE）和非流式响应，可配置首token延迟、生成速度、思考过程长度和错误注入；
+请求带有 response_format 或要求输出JSON时返回固定的结构化结果（与 Agent_2.StructuredOutputSchema 对应）
+
+用法（在项目根目录执行）:
+    python -m benchmarks.mock_server --port 8765 --ttft 0.5 --rate 40 --error-rate 0.1
+然后把模型的url设为 http://127.0.0.1:8765
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = (
+    "这段代码的问题在于循环的边界条件：`range(1, n)` 少处理了最后一个元素，"
+    "应改为 `range(1, n + 1)`。另外累加变量需要在循环外初始化为0。\n\n"
+    "```python\ndef solve(n):\n    total = 0\n    for i in range(1, n + 1):\n"
+    "        total += i\n    return total\n```\n"
+)
+
+STRUCTURED_ANSWER = {
+    "problem_analysis": "题目要求计算1到n的和，需要注意n为0时的边界情况。",
+    "error_reason": "循环使用了 range(1, n)，少加了n本身。",
+    "correct_code": "def solve(n):\n    return sum(range(1, n + 1))",
+    "test_cases": [
+        {"input": "3", "origin_output": "3", "expected_output": "6"},
+        {"input": "0", "origin_output": "0", "expected_output": "0"},
+    ],
+}
+
+
+@dataclass
+class MockConfig:
+    ttft: float = 0.3  # 收到请求到产出第一个回答token的时间（秒），不含思考过程
+    rate: float = 50.0  # 每秒产出的token（流式分片）数
+    tokens: int = 120  # 回答的token数，超过回答文本长度时循环使用
+    reasoning_tokens: int = 0  # 回答前的思考过程token数（模拟DeepSeek-R1的reasoning_content）
+    error_rate: float = 0.0  # 直接返回错误状态码的概率
+    error_status: int = 503
+    retry_after: float = None  # 错误响应中的Retry-After（秒）
+    midstream_error_rate: float = 0.0  # 输出一部分后在流中返回错误的概率
+    seed: int = None
+
+
+def _split_tokens(text, count):
+    """把文本切成count个分片，模拟逐token输出"""
+    pieces = [text[i:i + 2] for i in range(0, len(text), 2)]
+    return [pieces[i % len(pieces)] for i in range(count)]
+
+
+def _wants_json(body) -> bool:
+    if "response_format" in body:
+        return True
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str) and ("json" in content.lower() or "schema" in content.lower()):
+            return True
+    return False
+
+
+class MockServer:
+    """在后台线程中运行的模拟接口，可在同一进程内启动和关闭"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        """
+        :param port: 监听端口，0表示自动选择空闲端口
+        """
+        self.config = config or MockConfig()
+        self.rng = random.Random(self.config.seed)
+        self.requests = 0
+        self.errors = 0
+        self._stats_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="MockServer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _roll(self, probability) -> bool:
+        with self._stats_lock:
+            return self.rng.random() < probability
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_HEAD(self):
+                # 预连接用
+                self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_POST(self):
+                if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+                    self.send_error(404)
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                with server._stats_lock:
+                    server.requests += 1
+                server.handle_completion(self, body)
+
+        return Handler
+
+    def handle_completion(self, handler, body):
+        config = self.config
+        if self._roll(config.error_rate):
+            with self._stats_lock:
+                self.errors += 1
+            payload = json.dumps(
+                {"error": {"message": "mock injected error", "code": config.error_status}}
+            ).encode("utf-8")
+            handler.send_response(config.error_status)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(payload)))
+            if config.retry_after is not None:
+                handler.send_header("Retry-After", str(config.retry_after))
+            handler.end_headers()
+            handler.wfile.write(payload)
+            return
+
+        model = body.get("model", "mock")
+        if _wants_json(body):
+            text = json.dumps(STRUCTURED_ANSWER, ensure_ascii=False)
+            tokens = _split_tokens(text, (len(text) + 1) // 2)
+        else:
+            tokens = _split_tokens(ANSWER, config.tokens)
+        interval = 1.0 / config.rate if config.rate > 0 else 0.0
+
+        if not body.get("stream"):
+            time.sleep(config.ttft + config.reasoning_tokens * interval + len(tokens) * interval)
+            payload = json.dumps(self._completion(model, "".join(tokens), len(tokens))).encode("utf-8")
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(payload)))
+            handler.end_headers()
+            handler.wfile.write(payload)
+            return
+
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream")
+        handler.send_header("Transfer-Encoding", "chunked")
+        handler.end_headers()
+        fail_at = (
+            self.rng.randint(1, max(1, len(tokens) - 1))
+            if self._roll(config.midstream_error_rate)
+            else None
+        )
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def write(data: bytes):
+            handler.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            handler.wfile.flush()
+
+        try:
+            if config.reasoning_tokens:
+                # 思考过程紧接着开始输出，回答的首token仍在ttft之后
+                reasoning = _split_tokens("首先分析题意，再检查循环边界。", config.reasoning_tokens)
+                step = config.ttft / len(reasoning)
+                for piece in reasoning:
+                    time.sleep(step)
+                    write(self._event(chunk_id, model, {"content": None, "reasoning_content": piece}))
+            else:
+                time.sleep(config.ttft)
+            for i, piece in enumerate(tokens):
+                if i == fail_at:
+                    with self._stats_lock:
+                        self.errors += 1
+                    error = {"error": {"message": "mock injected stream error", "code": 500}}
+                    write(b"data: " + json.dumps(error).encode("utf-8") + b"\n\n")
+                    break
+                if i:
+                    time.sleep(interval)
+                write(self._event(chunk_id, model, {"content": piece, "reasoning_content": None}))
+            else:
+                write(self._event(chunk_id, model, {}, finish_reason="stop"))
+                write(b"data: [DONE]\n\n")
+            handler.wfile.write(b"0\r\n\r\n")
+            handler.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端取消了请求
+
+    @staticmethod
+    def _event(chunk_id, model, delta, finish_reason=None) -> bytes:
+        payload = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {"role": "assistant", **delta}, "finish_reason": finish_reason}],
+        }
+        return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+    @staticmethod
+    def _completion(model, content, completion_tokens) -> dict:
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": {
+                "prompt_tokens": 100,
+                "completion_tokens": completion_tokens,
+                "total_tokens": 100 + completion_tokens,
+            },
+        }
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """命令行参数与 MockConfig 一一对应，压测脚本共用"""
+    defaults = MockConfig()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="首token延迟（秒）")
+    parser.add_argument("--rate", type=float, default=defaults.rate, help="每秒token数")
+    parser.add_argument("--tokens", type=int, default=defaults.tokens, help="回答的token数")
+    parser.add_argument("--reasoning-tokens", type=int, default=defaults.reasoning_tokens, help="思考过程的token数")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="直接返回错误的概率")
+    parser.add_argument("--error-status", type=int, default=defaults.error_status, help="注入错误的状态码")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after, help="错误响应的Retry-After（秒）")
+    parser.add_argument("--midstream-error-rate", type=float, default=defaults.midstream_error_rate, help="流中途出错的概率")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="随机种子")
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        ttft=args.ttft,
+        rate=args.rate,
+        tokens=args.tokens,
+        reasoning_tokens=args.reasoning_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        midstream_error_rate=args.midstream_error_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容接口")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = MockServer(config_from_args(args), port=args.port).start()
+    print(f"模拟接口已在 {server.url}/v1/chat/completions 上运行，Ctrl+C 退出")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,137 +1,457 @@
 from .common import *
 from .Signals import Signals
+from .HttpClient import HttpClient
+from .StreamEngine import EngineTask, StreamEngine
+from .SSEParser import SSEParser
+from .ResponseCache import ResponseCache, make_key
+from .SemanticCache import SemanticCache
+from .SingleFlight import SingleFlight
+from .Memory import ConversationMemory
+from .Resilience import ServerError, call_with_retry, classify_exception, classify_status
+from .RateLimiter import EXPECTED_OUTPUT_TOKENS, RateLimiter, priority_for_window
+from functools import partial
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
 
 # chat_agent
 
 
-class StreamWorker(QThread):
-    message_received = Signal(str)
+class StreamWorker(EngineTask):
+    message_received = Signal(int, str)  # (窗口id, 增量内容)
     finished = Signal(int)
 
-    def __init__(self, model, prompt, id, history_messages=None):
-        super().__init__()
+    def __init__(
+        self,
+        model,
+        prompt,
+        id,
+        history_messages=None,
+        memory=None,
+        hedge=None,
+        fallback_model=None,
+    ):
+        super().__init__(window_id=id)
         self._model = model
+        self.fallback_model = fallback_model  # 主模型重试用尽或熔断时使用的备用模型
         self.prompt = prompt
         self.id = id
         self.history_messages = history_messages or []  # 接收历史消息
+        self.memory = memory  # 给出时在后台线程中从memory取历史消息（可能需要等待摘要完成）
+        self.hedge = hedge  # 对冲请求配置 {"url", "model_type", "delay_ms"}，None表示关闭
+        self._attempts = []  # 进行中的请求，取消时全部关闭
+        self._flight = None  # 与其他相同请求共享的上游请求，见 SingleFlight
+        self._leading = False  # 是否由本请求向上游发出
+        self._flight_lock = threading.Lock()
+
+    def cancel(self):
+        """
+        取消请求，并立即关闭正在读取的连接
+        合并了其他相同的请求时只停止向本窗口转发，所有参与者都取消后才关闭连接
+        """
+        super().cancel()
+        with self._flight_lock:
+            flight = self._flight
+        if flight is not None:
+            flight.leave()
+        else:
+            self._close_attempts()
+
+    def _close_attempts(self):
+        for attempt in list(self._attempts):
+            attempt.cancel()
+
+    def _should_stop(self) -> bool:
+        """本请求已取消，且没有其他请求在等待共享的输出"""
+        if not self.is_cancelled():
+            return False
+        return not (self._leading and self._flight.has_subscribers())
+
+    def _emit(self, content: str):
+        """转发给本窗口，并写入共享的flight供合并的请求读取"""
+        if self._leading:
+            self._flight.publish(content)
+        if not self.is_cancelled():
+            self.message_received.emit(self.id, content)
 
     def run(self):
         print("in Agent1")
-        api_url = f"{self._model._url}/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self._model._api_key}",
-            "Content-Type": "application/json",
-        }
+        if self.memory is not None:
+            self.history_messages = self.memory.get_messages(self.id)
+            if self.is_cancelled():
+                self.finished.emit(self.id)
+                return
 
         # 构建消息列表：历史消息 + 当前提问
         messages = self.history_messages.copy()
         messages.append({"role": "user", "content": self.prompt})
 
+        params = {"max_tokens": 2000, "temperature": 0.5, "top_p": 0.7}
+
+        # 相同的模型、参数和消息直接重放缓存的回答
+        cache = ResponseCache.instance()
+        cache_key = make_key(self._model.model_type, params, messages)
+        cached = cache.get(cache_key)
+
+        # 新对话的第一个问题再查语义缓存，与之前的问题足够相似时返回之前的回答
+        semantic_cache = SemanticCache.instance()
+        use_semantic = not self.history_messages and semantic_cache.is_enabled(self.id)
+        if cached is None and use_semantic:
+            try:
+                cached = semantic_cache.lookup(self.id, self.prompt)
+            except Exception as e:
+                log.warning(f"语义缓存查询失败: {e}")
+                use_semantic = False
+
+        if cached is not None:
+            self.trace.model = "cache"
+            for content in cached:
+                if self.is_cancelled():
+                    break
+                self.trace.mark("first_token")
+                self.trace.tokens += 1
+                self.message_received.emit(self.id, content)
+        else:
+            # 相同的请求正在进行时直接共享它的输出，不再向上游发送
+            with self._flight_lock:
+                if not self.is_cancelled():
+                    self._flight, self._leading = SingleFlight.instance().join(cache_key)
+            if self._leading:
+                self._flight.on_abandoned = self._close_attempts
+                complete = False
+                try:
+                    chunks, complete = self._request(messages, params)
+                    if complete and chunks:
+                        cache.put(cache_key, chunks)
+                        if use_semantic:
+                            semantic_cache.store(self.id, self.prompt, chunks)
+                finally:
+                    # 先写入缓存再结束，之后相同的请求直接命中缓存
+                    SingleFlight.instance().done(self._flight, complete)
+            elif self._flight is not None:
+                self.trace.model = "coalesced"
+                for content in self._flight.iter_chunks(self.is_cancelled):
+                    self.trace.mark("first_token")
+                    self.trace.tokens += 1
+                    self.message_received.emit(self.id, content)
+
+        if self.is_cancelled():
+            log.info(f"窗口{self.id}的请求已取消")
+        self.finished.emit(self.id)
+
+    def _request(self, messages, params):
+        """
+        发送流式请求并逐段转发回答
+        还没有输出内容时，可重试的错误按退避重试，主模型不可用时切换到备用模型
+        :return: (回答分片, 是否完整结束)
+        """
+        chunks = []
+        try:
+            complete = call_with_retry(
+                lambda model: self._stream_once(model, messages, params, chunks),
+                [self._model, self.fallback_model],
+                wait=self.wait_cancelled,
+                should_retry=lambda error: not chunks,  # 已经输出了一部分时无法透明地重试
+            )
+        except Exception as e:
+            error = classify_exception(e)
+            print(error)
+            if not self._should_stop():
+                self._emit(f"[ERROR] {error}")
+            return chunks, False
+        return chunks, complete
+
+    def _notify_wait(self, seconds):
+        Signals.instance().send_agent_status(self.id, f"请求排队中，预计等待{seconds:.0f}秒……")
+
+    def _stream_once(self, model, messages, params, chunks):
+        """
+        等待限流许可后向model发送一次流式请求，产出的内容追加到chunks并转发
+        :return: 是否完整结束（排队时被取消返回False）
+        :raises LLMError: 请求失败
+        """
+        limiter = RateLimiter.instance()
+        estimated = limiter.estimate(messages)
+        if not limiter.acquire(
+            estimated,
+            priority_for_window(self.id),
+            on_wait=self._notify_wait,
+            is_cancelled=self._should_stop,
+        ):
+            return False
+        produced = len(chunks)
+        try:
+            return self._stream_events(model, messages, params, chunks)
+        finally:
+            # 按实际输出的分片数（约等于token数）结算
+            limiter.settle(estimated, estimated - EXPECTED_OUTPUT_TOKENS + len(chunks) - produced)
+
+    def _stream_events(self, model, messages, params, chunks):
+        """读取流式回答，主模型配置了对冲时同时管理对冲请求"""
         data = {
-            "model": self._model.model_type,
+            "model": model.model_type,
             "messages": messages,
             "stream": True,
-            "max_tokens": 2000,
-            "temperature": 0.5,
-            "top_p": 0.7,
+            **params,
         }
+        self.trace.model = model.model_type
+        primary = StreamAttempt(model._url, model._api_key, data, self.trace)
+        self._attempts = [primary]
+        if self.hedge is None or model is not self._model:
+            events = primary.iter_events()
+        else:
+            events = self._hedged_events(primary, data)
+
+        for kind, payload in events:
+            if self._should_stop():
+                break
+            if kind == "delta":
+                if payload.content:
+                    self.trace.mark("first_token")
+                    self.trace.tokens += 1
+                    chunks.append(payload.content)
+                    self._emit(payload.content)
+            elif kind == "error":
+                raise payload
+            else:
+                return payload
+        return False
+
+    def _hedged_events(self, primary, data):
+        """
+        对冲请求：主接口在delay_ms内没有产出token（或未产出就失败）时，向备用接口发送同样的请求，
+        先产出token的一方胜出，另一方立即被取消
+        """
+        events = queue.Queue()
+        secondary = StreamAttempt(
+            self.hedge["url"],
+            self._model._api_key,
+            {**data, "model": self.hedge["model_type"]},
+            self.trace,
+        )
+        deadline = time.monotonic() + self.hedge["delay_ms"] / 1000
+        primary.start(events)
+        running = {primary}
+        winner = None
+        hedge_tried = False
+        limiter = RateLimiter.instance()
+        hedge_estimated = 0  # 对冲请求占用的限流额度，结束时结算
+
+        def start_hedge(reason) -> bool:
+            nonlocal hedge_tried, hedge_estimated
+            hedge_tried = True
+            # 对冲请求可有可无，限流额度不足或有请求在排队时不发送
+            estimated = limiter.estimate(data["messages"])
+            if not limiter.try_acquire(estimated):
+                log.info(f"窗口{self.id}: {primary.model_type} {reason}，但限流额度不足，不发送对冲请求")
+                return False
+            hedge_estimated = estimated
+            log.info(f"窗口{self.id}: {primary.model_type} {reason}，向 {secondary.model_type} 发送对冲请求")
+            self._attempts.append(secondary)
+            running.add(secondary)
+            secondary.start(events)
+            return True
 
         try:
-            with requests.post(
-                api_url, headers=headers, json=data, stream=True, timeout=60
+            while True:
+                if winner is None and not hedge_tried:
+                    timeout = max(0.0, deadline - time.monotonic())
+                else:
+                    timeout = 0.5  # 定期醒来检查是否被取消
+                try:
+                    kind, payload, attempt = events.get(timeout=timeout)
+                except queue.Empty:
+                    if self._should_stop():
+                        return
+                    if winner is None and not hedge_tried:
+                        start_hedge(f"在{self.hedge['delay_ms']}ms内没有产出token")
+                    continue
+
+                if winner is None:
+                    if kind == "delta":
+                        winner = attempt
+                        self.trace.model = attempt.model_type
+                        for other in running - {attempt}:
+                            other.cancel()
+                        log.info(f"窗口{self.id}: {attempt.model_type} 先产出token，使用该回答")
+                    else:
+                        # 没有产出token就结束或失败
+                        running.discard(attempt)
+                        if not hedge_tried and start_hedge("未产出token就结束"):
+                            continue
+                        if running:
+                            continue
+                        yield kind, payload
+                        return
+                if attempt is not winner:
+                    continue
+                yield kind, payload
+                if kind != "delta":
+                    return
+        finally:
+            for attempt in running - {winner}:
+                attempt.cancel()
+            if hedge_estimated:
+                # 输出的token不论来自哪一方，都已在 _stream_once 中按分片数结算，这里只计对冲请求的输入
+                limiter.settle(hedge_estimated, limiter.estimate(data["messages"], 0))
+
+
+class StreamAttempt:
+    """
+    向一个接口发出的一次流式请求
+    可以在当前线程中用 iter_events() 直接读取，也可以用 start() 在独立线程中读取并把事件放入队列
+    """
+
+    def __init__(self, url, api_key, data, trace=None):
+        self.api_url = f"{url}/v1/chat/completions"
+        self.trace = trace  # 所属请求的RequestTrace，记录响应头到达和解析用时
+        self.api_key = api_key
+        self.data = data
+        self.model_type = data["model"]
+        self._response = None
+        self._cancelled = threading.Event()
+
+    def start(self, events: queue.Queue):
+        def run():
+            try:
+                for kind, payload in self.iter_events():
+                    events.put((kind, payload, self))
+            except Exception as e:
+                log.exception(f"{self.model_type} 请求出错")
+                events.put(("error", classify_exception(e), self))
+
+        threading.Thread(target=run, name=f"StreamAttempt-{self.model_type}", daemon=True).start()
+
+    def cancel(self):
+        """取消请求，并立即关闭正在读取的连接"""
+        self._cancelled.set()
+        response = self._response
+        if response is not None:
+            response.close()
+
+    def iter_events(self):
+        """
+        产出 ("delta", Delta)、("error", LLMError) 或 ("done", 是否完整结束)
+        被取消时直接结束，不再产出事件
+        """
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        try:
+            with HttpClient.instance().post(
+                self.api_url, headers=headers, json=self.data, stream=True, timeout=60
             ) as response:
+                self._response = response
+                if self._cancelled.is_set():
+                    return
+                if self.trace is not None:
+                    self.trace.mark("headers")
 
                 if response.status_code != 200:
-                    error_msg = f"Agent_1 API请求失败，状态码: {response.status_code}, 错误: {response.text}"
-                    print(error_msg)
-                    self.message_received.emit(f"[ERROR] {error_msg}")
+                    yield "error", classify_status(
+                        response.status_code, response.text, response.headers
+                    )
                     return
 
-                for chunk in response.iter_lines():
-                    if chunk:
-                        chunk_str = chunk.decode("utf-8").strip()
-                        if chunk_str == "[DONE]":
-                            break
-                        if chunk_str.startswith("data:"):
-                            try:
-                                chunk_data = json.loads(chunk_str[5:])
-                                if chunk_data == " [DONE]":
-                                    break
-                                content = (
-                                    chunk_data.get("choices", [{}])[0]
-                                    .get("delta", {})
-                                    .get("content", "")
-                                )
-                                if content:
-                                    self.message_received.emit(content)
-                            except json.JSONDecodeError as e:
-                                print(
-                                    f"Agent_1 JSON解析错误: {e}, 原始数据: {chunk_str}"
-                                )
-        except requests.exceptions.RequestException as e:
-            self.message_received.emit(f"[ERROR] 请求异常: {str(e)}")
-
-        self.finished.emit(self.id)
+                parser = SSEParser()
+                for chunk in response.iter_content(chunk_size=None):
+                    if self._cancelled.is_set():
+                        return
+                    start = time.perf_counter()
+                    deltas = parser.feed(chunk)
+                    if self.trace is not None:
+                        self.trace.add("parse", time.perf_counter() - start)
+                    for delta in deltas:
+                        yield "delta", delta
+                    if parser.done:
+                        break
+                else:
+                    for delta in parser.close():
+                        yield "delta", delta
+                if parser.error:
+                    yield "error", ServerError(parser.error)
+                    return
+                yield "done", parser.done
+        except Exception as e:
+            # 取消时连接被关闭，读取线程会收到各种异常，此时直接丢弃
+            if self._cancelled.is_set():
+                return
+            if not isinstance(e, requests.exceptions.RequestException):
+                raise
+            yield "error", classify_exception(e)
+        finally:
+            self._response = None
 
 
 class MyChatAgent(ChatAgent):
     """自定义聊天代理，实现流式响应"""
 
-    def __init__(self, model, output_language="中文"):
+    def __init__(self, model, output_language="中文", hedge=None, fallback_model=None):
         super().__init__(model=model, output_language=output_language)
         self._model = model
-        self.result = []  # 记录流式响应结果
-        self.history = {}  # 记忆
-        self.prompt = ""  # 记录用户的问题
-
-    def _get_history(self, id: int) -> list:
-        """获取指定对话ID的历史记录，若无则初始化空列表"""
-        if id not in self.history:
-            self.history[id] = []
-        return self.history[id]
+        self.hedge = hedge  # 对冲请求配置，见 Model.HEDGE_CONFIG
+        self.fallback_model = fallback_model  # 备用模型，见 Model.create_fallback
+        self.result = {}  # 窗口id -> 流式响应结果，多个窗口可同时响应
+        self.memory = ConversationMemory(model)  # 按token预算管理的记忆
+        self.prompt = {}  # 窗口id -> 用户的问题
+        self.workers = {}  # 窗口id -> 进行中的StreamWorker
 
-    def stream_response(self, prompt, id: int, history_messages=None):
-        self.prompt = prompt
-        self.worker = StreamWorker(self._model, prompt, id, history_messages)
-        self.worker.message_received.connect(self.send_message)
-        self.worker.finished.connect(lambda: self.send_result(id))
-        self.worker.start()
+    def stream_response(self, prompt, id: int, history_messages=None, remember=True):
+        """
+        :param history_messages: 给出时使用这些历史消息，否则从记忆中获取
+        :param remember: 是否把这一轮问答写入记忆（图片的OCR路线借用文本模型，不写入）
+        """
+        self.cancel(id)  # 同一窗口的新提问抢占还未结束的旧请求
+        if remember:
+            self.prompt[id] = prompt
+        self.result[id] = []
+        worker = StreamWorker(
+            self._model,
+            prompt,
+            id,
+            history_messages,
+            memory=self.memory if history_messages is None else None,
+            hedge=self.hedge,
+            fallback_model=self.fallback_model,
+        )
+        worker.message_received.connect(partial(self.send_message, worker))
+        worker.finished.connect(partial(self.send_result, worker))
+        self.workers[id] = worker
+        worker.start()
 
     def receive_message(self, message, id: int):
         """接收消息并触发流式响应"""
         print(f"Agent_1开始处理:{message};来自页面{id}")
-        history = self._get_history(id)
-        self.stream_response(message, id, history)
+        self.stream_response(message, id)
+
+    def cancel(self, id: int):
+        """取消窗口id正在进行的请求，已产生的内容不计入历史记录"""
+        worker = self.workers.pop(id, None)
+        if worker is not None:
+            StreamEngine.instance().cancel(worker)
+            self.result.pop(id, None)
+            self.prompt.pop(id, None)
+
+    def send_message(self, worker, id: int, message):
+        """记录输出，并实时转发给对应窗口"""
+        if self.workers.get(id) is not worker:
+            return  # 已被取消或抢占的请求
+        self.result.setdefault(id, []).append(message)
+        Signals.instance().send_agent_stream(id, message)
 
-    def send_message(self, message):
-        """记录输出并打印"""
-        self.result.append(message)
-        print(message)
+    def send_result(self, worker, id: int):
+        if self.workers.get(id) is not worker:
+            return
+        self.workers.pop(id, None)
+        result = self.result.pop(id, [])
+        prompt = self.prompt.pop(id, None)  # 不写入记忆的请求没有记录问题
 
-    def send_result(self, id: int):
+        # 先更新历史记录（添加用户提问和AI回复），超出token预算时在后台压缩；
+        # 收到<EOS>后窗口可能立即发送下一个问题，此时历史必须已经包含这一轮
+        if result and prompt is not None:
+            self.memory.append(id, prompt, "".join(result))
         print(f"Agent_1 向ChatWindow(id={id})发送结果")
-        if id == 0:
-            Signals.instance().send_debug_agent_response(self.result)
-        elif id == 1:
-            Signals.instance().send_ai_response(self.result)
-        elif id == 3:
-            Signals.instance().send_rag_agent_response(self.result)
-
-        # 更新历史记录（添加用户提问和AI回复）
-        if self.result:
-            user_message = {
-                "role": "user",
-                "content": self.prompt,
-            }  # 需确保self.prompt可用
-            ai_message = {"role": "assistant", "content": "".join(self.result)}
-
-            history = self._get_history(id)
-            history.extend([user_message, ai_message])
-
-            # 限制历史记录长度（避免超出模型token限制）
-            max_history = 6  # 保留最近3轮对话
-            if len(history) > max_history:
-                history = history[-max_history:]
-            self.history[id] = history
-
-        self.result.clear()
+        Signals.instance().send_agent_stream(id, "<EOS>")
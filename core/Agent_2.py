@@ -2,7 +2,23 @@ from colorama import Fore
 from pydantic import BaseModel
 from .common import *
 import json
+import time
 from .Signals import Signals
+from .StreamEngine import EngineTask, StreamEngine
+from functools import partial
+from .ResponseCache import ResponseCache, make_key
+from .Resilience import LLMError, ParseError, call_with_retry, classify_exception
+from .SingleFlight import SingleFlight
+from .RateLimiter import PRIORITY_DEBUG, RateLimiter
+from .Agent_1 import StreamAttempt
+from .JSONStreamParser import JSONStreamParser
+from .JSONRepair import decode_json
+from .HttpClient import HttpClient
+from .TestRunner import TestRunner, normalize_language
+from .StaticCheck import StaticChecker
+import threading
+
+log = logging.getLogger(__name__)
 
 
 
@@ -19,67 +35,596 @@ class StructuredOutputSchema(BaseModel):
     test_cases: list[TestCase]
 
 
-class StructuredAgentThread(QThread):
-    result_ready = Signal(list, int)  # (result, id)
+# Debug页面支持的语言（小写）
+SUPPORTED_LANGUAGES = ("c++", "java", "python", "cpp", "c", "javascript", "c#")
+
+
+def is_supported_language(lang: str) -> bool:
+    return lang.strip().lower() in SUPPORTED_LANGUAGES
+
+
+def build_debug_prompt(question: str, code: str, lang: str) -> str:
+    """Debug页面和批量分析共用的提示词"""
+    return f"""
+我正在做如下{lang.strip().lower()}编程题：
+
+{question}
+
+以下是我写的代码：
+
+{code}
+
+请按以下四个方面分析并输出：
+1. 对题目的分析
+2. 我的错误代码的问题
+3. 正确的代码
+4. 两组测试数据（含输入、原代码输出和期望输出）
+"""
+
+
+def build_compile_error_prompt(question: str, code: str, lang: str, diagnostics: str) -> str:
+    """本地检查发现语法或编译错误时使用的较短的提示词，不需要模型自己找错误"""
+    return f"""
+以下{lang.strip().lower()}代码无法通过编译，编译器的报错为：
+
+{diagnostics}
+
+题目：
+{question}
+
+代码：
+{code}
+
+请分析题目，说明报错的原因，给出修正后的完整代码，以及两组测试数据（含输入、原代码输出和期望输出，原代码输出写“编译错误”）
+"""
+
+
+def prepare_debug_request(question: str, code: str, lang: str):
+    """
+    先在本地做语法检查，有错误时改用附带报错的较短提示词
+    :return: (提示词, 发现的错误（StaticCheck.CheckResult），没有错误或无法检查时为None)
+    """
+    check = StaticChecker.instance().check(code, lang)
+    if check is None or check.ok:
+        return build_debug_prompt(question, code, lang), None
+    return build_compile_error_prompt(question, code, lang, check.diagnostics), check
+
+
+def parse_structured_output(content) -> StructuredOutputSchema:
+    """
+    把模型输出解析为StructuredOutputSchema，失败时抛出ParseError
+    文本先经过 JSONRepair.decode_json（严格解析、去掉代码块标记、修复截断），再做pydantic校验
+    """
+    try:
+        if isinstance(content, dict):
+            return StructuredOutputSchema(**content)
+        value, stage = decode_json(content)
+        return StructuredOutputSchema(**value)
+    except Exception as e:
+        print("\n解析失败，请检查模型输出格式。")
+        print("错误信息：", e)
+        print("原始内容：", content)
+        raise ParseError(str(e)) from e
+
+
+# 流式请求不经过camel的response_format，在提问后附上输出格式的要求
+FORMAT_INSTRUCTION = """
+请只输出一个JSON对象，不要输出其他内容，字段依次为：
+problem_analysis（题目分析）、error_reason（错误原因）、correct_code（正确的完整代码）、
+test_cases（测试数据列表，每项含 input、origin_output、expected_output，均为字符串）
+"""
+
+
+def _stream_structured(model, message, on_field, trace, is_cancelled):
+    """
+    向model发送一次流式请求，每完成一个字段（test_cases中的每一项）就调用on_field
+    :return: (模型输出的全部内容, 解析出的JSON对象文本)；被取消时为None
+    :raises LLMError: 请求失败
+    """
+    data = {
+        **model.model_config_dict,
+        "model": str(model.model_type),
+        "messages": [{"role": "user", "content": message + FORMAT_INSTRUCTION}],
+        "stream": True,
+    }
+    if trace is not None:
+        trace.model = str(model.model_type)
+    attempt = StreamAttempt(model._url, model._api_key, data, trace)
+    parser = JSONStreamParser(item_keys=("test_cases",))
+    content = []
+    for kind, payload in attempt.iter_events():
+        if is_cancelled():
+            attempt.cancel()
+            return None
+        if kind == "delta":
+            if not payload.content:
+                continue
+            content.append(payload.content)
+            parse_start = time.perf_counter()
+            fields = parser.feed(payload.content)
+            if trace is not None:
+                trace.add("parse", time.perf_counter() - parse_start)
+            for key, index, value in fields:
+                if trace is not None:
+                    trace.mark("first_token")
+                on_field(key, index, value)
+        elif kind == "error":
+            raise payload
+        else:
+            break
+    return "".join(content), parser.document
+
+
+def analyze(
+    model,
+    message,
+    fallback_model=None,
+    wait=time.sleep,
+    trace=None,
+    on_wait=None,
+    is_cancelled=None,
+    on_field=None,
+    on_repair=None,
+):
+    """
+    获取结构化分析结果，先查回答缓存，未命中时按最高优先级等待限流许可后以流式请求调用模型（带重试和备用模型）
+    :param wait: 重试前的等待函数，返回True表示已取消
+    :param trace: 可选的RequestTrace，记录模型名、首个结果和解析用时
+    :param on_wait: 需要排队时以预计等待秒数调用，见 RateLimiter.acquire
+    :param is_cancelled: 返回True时放弃排队和读取
+    :param on_field: 可选，每完成一个字段调用 on_field(字段名, 元素序号, 值)，
+                     test_cases 逐项调用（元素序号从0开始），其余字段的元素序号为None；命中缓存时也会逐个调用
+    :param on_repair: 可选，本地无法修复输出、需要让模型重新输出JSON时调用
+    :return: 经过完整校验的StructuredOutputSchema
+    :raises LLMError: 模型调用失败、输出无法解析或被取消
+    """
+    is_cancelled = is_cancelled or (lambda: False)
+    on_field = on_field or (lambda key, index, value: None)
+    cache = ResponseCache.instance()
+    cache_key = make_key(
+        str(model.model_type),
+        {**model.model_config_dict, "response_format": "StructuredOutputSchema"},
+        [{"role": "user", "content": message}],
+    )
+    cached = cache.get(cache_key)
+    if cached is not None:
+        if trace is not None:
+            trace.model = "cache"
+            trace.mark("first_token")
+        parsed = parse_structured_output(cached[0])
+        for key, index, value in iter_fields(parsed):
+            on_field(key, index, value)
+        return parsed
+
+    # 相同的题目和代码同时提交时只向上游请求一次，其余请求共享领头请求的字段和结果
+    flight, leading = SingleFlight.instance().join(cache_key)
+    if not leading:
+        return _follow(flight, cache, cache_key, trace, is_cancelled, on_field)
+    left = False
+
+    def upstream_cancelled():
+        """本请求已取消，且没有其他请求在等待共享的结果"""
+        nonlocal left
+        if not is_cancelled():
+            return False
+        if not left:
+            flight.leave()
+            left = True
+        return not flight.has_subscribers()
+
+    def share_field(key, index, value):
+        flight.publish((key, index, value))
+        on_field(key, index, value)
+
+    complete = False
+    try:
+        parsed = _request_structured(
+            model,
+            message,
+            fallback_model,
+            wait,
+            trace,
+            on_wait,
+            upstream_cancelled,
+            share_field,
+            on_repair,
+        )
+        cache.put(cache_key, [parsed.model_dump_json()])
+        complete = True
+        return parsed
+    except Exception as e:
+        flight.publish(classify_exception(e))
+        raise
+    finally:
+        # 先写入缓存再结束，等待的请求从缓存中读取完整校验过的结果
+        SingleFlight.instance().done(flight, complete)
+
+
+def _follow(flight, cache, cache_key, trace, is_cancelled, on_field):
+    """合并到相同的进行中请求上：转发领头请求完成的字段，结束后从缓存读取结果"""
+    if trace is not None:
+        trace.model = "coalesced"
+    for event in flight.iter_chunks(is_cancelled):
+        if isinstance(event, LLMError):
+            raise event
+        if trace is not None:
+            trace.mark("first_token")
+        on_field(*event)
+    if is_cancelled():
+        flight.leave()
+        raise LLMError("请求已取消")
+    cached = cache.get(cache_key) if flight.complete else None
+    if cached is None:
+        raise LLMError("合并的相同请求未能完成")
+    return parse_structured_output(cached[0])
+
+
+def _request_structured(
+    model, message, fallback_model, wait, trace, on_wait, is_cancelled, on_field, on_repair
+):
+    """向上游请求结构化分析（限流、重试、备用模型、本地修复和让模型修正），参数同 analyze"""
+    limiter = RateLimiter.instance()
+    messages = [{"role": "user", "content": message + FORMAT_INSTRUCTION}]
+    estimated = limiter.estimate(messages)
+    if not limiter.acquire(estimated, PRIORITY_DEBUG, on_wait, is_cancelled):
+        raise LLMError("请求已取消")
+    actual = estimated
+    emitted = []  # 已交给on_field的字段，之后失败时不能透明地重试
+
+    def on_stream_field(key, index, value):
+        emitted.append(key)
+        on_field(key, index, value)
+
+    try:
+        result = call_with_retry(
+            lambda model: _stream_structured(model, message, on_stream_field, trace, is_cancelled),
+            [model, fallback_model],
+            wait=wait,
+            should_retry=lambda error: not emitted,
+        )
+        if result is None:
+            raise LLMError("请求已取消")
+        content, document = result
+        actual = limiter.estimate(messages + [{"role": "assistant", "content": content}], 0)
+    finally:
+        limiter.settle(estimated, actual)
+
+    # 增量解析只用于提前显示，最终结果仍经过pydantic的完整校验
+    parse_start = time.perf_counter()
+    try:
+        parsed = parse_structured_output(document or content)
+    except ParseError as e:
+        if on_repair is not None:
+            on_repair()
+        parsed = reask_fix(model, content, e, fallback_model, wait, is_cancelled)
+    if trace is not None:
+        trace.add("parse", time.perf_counter() - parse_start)
+    return parsed
+
+
+FIX_PROMPT = """下面的JSON无法使用（{error}），请修正格式、补全缺失的字段，只输出修正后的JSON：
+
+{content}"""
+
+
+def _fix_once(model, content, error):
+    """用最简短的提示词让model修正一次JSON，返回修正后的文本"""
+    config = model.model_config_dict
+    payload = {
+        "model": str(model.model_type),
+        "messages": [{"role": "user", "content": FIX_PROMPT.format(error=error, content=content)}],
+        "temperature": 0,
+    }
+    if "max_tokens" in config:
+        payload["max_tokens"] = config["max_tokens"]
+    response = HttpClient.instance().post_json(
+        f"{model._url}/v1/chat/completions",
+        payload,
+        headers={"Authorization": f"Bearer {model._api_key}"},
+    )
+    return response["choices"][0]["message"]["content"]
+
 
-    def __init__(self, model, message, id):
+def reask_fix(model, content, error, fallback_model=None, wait=time.sleep, is_cancelled=None):
+    """
+    本地无法修复时的最后一步：把原输出和错误交给模型修正并重新校验
+    修正JSON不需要推理，有备用模型（非推理模型，速度快）时先用备用模型
+    :raises LLMError: 调用失败、被取消或修正后仍无法解析
+    """
+    limiter = RateLimiter.instance()
+    messages = [{"role": "user", "content": FIX_PROMPT.format(error=error, content=content)}]
+    estimated = limiter.estimate(messages, limiter.estimate([{"role": "assistant", "content": content}], 0))
+    if not limiter.acquire(estimated, PRIORITY_DEBUG, is_cancelled=is_cancelled):
+        raise LLMError("请求已取消")
+    actual = estimated
+    try:
+        fixed = call_with_retry(
+            lambda model: _fix_once(model, content, error),
+            [fallback_model, model],
+            wait=wait,
+        )
+        actual = limiter.estimate(messages + [{"role": "assistant", "content": fixed}], 0)
+    finally:
+        limiter.settle(estimated, actual)
+    print("模型已重新输出JSON")
+    return parse_structured_output(fixed)
+
+
+def iter_fields(parsed: StructuredOutputSchema):
+    """按输出顺序产出 (字段名, 元素序号, 值)，与 analyze 的 on_field 参数相同"""
+    yield "problem_analysis", None, parsed.problem_analysis
+    yield "error_reason", None, parsed.error_reason
+    yield "correct_code", None, parsed.correct_code
+    for i, case in enumerate(parsed.test_cases):
+        yield "test_cases", i, case.model_dump()
+    yield "test_cases", None, [case.model_dump() for case in parsed.test_cases]
+
+
+def format_field(key, index, value) -> list[str]:
+    """把一个完成的字段排版成Debug窗口显示的Markdown分段，不显示的字段返回空列表"""
+    if key == "problem_analysis":
+        return [f"## 🧠 题目分析\n\n{value}\n", f"\n---\n"]
+    if key == "error_reason":
+        return [f"## ❌ 错误原因\n\n{value}\n", f"\n---\n"]
+    if key == "correct_code":
+        return [f"## ✅ 正确代码\n\n```python\n{value}\n```\n", f"\n---\n", f"## 📊 测试数据\n"]
+    if key == "test_cases" and index is not None and isinstance(value, dict):
+        return [
+            f"\n### 示例 {index + 1}\n",
+            f"- **输入：** `{value.get('input', '')}`\n",
+            f"- **原代码输出：** `{value.get('origin_output', '')}`\n",
+            f"- **期望输出：** `{value.get('expected_output', '')}`\n",
+        ]
+    return []
+
+
+def format_result(parsed: StructuredOutputSchema) -> list[str]:
+    """把结构化结果排版成Debug窗口显示的Markdown分段"""
+    result = []
+    for key, index, value in iter_fields(parsed):
+        result.extend(format_field(key, index, value))
+    return result
+
+
+RUN_STATUS_TEXT = {
+    "timeout": "超时",
+    "runtime_error": "运行出错",
+    "output_limit": "输出过多",
+    "not_run": "未运行",
+}
+
+
+def _describe_run(run) -> str:
+    if run.status == "ok":
+        return f"`{run.output.strip()}`"
+    return f"{RUN_STATUS_TEXT[run.status]}（{run.detail.splitlines()[-1] if run.detail else ''}）"
+
+
+def format_case_result(result) -> str:
+    """把一组测试的运行结果（TestRunner.CaseResult）排版成Markdown"""
+    mark = "✅" if result.fixed_passed else "❌"
+    lines = [f"\n### {mark} 示例 {result.index + 1}\n"]
+    if result.fixed_passed:
+        lines.append(f"- **修正后的代码：** 通过（{result.fixed.elapsed:.2f}s）\n")
+    else:
+        lines.append(f"- **修正后的代码：** 未通过，实际输出 {_describe_run(result.fixed)}\n")
+    consistent = "与分析一致" if result.original_as_described else "与分析不一致"
+    lines.append(f"- **原代码：** 实际输出 {_describe_run(result.original)}，{consistent}\n")
+    return "".join(lines)
+
+
+class TestRunWorker(QObject):
+    """在后台线程中用TestRunner运行测试数据，每完成一组就发出一段Markdown"""
+
+    section_ready = Signal(str)
+    finished = Signal()
+
+    def __init__(self, language, user_code, parsed: StructuredOutputSchema):
         super().__init__()
+        self.language = language
+        self.user_code = user_code
+        self.parsed = parsed
+        self.runner = TestRunner()
+
+    def start(self):
+        threading.Thread(target=self.run, name="TestRunWorker", daemon=True).start()
+
+    def cancel(self):
+        self.runner.cancel()
+
+    def run(self):
+        cases = [case.model_dump() for case in self.parsed.test_cases]
+        self.section_ready.emit(f"\n---\n## 🧪 本地运行测试\n")
+        try:
+            results = self.runner.run(
+                self.language,
+                self.user_code,
+                self.parsed.correct_code,
+                cases,
+                on_case=lambda result: self.section_ready.emit(format_case_result(result)),
+                on_compile_error=lambda program: self.section_ready.emit(
+                    f"\n{self._compile_label(program.label)}：\n```\n{program.error}\n```\n"
+                ),
+            )
+            passed = sum(result.fixed_passed for result in results)
+            if results:
+                summary = f"\n**修正后的代码通过了 {passed}/{len(cases)} 组测试**"
+                if passed < len(cases):
+                    summary += "，请谨慎参考上面的修正"
+                self.section_ready.emit(summary + "\n")
+        except Exception as e:
+            log.exception("运行测试失败")
+            self.section_ready.emit(f"\n运行测试失败: {e}\n")
+        self.finished.emit()
+
+    @staticmethod
+    def _compile_label(label) -> str:
+        return {"original": "原代码编译失败", "fixed": "修正后的代码编译失败"}.get(label, "无法运行测试")
+
+
+class StructuredAgentThread(EngineTask):
+    section_ready = Signal(str, int)  # (一个完成字段的Markdown, id)，边生成边显示
+    result_ready = Signal(list, int)  # (完整校验后的result, id)
+
+    def __init__(self, model, message, id, fallback_model=None):
+        super().__init__(window_id=id)
         self.model = model
+        self.fallback_model = fallback_model
         self.message = message
         self.id = id
+        self.submission = None  # (题目, 代码, 语言)，给出时先做本地检查，结果出来后本地运行测试数据
+        self.parsed = None  # 完整校验后的结果
+        self._shown = set()  # 已经显示的 (字段名, 元素序号)
 
-    def run(self):
-        result = []
-        print(f"[线程] Agent_2开始处理: {self.message}; 来自页面{self.id}")
-        agent = ChatAgent(model=self.model)
-        response = agent.step(self.message, response_format=StructuredOutputSchema)
-        content = response.msg.content
-        print("正在生成JSON文件\n")
-        print("正在解析...\n")
+    def _notify_wait(self, seconds):
+        Signals.instance().send_agent_status(self.id, f"请求排队中，预计等待{seconds:.0f}秒……")
 
-        parsed = None
-        try:
-            if isinstance(content, dict):
-                parsed = StructuredOutputSchema(**content)
-            else:
-                parsed = StructuredOutputSchema(**json.loads(content))
-        except Exception as e:
-            print("\n解析失败，请检查模型输出格式。")
-            print("错误信息：", e)
-            print("原始内容：", content)
-            return  # 不发信号，直接退出线程
+    def _on_repair(self):
+        self.section_ready.emit("\n\n*输出格式有误，正在让模型修正……*\n", self.id)
 
-        result.append(f"## 🧠 题目分析\n\n{parsed.problem_analysis}\n")
-        result.append(f"\n---\n")
-        result.append(f"## ❌ 错误原因\n\n{parsed.error_reason}\n")
-        result.append(f"\n---\n")
-        result.append(f"## ✅ 正确代码\n\n```python\n{parsed.correct_code}\n```\n")
-        result.append(f"\n---\n")
-        result.append(f"## 📊 测试数据\n")
+    def _on_field(self, key, index, value):
+        self._shown.add((key, index))
+        sections = format_field(key, index, value)
+        if sections and not self.is_cancelled():
+            self.section_ready.emit("".join(sections), self.id)
 
-        for i, case in enumerate(parsed.test_cases, 1):
-            result.append(f"\n### 示例 {i}\n")
-            result.append(f"- **输入：** `{case.input}`\n")
-            result.append(f"- **原代码输出：** `{case.origin_output}`\n")
-            result.append(f"- **期望输出：** `{case.expected_output}`\n")
+    def _static_check(self):
+        """
+        本地检查发现语法或编译错误时立即显示报错，并改用较短的提示词
+        :return: (提示词, 主模型, 备用模型)；编译错误不需要推理，有备用模型（非推理模型）时先用备用模型
+        """
+        if self.submission is None:
+            return self.message, self.model, self.fallback_model
+        message, check = prepare_debug_request(*self.submission)
+        if check is None:
+            return self.message, self.model, self.fallback_model
+        print(f"[线程] 本地检查（{check.tool}）发现错误")
+        self.section_ready.emit(
+            f"## ⚡ 本地检查发现错误（{check.tool}）\n\n```\n{check.diagnostics}\n```\n\n---\n", self.id
+        )
+        if self.fallback_model is None:
+            return message, self.model, None
+        return message, self.fallback_model, self.model
 
-        self.result_ready.emit(result, self.id)
+    def run(self):
+        print(f"[线程] Agent_2开始处理: {self.message}; 来自页面{self.id}")
+        message, model, fallback_model = self._static_check()
+        try:
+            parsed = analyze(
+                model,
+                message,
+                fallback_model,
+                wait=self.wait_cancelled,
+                trace=self.trace,
+                on_wait=self._notify_wait,
+                is_cancelled=self.is_cancelled,
+                on_field=self._on_field,
+                on_repair=self._on_repair,
+            )
+        except Exception as e:
+            if not self.is_cancelled():
+                print("分析失败：", e)
+                self.result_ready.emit([f"[ERROR] {e}"], self.id)
+            return
+        if self.is_cancelled():
+            return
+        # 流被截断或经过修复时，补上之前没能显示的字段
+        for key, index, value in iter_fields(parsed):
+            if (key, index) not in self._shown:
+                self._on_field(key, index, value)
+        self.parsed = parsed
+        self.result_ready.emit(format_result(parsed), self.id)
 
 
 class StructuredAgent:
-    def __init__(self, model):
+    def __init__(self, model, fallback_model=None):
         self.model = model
+        self.fallback_model = fallback_model
         self.result = []
         self.worker_thread = None
+        self.streamed = False  # 当前请求是否已有字段流式显示在窗口中
+        self.submission = None  # 下一次提问对应的 (题目, 代码, 语言)，见 set_submission
+        self.run_tests = False  # 是否在本机运行测试数据；没有沙箱，需要用户在界面中明确开启
+        self.test_worker = None
+
+    def set_submission(self, question: str, code: str, language: str):
+        """
+        记录下一次提问的题目、原代码和语言，用于先做本地语法检查，分析完成后在本地运行测试数据
+        不支持检查和运行的语言忽略
+        """
+        self.submission = (question, code, language) if normalize_language(language) else None
 
     def receive_message(self, message, id: int):
+        self.cancel()  # 新提问抢占还未结束的旧请求
         self.result = []
-        self.worker_thread = StructuredAgentThread(self.model, message, id)
-        self.worker_thread.result_ready.connect(self.send_result)
+        self.streamed = False
+        self.worker_thread = StructuredAgentThread(
+            self.model, message, id, self.fallback_model
+        )
+        self.worker_thread.submission, self.submission = self.submission, None
+        self.worker_thread.section_ready.connect(
+            partial(self._on_section_ready, self.worker_thread)
+        )
+        self.worker_thread.result_ready.connect(
+            partial(self._on_result_ready, self.worker_thread)
+        )
         self.worker_thread.start()
 
+    def cancel(self):
+        """取消正在进行的请求，收到下一段输出时停止读取，已产生的结果会被丢弃"""
+        if self.worker_thread is not None:
+            StreamEngine.instance().cancel(self.worker_thread)
+            self.worker_thread = None
+        if self.test_worker is not None:
+            self.test_worker.cancel()
+            self.test_worker = None
+
+    def _on_section_ready(self, worker, section: str, id: int):
+        if worker is not self.worker_thread:
+            return  # 已被取消或抢占的请求
+        self.streamed = True
+        Signals.instance().send_agent_stream(id, section)
+
+    def _on_result_ready(self, worker, result: list[str], id: int):
+        if worker is not self.worker_thread:
+            return  # 已被取消或抢占的请求
+        self.worker_thread = None
+        if not self.streamed:
+            self.send_result(result, id)
+            return
+        # 各字段已经流式显示过，只需补上最终校验失败的提示并结束
+        for item in result:
+            if str(item).startswith("[ERROR]"):
+                Signals.instance().send_agent_stream(id, f"\n\n{item}")
+        if worker.parsed is not None and worker.submission is not None and worker.parsed.test_cases:
+            if self.run_tests:
+                self._run_tests(worker, id)
+                return
+            Signals.instance().send_agent_stream(
+                id, "\n\n*未在本机运行测试数据，可在Debug窗口勾选“在本机运行测试数据”开启*\n"
+            )
+        Signals.instance().send_agent_stream(id, "<EOS>")
+
+    def _run_tests(self, worker, id: int):
+        """在本地运行测试数据，结果继续流式显示在同一条回答中，全部完成后结束回答"""
+        question, code, language = worker.submission
+        test_worker = TestRunWorker(language, code, worker.parsed)
+        test_worker.section_ready.connect(partial(self._on_test_section, test_worker, id))
+        test_worker.finished.connect(partial(self._on_tests_finished, test_worker, id))
+        self.test_worker = test_worker
+        test_worker.start()
+
+    def _on_test_section(self, test_worker, id: int, section: str):
+        if test_worker is self.test_worker:
+            Signals.instance().send_agent_stream(id, section)
+
+    def _on_tests_finished(self, test_worker, id: int):
+        if test_worker is self.test_worker:
+            self.test_worker = None
+            Signals.instance().send_agent_stream(id, "<EOS>")
+
     def send_result(self, result: list[str], id: int):
         print(f"[主线程] Agent_2 向ChatWindow(id={id})发送结果")
         self.result = result
         Signals.instance().send_debug_agent_response(self.result)
-        self.result.clear()
\ No newline at end of file
+        self.result.clear()
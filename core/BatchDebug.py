@@ -0,0 +1,211 @@
+"""
+批量Debug：不启动界面，对一批提交（题目、代码、语言）运行与Debug页面相同的提示词和结构化解析
+
+用法（在项目根目录执行）:
+    python -m core.BatchDebug submissions.jsonl results.jsonl --concurrency 4
+    python -m core.BatchDebug assignment1/ results.jsonl
+
+输入可以是:
+- JSONL文件，每行 {"id": ..., "problem": ..., "code": ..., "language": ...}，id缺省时使用行号
+- 目录，其中每个代码文件是一份提交（id为相对路径），语言由扩展名判断，
+  题目取自所在目录或上级目录中最近的 problem.txt / problem.md
+结果逐条追加写入输出文件（JSONL），重新运行时跳过已成功的提交，失败的会重试
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .Agent_2 import analyze, is_supported_language, prepare_debug_request
+from .Resilience import LLMError
+
+DEFAULT_CONCURRENCY = 4
+PROBLEM_FILES = ("problem.txt", "problem.md")
+EXTENSION_LANGUAGES = {
+    ".py": "python",
+    ".cpp": "c++",
+    ".cc": "c++",
+    ".cxx": "c++",
+    ".c": "c",
+    ".java": "java",
+    ".js": "javascript",
+    ".cs": "c#",
+}
+
+
+def _read_text(path) -> str:
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def load_jsonl(path) -> list:
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            records.append(
+                {
+                    "id": str(record.get("id", line_number)),
+                    "problem": record["problem"],
+                    "code": record["code"],
+                    "language": record["language"],
+                }
+            )
+    return records
+
+
+def load_directory(root) -> list:
+    records = []
+    problems = {}  # 目录 -> 该目录适用的题目
+
+    def problem_for(directory):
+        if directory not in problems:
+            problem = None
+            for name in PROBLEM_FILES:
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    problem = _read_text(path)
+                    break
+            parent = os.path.dirname(directory)
+            if problem is None and os.path.abspath(directory) != os.path.abspath(root):
+                problem = problem_for(parent)
+            problems[directory] = problem
+        return problems[directory]
+
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            language = EXTENSION_LANGUAGES.get(os.path.splitext(name)[1].lower())
+            if language is None:
+                continue
+            problem = problem_for(directory)
+            path = os.path.join(directory, name)
+            if problem is None:
+                print(f"跳过 {path}：找不到 {' / '.join(PROBLEM_FILES)}")
+                continue
+            records.append(
+                {
+                    "id": os.path.relpath(path, root).replace(os.sep, "/"),
+                    "problem": problem,
+                    "code": _read_text(path),
+                    "language": language,
+                }
+            )
+    return records
+
+
+def load_records(path) -> list:
+    if os.path.isdir(path):
+        return load_directory(path)
+    return load_jsonl(path)
+
+
+def load_finished(output_path) -> set:
+    """输出文件中已成功的提交id，用于断点续跑"""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 上次中断时写了一半的行
+            if result.get("status") == "ok":
+                finished.add(result["id"])
+    return finished
+
+
+class BatchDebug:
+    """用有限的并发对一批提交调用结构化分析，结果逐条写入JSONL"""
+
+    def __init__(self, model, fallback_model=None, concurrency=DEFAULT_CONCURRENCY):
+        self.model = model
+        self.fallback_model = fallback_model
+        self.concurrency = concurrency
+
+    def analyze_record(self, record) -> dict:
+        start = time.perf_counter()
+        result = {"id": record["id"], "language": record["language"]}
+        if not is_supported_language(record["language"]):
+            result.update(status="error", error=f"目前不支持debug {record['language']} 语言")
+        else:
+            # 任何一份提交出错都只记为失败，不能中断整批任务
+            try:
+                prompt, check = prepare_debug_request(record["problem"], record["code"], record["language"])
+                model, fallback_model = self.model, self.fallback_model
+                if check is not None:
+                    # 本地检查发现的编译错误不需要推理模型
+                    result["static_check"] = check.diagnostics
+                    if fallback_model is not None:
+                        model, fallback_model = fallback_model, model
+                parsed = analyze(model, prompt, fallback_model)
+                result.update(status="ok", result=parsed.model_dump())
+            except LLMError as e:
+                result.update(status="error", error=str(e))
+            except Exception as e:
+                result.update(status="error", error=f"{type(e).__name__}: {e}")
+        result["elapsed"] = round(time.perf_counter() - start, 3)
+        return result
+
+    def run(self, records, output_path, report_every=1):
+        """
+        :param report_every: 每完成多少条打印一次进度
+        :return: (成功数, 失败数)
+        """
+        finished = load_finished(output_path)
+        pending = [r for r in records if r["id"] not in finished]
+        print(f"共 {len(records)} 份提交，已完成 {len(records) - len(pending)} 份，本次处理 {len(pending)} 份")
+        if not pending:
+            return 0, 0
+
+        ok = failed = 0
+        start = time.perf_counter()
+        with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="BatchDebug"
+        ) as executor:
+            futures = [executor.submit(self.analyze_record, r) for r in pending]
+            for done, future in enumerate(as_completed(futures), 1):
+                result = future.result()
+                # 只在当前线程中写入，每条立即落盘，中断后可续跑
+                output.write(json.dumps(result, ensure_ascii=False) + "\n")
+                output.flush()
+                if result["status"] == "ok":
+                    ok += 1
+                else:
+                    failed += 1
+                    print(f"  {result['id']} 失败: {result['error']}")
+                if done % report_every == 0 or done == len(pending):
+                    elapsed = time.perf_counter() - start
+                    rate = done / elapsed if elapsed else 0.0
+                    eta = (len(pending) - done) / rate if rate else 0.0
+                    print(
+                        f"[{done}/{len(pending)}] 成功 {ok} 失败 {failed}  "
+                        f"{rate * 60:.1f} 份/分钟  预计剩余 {eta / 60:.1f} 分钟"
+                    )
+        return ok, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量Debug一批提交")
+    parser.add_argument("input", help="JSONL文件或提交所在的目录")
+    parser.add_argument("output", help="结果JSONL文件，已存在时断点续跑")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时进行的请求数")
+    parser.add_argument("--report-every", type=int, default=1, help="每完成多少份打印一次进度")
+    args = parser.parse_args(argv)
+
+    from .Model import FALLBACK_MODEL_TYPE, create_fallback, model
+
+    records = load_records(args.input)
+    batch = BatchDebug(model, create_fallback(model, FALLBACK_MODEL_TYPE), args.concurrency)
+    ok, failed = batch.run(records, args.output, args.report_every)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
 from .common import *
 from .Signals import Signals
+from .Metrics import Metrics
+from .RAG import build_rag_prompt
 import time
 import random
 from markdown import markdown
@@ -24,7 +26,7 @@ class ChatList(QTextEdit):
         )
 
         self.id = id
-        self.img_path = None  # 图片
+        self.img_path = None  # 图片路径，或截图窗口传来的内存中的图片（PixelBuffer）
         self.rag_query = None  # rag搜索结果
 
         # self.pending_code_block = None  # 未闭合的代码块缓存
@@ -32,6 +34,7 @@ class ChatList(QTextEdit):
         # 聊天状态控制
         self.waiting_for_ai = False  # AI是否正在响应
         self.has_typing_indicator = False  # 判断“思考中……”标签是否存在
+        self.typing_text = "思考中……"  # 等待提示的文字，限流排队时显示预计等待时间
         self.current_ai_response = False  # 判断是否是AI第一次响应
 
         self.setReadOnly(True)
@@ -40,6 +43,7 @@ class ChatList(QTextEdit):
         # 存储所有消息内容和当前AI响应内容
         self.all_messages = []  # 存储所有消息 {sender, content}
         self.current_ai_content = ""  # 当前AI响应累积的内容
+        self.sent_at = None  # 用户发送当前问题的时间，用于统计端到端延迟
 
         self._setup_html_template()
 
@@ -143,10 +147,10 @@ class ChatList(QTextEdit):
 
         # 添加思考中指示器（如果需要）
         if self.has_typing_indicator:
-            messages_html += """
+            messages_html += f"""
             <div class="message-container">
                 <div class="ai-message">
-                    思考中……<span class="typing-indicator">
+                    {self.typing_text}<span class="typing-indicator">
                         <span class="typing-dot"></span>
                         <span class="typing-dot"></span>
                         <span class="typing-dot"></span>
@@ -188,6 +192,7 @@ class ChatList(QTextEdit):
             return
 
         # 添加用户消息
+        self.sent_at = time.perf_counter()
         self._add_message("user", user_text)
 
         # 禁用输入
@@ -204,6 +209,7 @@ class ChatList(QTextEdit):
 
     def _show_typing_indicator(self):
         """显示'思考中……'"""
+        self.typing_text = "思考中……"
         self.has_typing_indicator = True
         self._update_chat_display()
 
@@ -225,11 +231,7 @@ class ChatList(QTextEdit):
             Signals.instance().send_message_to_image_agent(self.img_path, user_message)
         else:  # rag窗口
             # TODO:整合self.rag_query的查询结果
-            message = f"""
-                仅根据我提供的材料回答问题：
-                材料：{self.rag_query}
-                问题：{user_message}
-                """
+            message = build_rag_prompt(self.rag_query, user_message)
             print(message)
             Signals.instance().send_message_to_rag_agent(message)
 
@@ -242,10 +244,19 @@ class ChatList(QTextEdit):
         if content == "<EOS>":
             # 响应完成，添加完整的AI消息
             if self.current_ai_content:
-                self._add_message("ai", f"<markdown>{self.current_ai_content}")
+                self._timed_render(self._add_message, "ai", f"<markdown>{self.current_ai_content}")
+            if self.sent_at is not None:
+                Metrics.instance().observe(
+                    "end_to_end_seconds", time.perf_counter() - self.sent_at, self.id
+                )
+                self.sent_at = None
             self._enable_user_input()
 
         else:
+            if not self.current_ai_content and content and self.sent_at is not None:
+                Metrics.instance().observe(
+                    "ui_first_token_seconds", time.perf_counter() - self.sent_at, self.id
+                )
             # 累积AI响应内容
             self.current_ai_content += content
             # 更新显示（每次都会重新渲染整个AI消息）
@@ -255,7 +266,13 @@ class ChatList(QTextEdit):
                 temp_messages.append(
                     {"sender": "ai", "content": f"<markdown>{self.current_ai_content}"}
                 )
-                self._render_temp_messages(temp_messages)
+                self._timed_render(self._render_temp_messages, temp_messages)
+
+    def _timed_render(self, render, *args):
+        """渲染并记录用时"""
+        start = time.perf_counter()
+        render(*args)
+        Metrics.instance().observe("render_seconds", time.perf_counter() - start, self.id)
 
     def _render_temp_messages(self, messages):
         """临时渲染消息（用于流式更新）"""
@@ -282,10 +299,10 @@ class ChatList(QTextEdit):
                 """
 
         if self.has_typing_indicator:
-            messages_html += """
+            messages_html += f"""
             <div class="message-container">
                 <div class="ai-message">
-                    思考中……<span class="typing-indicator">
+                    {self.typing_text}<span class="typing-indicator">
                         <span class="typing-dot"></span>
                         <span class="typing-dot"></span>
                         <span class="typing-dot"></span>
@@ -316,9 +333,36 @@ class ChatList(QTextEdit):
             else:
                 break
 
-    def show_API_error(self):
-        # 在API错误时在聊天框中显示“API错误”的提醒
+    def stop_ai_response(self):
+        """停止等待AI回答，保留已经收到的内容"""
+        if self.waiting_for_ai:
+            self.update_ai_response("<EOS>")
+
+    def reset(self):
+        """清空聊天记录和等待状态"""
+        self.all_messages = []
+        self.current_ai_content = ""
+        self.sent_at = None
+        self.waiting_for_ai = False
+        self.has_typing_indicator = False
+        self.clear()
+
+    def receive_stream(self, id: int, content: str):
+        """接收流式回复，只处理发给本窗口的内容"""
+        if id != self.id or not self.waiting_for_ai:
+            return
+        self.update_ai_response(content)
+
+    def receive_status(self, id: int, text: str):
+        """在等待提示中显示请求状态（如限流排队的预计等待时间），只处理发给本窗口的内容"""
+        if id != self.id or not self.has_typing_indicator:
+            return
+        self.typing_text = text
+        self._update_chat_display()
+
+    def show_API_error(self, message="API错误"):
+        # 在API错误时在聊天框中显示错误提醒
         if self.has_typing_indicator:
             self._remove_typing_indicator()
         self._enable_user_input()
-        QMessageBox.warning(self, "警告", "API错误")
+        QMessageBox.warning(self, "警告", message)
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POOL_CONNECTIONS = 4  # 缓存的连接池个数（每个host一个）
+DEFAULT_POOL_MAXSIZE = 16  # 每个host最多保持的keep-alive连接数
+
+
+@dataclass
+class RequestStats:
+    """单次请求的连接统计"""
+
+    url: str
+    status_code: int
+    reused_connection: bool  # 是否复用了已有的keep-alive连接
+    time_to_headers: float  # 从发出请求到收到响应头的时间（秒）
+    finished_at: float
+
+
+class HttpClient:
+    """
+    所有agent共用的HTTP客户端，只有一个实例
+    复用keep-alive连接，避免每次提问都重新进行DNS、TCP和TLS握手
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "HttpClient":
+        with HttpClient._lock:
+            if HttpClient._instance is None:
+                HttpClient._instance = HttpClient()
+        return HttpClient._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "HttpClient":
+        """用指定参数重建共享实例，需在第一次请求前调用"""
+        with HttpClient._lock:
+            if HttpClient._instance is not None:
+                HttpClient._instance.close()
+            HttpClient._instance = HttpClient(**kwargs)
+        return HttpClient._instance
+
+    def __init__(
+        self,
+        pool_connections=DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        max_stats=200,
+    ):
+        """
+        :param pool_connections: 连接池个数
+        :param pool_maxsize: 每个连接池保持的最大连接数，应不小于同时进行的请求数
+        :param max_stats: 保留最近多少条请求统计
+        """
+        self.session = requests.Session()
+        self._adapter = HTTPAdapter(
+            pool_connections=pool_connections, pool_maxsize=pool_maxsize
+        )
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+
+        self.stats = deque(maxlen=max_stats)
+        self.total_requests = 0
+        self.reused_requests = 0
+        self._stats_lock = threading.Lock()
+
+    def preconnect(self, base_url, timeout=5):
+        """启动时预先建立连接，让第一次提问不用等待握手"""
+        start = time.perf_counter()
+        try:
+            self.session.head(base_url, timeout=timeout)
+            log.info(f"预连接 {base_url} 完成，用时 {time.perf_counter() - start:.3f}s")
+        except requests.exceptions.RequestException as e:
+            log.warning(f"预连接 {base_url} 失败: {e}")
+
+    def post(self, url, **kwargs) -> requests.Response:
+        """
+        发送POST请求，参数与 requests.post 相同
+        stream=True 时调用方需要负责关闭返回的response（可用with语句）
+        """
+        pool = self._adapter.poolmanager.connection_from_url(url)
+        connections_before = pool.num_connections
+
+        response = self.session.post(url, **kwargs)
+
+        # 请求期间连接池没有新建连接，说明复用了keep-alive连接（并发时为近似值）
+        reused = pool.num_connections == connections_before
+        self._record(
+            RequestStats(
+                url=url,
+                status_code=response.status_code,
+                reused_connection=reused,
+                time_to_headers=response.elapsed.total_seconds(),
+                finished_at=time.time(),
+            )
+        )
+        return response
+
+    def post_json(self, url, payload, headers=None, timeout=60) -> dict:
+        """发送非流式请求并返回解析后的JSON，状态码不是2xx时抛出 requests.HTTPError"""
+        with self.post(url, headers=headers, json=payload, timeout=timeout) as response:
+            response.raise_for_status()
+            return response.json()
+
+    def _record(self, stats: RequestStats):
+        with self._stats_lock:
+            self.stats.append(stats)
+            self.total_requests += 1
+            if stats.reused_connection:
+                self.reused_requests += 1
+        log.debug(
+            f"HTTP {stats.status_code} {stats.url} "
+            f"复用连接={stats.reused_connection} 首包={stats.time_to_headers:.3f}s"
+        )
+
+    def summary(self) -> dict:
+        """连接复用情况汇总"""
+        with self._stats_lock:
+            recent = list(self.stats)
+            total = self.total_requests
+            reused = self.reused_requests
+        avg = (
+            sum(s.time_to_headers for s in recent) / len(recent) if recent else 0.0
+        )
+        return {
+            "total_requests": total,
+            "reused_requests": reused,
+            "reuse_rate": reused / total if total else 0.0,
+            "avg_time_to_headers": avg,
+        }
+
+    def close(self):
+        self.session.close()
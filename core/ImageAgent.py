@@ -1,72 +1,262 @@
 from .common import *
 from PIL import Image
 from .Signals import Signals
+from .StreamEngine import EngineTask, StreamEngine
+from .Resilience import LLMError, call_with_retry
+from .RateLimiter import PRIORITY_IMAGE, RateLimiter
+from .Agent_1 import StreamAttempt
+from .ImagePrep import ImagePreprocessor, PreparedImage
+from .ImageCache import ImageCache
+from .OCR import TEXT_ROUTE, VISION_ROUTE, OCRRouter, build_ocr_prompt
+import time
+from functools import partial
 
 
-class ImageWorker(QThread):
-    result_ready = Signal(list)
+# 与camel的 output_language="中文" 相同的系统提示
+SYSTEM_PROMPT = "\nRegardless of the input language, you must output text in 中文."
 
-    def __init__(self, model, image, question):
-        super().__init__()
+
+def build_image_messages(prepared: PreparedImage, question: str) -> list:
+    """OpenAI兼容接口的图文消息，图片直接使用预处理后编码好的数据"""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {
+            "role": "user",
+            "content": [
+                {"type": "image_url", "image_url": {"url": prepared.data_url()}},
+                {"type": "text", "text": question},
+            ],
+        },
+    ]
+
+
+class ImageWorker(EngineTask):
+    message_received = Signal(int, str)  # (窗口id, 增量内容)
+    finished = Signal(int)
+    text_routed = Signal(str)  # 纯文字截图改由文本模型回答时发出，参数为拼好的提示词
+
+    def __init__(self, model, image, question, fallback_model=None, router=None, id=2):
+        """
+        :param image: 图片路径、编码后的图片数据（bytes/memoryview）、PixelBuffer或PIL.Image，在后台线程中预处理
+        :param router: OCRRouter，None表示总是使用视觉模型
+        :param id: 接收回答的窗口id
+        """
+        super().__init__(window_id=id)
         self.model = model
+        self.fallback_model = fallback_model
         self.image = image
         self.question = question
+        self.router = router
+        self.id = id
+        self.failed = False  # 是否以错误结束
+        self._attempt = None  # 进行中的流式请求，取消时立即关闭
+
+    def cancel(self):
+        """取消请求，并立即关闭正在读取的连接"""
+        super().cancel()
+        attempt = self._attempt
+        if attempt is not None:
+            attempt.cancel()
+
+    def _notify_wait(self, seconds):
+        Signals.instance().send_agent_status(self.id, f"请求排队中，预计等待{seconds:.0f}秒……")
+
+    def _emit_error(self, message):
+        self.failed = True
+        if not self.is_cancelled():
+            self.message_received.emit(self.id, f"[ERROR] {message}")
+
+    def _stream_once(self, model, messages, chunks):
+        """
+        向model发送一次流式请求，产出的内容追加到chunks并转发
+        :return: 是否完整结束
+        :raises LLMError: 请求失败
+        """
+        config = {k: v for k, v in model.model_config_dict.items() if k != "stream"}
+        data = {**config, "model": str(model.model_type), "messages": messages, "stream": True}
+        self.trace.model = str(model.model_type)
+        self._attempt = StreamAttempt(model._url, model._api_key, data, self.trace)
+        if self.is_cancelled():
+            return False  # 在创建请求前被取消，cancel() 没能关闭它
+        try:
+            for kind, payload in self._attempt.iter_events():
+                if self.is_cancelled():
+                    return False
+                if kind == "delta":
+                    if payload.content:
+                        self.trace.mark("first_token")
+                        self.trace.tokens += 1
+                        chunks.append(payload.content)
+                        self.message_received.emit(self.id, payload.content)
+                elif kind == "error":
+                    raise payload
+                else:
+                    return payload
+            return False
+        finally:
+            self._attempt = None
+
+    def _replay(self, cached) -> bool:
+        """转发缓存的回答，cached为 ImageCache.get 的返回值，未命中时返回False"""
+        if cached is None:
+            return False
+        content, distance, exact = cached
+        self.trace.model = "cache"
+        self.trace.mark("first_token")
+        note = "相同的图片" if exact else f"相似的图片（感知哈希相差{distance}位）"
+        print(f"图片结果缓存命中：{note}")
+        self.message_received.emit(self.id, f"{content}\n\n（{note}已回答过这个问题，以上为缓存的回答）")
+        return True
 
     def run(self):
-        chat_agent = ChatAgent(model=self.model, output_language="中文")
-        result = []
-
-        image_msg = BaseMessage(
-            role_name="assistant",
-            content=self.question,
-            image_list=[self.image],
-            meta_dict={},
-            role_type=RoleType.ASSISTANT,
-        )
-
-        response = chat_agent.step(image_msg)
-
-        if response and response.msgs:
-            print(response.msgs[0].content)
-            result.append(response.msgs[0].content)
+        try:
+            self._run()
+        finally:
+            self.finished.emit(self.id)
+
+    def _run(self):
+        self.trace.model = str(self.model.model_type)
+        preprocess_start = time.perf_counter()
+        try:
+            prepared = ImagePreprocessor.instance().prepare(self.image)
+        except (OSError, ValueError) as e:
+            print("图片读取失败：", e)
+            self._emit_error(f"无法读取图片: {e}")
+            return
+        self.trace.add("preprocess", time.perf_counter() - preprocess_start)
+
+        # 同一张图片（预处理后内容相同）问同样的问题时直接返回之前的回答
+        cache = ImageCache.instance()
+        model_name = str(self.model.model_type)
+        if self._replay(cache.get(model_name, self.question, prepared.phash, prepared.digest)):
+            return
+
+        # 纯文字截图先在本地OCR，交给更快的文本模型回答
+        if self.router is not None and self.router.enabled:
+            Signals.instance().send_agent_status(self.id, "识别图片中的文字……")
+            ocr_start = time.perf_counter()
+            decision = self.router.route(prepared)
+            self.trace.add("ocr", time.perf_counter() - ocr_start)
+            if decision.route == TEXT_ROUTE:
+                self.trace.model = "ocr"
+                print(f"识别为纯文字截图（置信度{decision.confidence:.0%}），交给文本模型回答")
+                self.text_routed.emit(build_ocr_prompt(decision.text, self.question))
+                return
+            # 只有几乎没有文字的图片才按感知哈希近似匹配，代码截图差一个字符就是另一个问题
+            if decision.text_free and cache.threshold and self._replay(
+                cache.get(model_name, self.question, prepared.phash, prepared.digest, similar=True)
+            ):
+                return
+            Signals.instance().send_agent_status(self.id, "思考中……")
+
+        messages = build_image_messages(prepared, self.question)
+
+        limiter = RateLimiter.instance()
+        text = [{"role": "user", "content": self.question}]
+        estimated = limiter.estimate(text) + prepared.vision_tokens
+        if not limiter.acquire(estimated, PRIORITY_IMAGE, self._notify_wait, self.is_cancelled):
+            return
+        chunks = []
+        try:
+            complete = call_with_retry(
+                lambda model: self._stream_once(model, messages, chunks),
+                [self.model, self.fallback_model],
+                wait=self.wait_cancelled,
+                should_retry=lambda error: not chunks,  # 已经输出了一部分时无法透明地重试
+            )
+        except LLMError as e:
+            print("模型调用失败：", e)
+            self._emit_error(e)
+            return
+        finally:
+            text.append({"role": "assistant", "content": "".join(chunks)})
+            limiter.settle(estimated, limiter.estimate(text, 0) + prepared.vision_tokens)
+        if self.is_cancelled():
+            return
+
+        if chunks:
+            if complete:
+                cache.put(model_name, self.question, prepared.phash, prepared.digest, "".join(chunks))
         else:
             print("未能获取到有效的回复。")
-            result.append("未能获取到有效的回复。")
-            if response and response.info:
-                print(response.info)
-                result.append(response.info)
-
-        self.result_ready.emit(result)
+            self.message_received.emit(self.id, "未能获取到有效的回复。")
 
 
 class ImageAgent:
     """图像识别"""
 
-    def __init__(self, _model):
+    def __init__(self, _model, fallback_model=None, text_agent=None):
+        """
+        :param text_agent: MyChatAgent，给出时纯文字截图经本地OCR后交给它回答（见 OCR.OCRRouter）
+        """
         self.model = _model
-        self.chat_agent = ChatAgent(model=self.model, output_language="中文")
-        self.result = []
+        self.fallback_model = fallback_model
+        self.text_agent = text_agent
+        self.worker = None
+        self.started = None  # 当前提问的开始时间，用于比较两条路线的用时
 
-    def change_model(self, new_model):
+    def change_model(self, new_model, fallback_model=None, text_agent=None):
         self.model = new_model
-        self.chat_agent = ChatAgent(model=self.model, output_language="中文")
-        self.result = []
+        self.fallback_model = fallback_model
+        self.text_agent = text_agent
 
     def image_analysis(self, image, question):
-        """image是Image解析后的形式"""
-        self.worker = ImageWorker(self.model, image, question)
-        self.worker.result_ready.connect(lambda x: self.send_result(x))
+        """image可以是图片路径、编码后的图片数据、PixelBuffer或PIL.Image，预处理在后台线程中进行"""
+        self.cancel()  # 新提问抢占还未结束的旧请求
+        router = OCRRouter.instance() if self.text_agent is not None else None
+        self.started = time.perf_counter()
+        self.worker = ImageWorker(self.model, image, question, self.fallback_model, router)
+        self.worker.message_received.connect(partial(self.send_message, self.worker))
+        self.worker.finished.connect(partial(self.send_result, self.worker))
+        self.worker.text_routed.connect(partial(self._on_text_routed, self.worker))
         self.worker.start()
 
     def receive_message(self, img, question):
         """从前端接收信息"""
-        print(f"ImageAgent开始处理:图片地址:{img};问题:{question}")
-        image = Image.open(img)
-        self.image_analysis(image, question)
+        source = img if isinstance(img, str) else f"内存中的图片{getattr(img, 'size', '')}"
+        print(f"ImageAgent开始处理:图片地址:{source};问题:{question}")
+        self.image_analysis(img, question)
 
-    def send_result(self, result):
+    def cancel(self):
+        """取消正在进行的请求，并立即关闭正在读取的连接"""
+        if self.worker is not None:
+            StreamEngine.instance().cancel(self.worker)
+            self.worker = None
+        if self.text_agent is not None:
+            self.text_agent.cancel(2)
+
+    def send_message(self, worker, id: int, message):
+        """实时转发给图片窗口"""
+        if worker is not self.worker:
+            return  # 已被取消或抢占的请求
+        Signals.instance().send_agent_stream(id, message)
+
+    def send_result(self, worker, id: int):
+        if worker is not self.worker:
+            return
+        self.worker = None
         print("ImageAgent向ChatWindow发送结果")
-        Signals.instance().send_image_agent_response(result)
+        Signals.instance().send_agent_stream(id, "<EOS>")
+        if worker.router is not None and worker.trace.model != "cache" and not worker.failed:
+            self._record_route(VISION_ROUTE)
+
+    def _on_text_routed(self, worker, prompt):
+        """在文本模型的窗口2中流式回答，不带对话历史，也不写入文本模型的记忆"""
+        if worker is not self.worker:
+            return
+        self.worker = None
+        self.text_agent.stream_response(prompt, 2, history_messages=[], remember=False)
+        text_worker = self.text_agent.workers[2]
+        text_worker.finished.connect(partial(self._on_text_finished, text_worker))
+
+    def _on_text_finished(self, text_worker, _id):
+        if not text_worker.is_cancelled():
+            self._record_route(TEXT_ROUTE)
+
+    def _record_route(self, route):
+        router = OCRRouter.instance()
+        router.record_latency(route, time.perf_counter() - self.started)
+        print(f"图片路由统计: {router.stats()}")
 
 
 # 用法示例:
@@ -0,0 +1,189 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# 缓存文件放在项目根目录的 cache/ 下
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(script_dir), "cache", "image_cache.sqlite")
+
+# 近似匹配：感知哈希（见 ImagePrep.perceptual_hash，共256位）的汉明距离不超过该值时视为同一张图片
+# 只改了一个运算符的代码截图哈希只差一两位，因此默认为0，只按内容摘要精确匹配；
+# 大于0时也只用于几乎没有文字的图片（由调用方判断），见 ImageAgent.ImageWorker
+DEFAULT_THRESHOLD = 0
+
+
+def normalize_question(question: str) -> str:
+    """忽略大小写、多余空白和句末标点，使措辞相同的问题得到相同的key"""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?？。.!！~ ")
+
+
+class ImageCache:
+    """
+    图片问答的结果缓存（SQLite），只有一个实例
+    按 (模型, 规范化后的问题) 查找，预处理后内容摘要相同的图片（重新截了一次、边缘多截了一点）直接返回之前的回答；
+    开启近似匹配时，没有文字的图片还可以按感知哈希的汉明距离匹配
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "ImageCache":
+        with ImageCache._lock:
+            if ImageCache._instance is None:
+                ImageCache._instance = ImageCache()
+        return ImageCache._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "ImageCache":
+        """用指定参数重建共享实例（如基准测试时使用临时文件）"""
+        with ImageCache._lock:
+            ImageCache._instance = ImageCache(**kwargs)
+        return ImageCache._instance
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        threshold=DEFAULT_THRESHOLD,
+        max_entries=1000,
+        max_bytes=10 * 1024 * 1024,
+        ttl=7 * 24 * 3600,
+    ):
+        """
+        :param path: SQLite文件路径
+        :param threshold: 近似匹配所需的最大汉明距离，0表示关闭近似匹配
+        :param max_entries: 最多保存的回答条数，超出时按最近最少使用淘汰
+        :param max_bytes: 所有回答的总大小上限（字节）
+        :param ttl: 回答的有效期（秒），过期后视为未命中
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS image_answers (
+                id INTEGER PRIMARY KEY,
+                model TEXT NOT NULL,
+                question TEXT NOT NULL,
+                phash TEXT NOT NULL,
+                digest TEXT NOT NULL DEFAULT '',
+                answer TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(image_answers)")}
+        if "digest" not in columns:
+            # 旧版本的缓存没有内容摘要，这些条目不会再命中，按容量和有效期自然淘汰
+            self._db.execute("ALTER TABLE image_answers ADD COLUMN digest TEXT NOT NULL DEFAULT ''")
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_image_question ON image_answers(model, question)"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_image_last_access ON image_answers(last_access)"
+        )
+        self._db.commit()
+
+    def get(self, model: str, question: str, phash: int, digest: str, similar=False):
+        """
+        :param digest: 预处理后图片的内容摘要（PreparedImage.digest），相同时精确命中
+        :param similar: 是否允许按感知哈希近似匹配，只应对没有文字的图片开启，且需要threshold大于0
+        :return: (回答, 汉明距离, 是否精确命中)，未命中时返回None
+        """
+        now = time.time()
+        best = None
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT id, phash, digest, answer FROM image_answers "
+                "WHERE model = ? AND question = ? AND created >= ?",
+                (model, normalize_question(question), now - self.ttl),
+            ).fetchall()
+            for row_id, stored, stored_digest, answer in rows:
+                if stored_digest == digest:
+                    best = (row_id, answer, 0, True)
+                    break
+                if not similar or not self.threshold:
+                    continue
+                distance = (int(stored, 16) ^ phash).bit_count()
+                if distance <= self.threshold and (best is None or distance < best[2]):
+                    best = (row_id, answer, distance, False)
+            if best is None:
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE image_answers SET last_access = ? WHERE id = ?", (now, best[0])
+            )
+            self._db.commit()
+            self.hits += 1
+        match = "内容相同" if best[3] else f"汉明距离{best[2]}"
+        log.info(f"图片结果缓存命中，{match} (命中 {self.hits} / 未命中 {self.misses})")
+        return best[1], best[2], best[3]
+
+    def put(self, model: str, question: str, phash: int, digest: str, answer: str):
+        """保存一次完整的回答，同一张图片相同的问题会替换旧的回答"""
+        size = len(answer.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        question = normalize_question(question)
+        with self._db_lock:
+            self._db.execute(
+                "DELETE FROM image_answers WHERE model = ? AND question = ? AND digest = ?",
+                (model, question, digest),
+            )
+            self._db.execute(
+                "INSERT INTO image_answers "
+                "(model, question, phash, digest, answer, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (model, question, format(phash, "x"), digest, answer, size, now, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        """删除过期条目，再按最近最少使用淘汰到条数和大小上限以内（调用方持有锁）"""
+        self._db.execute("DELETE FROM image_answers WHERE created < ?", (now - self.ttl,))
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM image_answers"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT id, size FROM image_answers ORDER BY last_access"
+        ).fetchall()
+        removed = []
+        for row_id, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            removed.append((row_id,))
+            count -= 1
+            total -= size
+        self._db.executemany("DELETE FROM image_answers WHERE id = ?", removed)
+        log.info(f"图片结果缓存淘汰了 {len(removed)} 条")
+
+    def stats(self) -> dict:
+        with self._db_lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM image_answers"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total}
+
+    def clear(self):
+        with self._db_lock:
+            self._db.execute("DELETE FROM image_answers")
+            self._db.commit()
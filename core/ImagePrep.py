@@ -0,0 +1,249 @@
+"""
+上传给视觉模型之前的图片预处理：去掉纯色边框、缩小到合适的尺寸、选择体积小的编码
+处理结果按图片内容的哈希缓存在内存中，同一张图片重复提问时直接复用编码好的数据
+"""
+
+import base64
+import hashlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from PIL import Image, ImageChops, ImageOps
+
+log = logging.getLogger(__name__)
+
+# Qwen2.5-VL 按 28x28 像素为一个视觉token（14像素的patch再2x2合并），边长取28的倍数可以避免服务端再次缩放
+PATCH_SIZE = 28
+MAX_DIMENSION = 1344  # 长边的最大像素数，代码截图在这个尺寸下仍然清晰
+CROP_TOLERANCE = 16  # 与边框颜色的差异不超过该值的像素视为边框
+CROP_PADDING = 8  # 裁剪后保留的边距
+PALETTE_COLORS = 256  # 颜色数不超过该值时（多为纯文字截图）另外尝试无损的调色板PNG
+JPEG_QUALITY = 85
+CACHE_BYTES = 64 * 1024 * 1024  # 缓存的编码数据总大小上限
+HASH_SIZE = 16  # 感知哈希的网格边长，共 HASH_SIZE * HASH_SIZE 位
+HASH_MARGIN = 4  # 相邻格子的亮度差超过该值才记为1，避免JPEG噪点使大片空白区域的位随机翻转
+
+
+@dataclass
+class PreparedImage:
+    key: str  # 原始内容的哈希
+    data: bytes  # 编码后的图片
+    mime: str
+    size: tuple  # 处理后的 (宽, 高)
+    original_size: tuple
+    original_bytes: int  # 原始数据（或像素）的字节数
+    phash: int = 0  # 处理后图片的感知哈希，用于查找近似图片的回答
+    digest: str = ""  # 处理后（去边框、缩放、编码后）图片的内容摘要，用于精确查找回答
+
+    @property
+    def vision_tokens(self) -> int:
+        """按Qwen2.5-VL的规则估计占用的视觉token数"""
+        return max(1, self.size[0] // PATCH_SIZE) * max(1, self.size[1] // PATCH_SIZE)
+
+    def data_url(self) -> str:
+        return f"data:{self.mime};base64,{base64.b64encode(self.data).decode('ascii')}"
+
+
+@dataclass
+class PixelBuffer:
+    """未编码的像素数据（如剪贴板中的QImage），预处理时直接读取这块内存，不复制也不写临时文件"""
+
+    data: memoryview
+    size: tuple  # (宽, 高)
+    stride: int  # 每行的字节数（可能含有对齐用的填充）
+    mode: str = "RGBA"
+    owner: object = None  # data所在内存的持有者（如QImage），预处理完成前必须保持存活
+
+
+def _load(source):
+    """
+    :param source: 图片路径、编码后的图片数据（bytes/bytearray/memoryview）、PixelBuffer或PIL.Image
+    :return: (哈希, PIL.Image, 原始字节数)
+    """
+    if isinstance(source, PixelBuffer):
+        digest = hashlib.sha256(f"{source.mode}{source.size}{source.stride}".encode("ascii"))
+        digest.update(source.data)
+        image = Image.frombuffer(
+            source.mode, source.size, source.data, "raw", source.mode, source.stride, 1
+        )
+        return digest.hexdigest(), image, source.data.nbytes
+    if isinstance(source, Image.Image):
+        pixels = source.tobytes()
+        digest = hashlib.sha256(f"{source.mode}{source.size}".encode("ascii"))
+        digest.update(pixels)
+        return digest.hexdigest(), source, len(pixels)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            source = f.read()
+    data = memoryview(source)
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return hashlib.sha256(data).hexdigest(), image, data.nbytes
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    """按EXIF方向摆正，透明部分铺上白色背景，统一为RGB"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def autocrop(image: Image.Image) -> Image.Image:
+    """去掉与左上角颜色相同的边框（截图时多截到的空白、窗口背景）"""
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    mask = ImageChops.difference(image, background).convert("L").point(
+        lambda value: 255 if value > CROP_TOLERANCE else 0
+    )
+    box = mask.getbbox()
+    if box is None:
+        return image  # 纯色图片
+    left, top, right, bottom = box
+    box = (
+        max(0, left - CROP_PADDING),
+        max(0, top - CROP_PADDING),
+        min(image.width, right + CROP_PADDING),
+        min(image.height, bottom + CROP_PADDING),
+    )
+    if box == (0, 0, image.width, image.height):
+        return image
+    return image.crop(box)
+
+
+def perceptual_hash(image: Image.Image, hash_size=HASH_SIZE) -> int:
+    """
+    差值哈希（dHash）：缩小为灰度网格后比较每行相邻格子的明暗
+    重新截图、边缘稍有不同或缩放不同的同一画面得到的哈希只相差少数几位
+    """
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1] + HASH_MARGIN)
+    return value
+
+
+def fit_size(width, height, max_dimension=MAX_DIMENSION) -> tuple:
+    """缩小到长边不超过max_dimension，边长取PATCH_SIZE的倍数（不放大）"""
+    scale = min(1.0, max_dimension / max(width, height))
+
+    def fit(length):
+        return max(PATCH_SIZE, int(length * scale) // PATCH_SIZE * PATCH_SIZE)
+
+    return fit(width), fit(height)
+
+
+def encode(image: Image.Image) -> tuple:
+    """
+    用JPEG编码；颜色少的图片（纯文字截图）另外尝试无损的调色板PNG，取体积较小的
+    :return: (编码后的数据, MIME类型)
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+    candidates = [(buffer.getvalue(), "image/jpeg")]
+    colors = image.getcolors(PALETTE_COLORS)
+    if colors is not None:
+        buffer = io.BytesIO()
+        image.quantize(colors=len(colors)).save(buffer, "PNG", optimize=True)
+        candidates.append((buffer.getvalue(), "image/png"))
+    return min(candidates, key=lambda candidate: len(candidate[0]))
+
+
+class ImagePreprocessor:
+    """图片预处理，只有一个实例，编码结果按内容哈希缓存（按总字节数淘汰最久未用的）"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "ImagePreprocessor":
+        with ImagePreprocessor._lock:
+            if ImagePreprocessor._instance is None:
+                ImagePreprocessor._instance = ImagePreprocessor()
+        return ImagePreprocessor._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "ImagePreprocessor":
+        """用指定参数重建共享实例"""
+        with ImagePreprocessor._lock:
+            ImagePreprocessor._instance = ImagePreprocessor(**kwargs)
+        return ImagePreprocessor._instance
+
+    def __init__(self, max_dimension=MAX_DIMENSION, crop=True, cache_bytes=CACHE_BYTES):
+        self.max_dimension = max_dimension
+        self.crop = crop
+        self.cache_bytes = cache_bytes
+        self._cache = OrderedDict()  # 哈希 -> PreparedImage
+        self._cached_bytes = 0
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_in = 0  # 处理过的原始数据总量
+        self.bytes_out = 0  # 编码后的数据总量
+
+    def prepare(self, source) -> PreparedImage:
+        """
+        :param source: 图片路径、编码后的图片数据（bytes/bytearray/memoryview）、PixelBuffer或PIL.Image
+        :raises OSError: 无法读取或解码图片
+        """
+        key, image, original_bytes = _load(source)
+        with self._cache_lock:
+            prepared = self._cache.get(key)
+            if prepared is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return prepared
+
+        original_size = image.size
+        image = _flatten(image)
+        if self.crop:
+            image = autocrop(image)
+        size = fit_size(image.width, image.height, self.max_dimension)
+        if size != image.size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        data, mime = encode(image)
+        prepared = PreparedImage(
+            key,
+            data,
+            mime,
+            image.size,
+            original_size,
+            original_bytes,
+            perceptual_hash(image),
+            hashlib.sha256(data).hexdigest(),
+        )
+        log.info(
+            f"图片预处理: {original_size[0]}x{original_size[1]} {original_bytes // 1024}KB -> "
+            f"{size[0]}x{size[1]} {mime} {len(data) // 1024}KB"
+        )
+
+        with self._cache_lock:
+            self.misses += 1
+            self.bytes_in += original_bytes
+            self.bytes_out += len(data)
+            if key not in self._cache:
+                self._cache[key] = prepared
+                self._cached_bytes += len(data)
+            while self._cached_bytes > self.cache_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted.data)
+        return prepared
+
+    def stats(self) -> dict:
+        with self._cache_lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "cached_images": len(self._cache),
+            }
@@ -0,0 +1,115 @@
+import json
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+# 只匹配包住整段文本的代码块（结尾的 ``` 可能因截断缺失），字符串值中的 ``` 不受影响
+_FENCE = re.compile(r"\A\s*```[A-Za-z0-9_-]*[ \t]*\n(.*?)(?:```\s*)?\Z", re.DOTALL)
+
+# 各阶段成功解析的次数，用于观察模型输出格式的稳定性
+STAGE_COUNTS = {"strict": 0, "fences": 0, "repaired": 0}
+
+
+def strip_code_fences(text: str) -> str:
+    """去掉包住整段文本的 ```json ... ``` 代码块标记，以及第一个 { 之前和最后一个 } 之后的说明文字"""
+    match = _FENCE.match(text)
+    if match:
+        text = match.group(1)
+    start = text.find("{")
+    end = text.rfind("}")
+    if start < 0:
+        return text.strip()
+    return text[start:end + 1] if end > start else text[start:]
+
+
+def _strip_trailing_comma(out: list):
+    i = len(out)
+    while i > 0 and out[i - 1] in " \t\r\n":
+        i -= 1
+    if i > 0 and out[i - 1] == ",":
+        del out[i - 1]
+
+
+def repair_json(text: str) -> str:
+    """
+    修复被截断或略有错误的JSON对象：
+    去掉 } 和 ] 前多余的逗号，闭合未结束的字符串、对象和数组，补全缺少值的字段
+    :return: 修复后的文本（不保证一定能解析）
+    """
+    start = text.find("{")
+    if start < 0:
+        return text
+    out = []
+    closers = []  # 尚未闭合的容器对应的结束符
+    in_string = False
+    escape = False
+    for c in text[start:]:
+        if in_string:
+            out.append(c)
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+            continue
+        if c in "}]":
+            _strip_trailing_comma(out)
+            out.append(closers.pop())  # 括号不匹配时按实际打开的容器闭合
+            if not closers:
+                break
+            continue
+        if c == '"':
+            in_string = True
+        elif c == "{":
+            closers.append("}")
+        elif c == "[":
+            closers.append("]")
+        out.append(c)
+
+    repaired = "".join(out)
+    if in_string:
+        if escape:
+            repaired = repaired[:-1]
+        repaired += '"'
+    repaired = repaired.rstrip()
+    if repaired.endswith(","):
+        repaired = repaired[:-1]
+    if repaired.endswith(":"):
+        repaired += " null"
+    elif closers and closers[-1] == "}" and re.search(r'[{,]\s*"(?:[^"\\]|\\.)*"$', repaired):
+        repaired += ": null"  # 只输出了字段名就被截断
+    return repaired + "".join(reversed(closers))
+
+
+def decode_json(text: str):
+    """
+    依次尝试：严格解析 -> 去掉代码块标记 -> 修复原文 -> 去掉代码块标记后修复
+    先修复原文，避免去掉标记或说明文字时误删了字符串值中的内容
+    :return: (解析结果, 成功的阶段 "strict" / "fences" / "repaired")
+    :raises ValueError: 所有阶段都失败，信息为最后一次的解析错误
+    """
+    try:
+        return json.loads(text), _count("strict")
+    except json.JSONDecodeError:
+        pass
+    stripped = strip_code_fences(text)
+    try:
+        return json.loads(stripped, strict=False), _count("fences")
+    except json.JSONDecodeError:
+        pass
+    try:
+        value = json.loads(repair_json(text), strict=False)
+    except json.JSONDecodeError:
+        try:
+            value = json.loads(repair_json(stripped), strict=False)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"JSON修复失败: {e}") from e
+    log.info("模型输出的JSON不完整或格式有误，已在本地修复")
+    return value, _count("repaired")
+
+
+def _count(stage: str) -> str:
+    STAGE_COUNTS[stage] += 1
+    return stage
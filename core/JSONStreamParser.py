@@ -0,0 +1,160 @@
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+_WHITESPACE = " \t\r\n"
+
+
+class JSONStreamParser:
+    """
+    增量解析模型逐段输出的JSON对象
+    每送入一段文本就报告其中新完成的顶层字段；item_keys 中的数组字段还会逐个报告已完成的元素
+    只对已完成的字段或元素调用 json.loads，扫描过的字符不会重复扫描
+    第一个 "{" 之前的内容（如 ```json 代码块标记）被忽略
+    与 JSONRepair.decode_json 一样允许字符串中出现未转义的换行和制表符（模型输出多行代码时常见）
+    """
+
+    def __init__(self, item_keys=()):
+        self.item_keys = set(item_keys)
+        self.document = None  # 顶层对象结束后为其完整文本
+        self._text = ""
+        self._pos = 0  # 下一个要扫描的字符
+        self._offset = -1  # 顶层对象在_text中的起始位置
+        self._stack = []  # 当前所在的容器："{" 或 "["
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._key = None  # 当前的顶层字段名
+        self._state = "key"  # 顶层对象中的状态：key / colon / value / after_value
+        self._value_start = None
+        self._item_index = 0
+        self._item_start = None
+
+    @property
+    def finished(self) -> bool:
+        return self.document is not None
+
+    def feed(self, text: str) -> list:
+        """
+        送入一段文本
+        :return: 新完成的 (字段名, 元素序号, 值) 列表；整个字段完成时元素序号为None
+        """
+        if self.finished or not text:
+            return []
+        self._text += text
+        events = []
+        text = self._text
+        for i in range(self._pos, len(text)):
+            self._scan(text, i, events)
+            if self.finished:
+                break
+        self._pos = len(text)
+        return events
+
+    def _scan(self, text, i, events):
+        c = text[i]
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif c == "\\":
+                self._escape = True
+            elif c == '"':
+                self._in_string = False
+                self._end_string(text, i, events)
+            return
+
+        if not self._stack:
+            if c == "{":
+                self._offset = i
+                self._stack.append(c)
+            return
+
+        depth = len(self._stack)
+        if depth == 1:
+            self._scan_top_level(text, i, c, events)
+            return
+
+        if depth == 2 and self._stack[1] == "[" and self._key in self.item_keys:
+            if self._item_start is None and c not in _WHITESPACE + ",]":
+                self._item_start = i
+            elif self._item_start is not None and c in ",]" and text[self._item_start] not in '{["':
+                self._emit_item(text[self._item_start:i], events)  # 数字等标量元素
+
+        if c == '"':
+            self._start_string(i)
+        elif c in "{[":
+            self._stack.append(c)
+        elif c in "}]":
+            self._stack.pop()
+            if len(self._stack) == 2 and self._item_start is not None:
+                self._emit_item(text[self._item_start:i + 1], events)
+            elif len(self._stack) == 1:
+                self._emit_field(text[self._value_start:i + 1], events)
+
+    def _scan_top_level(self, text, i, c, events):
+        if c in _WHITESPACE:
+            return
+        if self._state == "key":
+            if c == '"':
+                self._start_string(i)
+            elif c == "}":
+                self._close(text, i)
+        elif self._state == "colon":
+            if c == ":":
+                self._state = "value"
+                self._value_start = None
+        elif self._state == "value":
+            if self._value_start is None:
+                self._value_start = i
+                self._item_index = 0
+                self._item_start = None
+                if c == '"':
+                    self._start_string(i)
+                elif c in "{[":
+                    self._stack.append(c)
+            elif c in ",}":
+                self._emit_field(text[self._value_start:i], events)  # 数字、true等标量
+                self._after_value(text, i, c)
+        elif self._state == "after_value":
+            self._after_value(text, i, c)
+
+    def _after_value(self, text, i, c):
+        if c == ",":
+            self._state = "key"
+        elif c == "}":
+            self._close(text, i)
+
+    def _start_string(self, i):
+        self._in_string = True
+        self._string_start = i
+
+    def _end_string(self, text, i, events):
+        depth = len(self._stack)
+        if depth == 1 and self._state == "key":
+            self._key = json.loads(text[self._string_start:i + 1], strict=False)
+            self._state = "colon"
+        elif depth == 1 and self._state == "value":
+            self._emit_field(text[self._value_start:i + 1], events)
+        elif depth == 2 and self._item_start == self._string_start and self._key in self.item_keys:
+            self._emit_item(text[self._item_start:i + 1], events)
+
+    def _emit_field(self, raw, events):
+        self._state = "after_value"
+        try:
+            events.append((self._key, None, json.loads(raw, strict=False)))
+        except json.JSONDecodeError as e:
+            log.warning(f"字段 {self._key} 无法解析: {e}")
+
+    def _emit_item(self, raw, events):
+        self._item_start = None
+        index = self._item_index
+        self._item_index += 1
+        try:
+            events.append((self._key, index, json.loads(raw, strict=False)))
+        except json.JSONDecodeError as e:
+            log.warning(f"字段 {self._key} 的第{index + 1}个元素无法解析: {e}")
+
+    def _close(self, text, i):
+        self._stack.pop()
+        self.document = text[self._offset:i + 1]
@@ -4,27 +4,51 @@ from .Signals import Signals
 from .ChatWindow import ChatList
 from .FontSetting import set_font
 from .Agent_1 import MyChatAgent
-from .Agent_2 import StructuredAgent
+from .Agent_2 import StructuredAgent, build_debug_prompt, is_supported_language
 from .ImageAgent import ImageAgent
-from .Model import model, vision_model
+from .Screenshot import RegionCapture, Screenshot
+from PySide6.QtGui import QKeySequence, QShortcut
+from .Model import (
+    model,
+    vision_model,
+    HEDGE_CONFIG,
+    FALLBACK_MODEL_TYPE,
+    FALLBACK_VISION_MODEL_TYPE,
+    create_fallback,
+)
 from functools import partial
 from core.api_saver import ApiKeySaver
 from .RAG import RAGStorage
+from .HttpClient import HttpClient
+from .StreamEngine import StreamEngine
+from .Metrics import Metrics, PROMETHEUS_PORT
+from .SemanticCache import SemanticCache
 import tkinter as tk
 from tkinter import filedialog
 import re
 
 log = logging.getLogger(__name__)
 
+CAPTURE_HOTKEY = "Ctrl+Alt+A"  # 框选截图后直接提问的快捷键（本程序的窗口处于活动状态时有效）
+CAPTURE_QUESTION = "请分析截图中的内容，如果有代码或报错，指出问题并给出修改方法。"  # 图片页面没有输入问题时使用
+
 
 class AgentInitializer(QThread):
     agents_ready = Signal(object, object, object, object)  # chat_agent, image_agent
 
     def run(self):
         # 在子线程中执行耗时初始化
-        chat_agent = MyChatAgent(model=model)
-        structured_agent = StructuredAgent(model=model)
-        image_agent = ImageAgent(vision_model)
+        HttpClient.instance().preconnect(model._url)  # 提前建立keep-alive连接
+        fallback_model = create_fallback(model, FALLBACK_MODEL_TYPE)
+        chat_agent = MyChatAgent(
+            model=model, hedge=HEDGE_CONFIG, fallback_model=fallback_model
+        )
+        structured_agent = StructuredAgent(model=model, fallback_model=fallback_model)
+        image_agent = ImageAgent(
+            vision_model,
+            create_fallback(vision_model, FALLBACK_VISION_MODEL_TYPE),
+            text_agent=chat_agent,
+        )
         rag_storage = RAGStorage(similarity_threshold=0.6, top_k=1)
         self.agents_ready.emit(chat_agent, structured_agent, image_agent, rag_storage)
 
@@ -58,19 +82,45 @@ class MainWindow(QMainWindow):
         self.structured_agent = None
         self.image_agent = None
         self.rag_storage = None
+        self.captured_image = None  # 截图窗口传来的图片（PixelBuffer），优先于图片路径
+        self.run_tests_locally = False  # 是否在本机运行Debug给出的测试数据（没有沙箱，默认关闭）
+        self.screenshot_window = None
+
+        # 快捷键框选截图，截图在内存中直接发给ImageAgent
+        self.region_capture = RegionCapture()
+        self.region_capture.captured.connect(self.on_region_captured)
+        self.region_capture.cancelled.connect(self.showNormal)
+        capture_shortcut = QShortcut(QKeySequence(CAPTURE_HOTKEY), self)
+        capture_shortcut.setContext(Qt.ShortcutContext.ApplicationShortcut)
+        capture_shortcut.activated.connect(self.start_region_capture)
 
         # 初始化界面结构
         self.setup_ui_structure()
 
+        # 退出时取消所有进行中的请求
+        app.aboutToQuit.connect(StreamEngine.instance().shutdown)
+        # 退出时写出最终的延迟指标
+        app.aboutToQuit.connect(Metrics.instance().shutdown)
+        if PROMETHEUS_PORT:
+            Metrics.instance().serve(PROMETHEUS_PORT)
+
         # 启动异步 agent 加载线程
         self.agent_loader = AgentInitializer()
         self.agent_loader.agents_ready.connect(self.on_agents_ready)
         self.agent_loader.start()
 
     def refresh(self, _model, _vision_model):
-        self.chat_agent = MyChatAgent(_model)
-        self.structured_agent = StructuredAgent(model=model)
-        self.image_agent = ImageAgent(_vision_model)
+        fallback_model = create_fallback(_model, FALLBACK_MODEL_TYPE)
+        self.chat_agent = MyChatAgent(
+            _model, hedge=HEDGE_CONFIG, fallback_model=fallback_model
+        )
+        self.structured_agent = StructuredAgent(model=_model, fallback_model=fallback_model)
+        self.structured_agent.run_tests = self.run_tests_locally
+        self.image_agent = ImageAgent(
+            _vision_model,
+            create_fallback(_vision_model, FALLBACK_VISION_MODEL_TYPE),
+            text_agent=self.chat_agent,
+        )
         # 断开已有信号连接
         try:
             Signals.instance().to_chat_agent_signal.disconnect()
@@ -112,6 +162,7 @@ class MainWindow(QMainWindow):
     ):
         self.chat_agent = chat_agent
         self.structured_agent = structured_agent
+        self.structured_agent.run_tests = self.run_tests_locally
         self.image_agent = image_agent
         self.rag_storage = rag_storage
 
@@ -170,6 +221,12 @@ class MainWindow(QMainWindow):
         self.top_bar.setContentsMargins(10, 10, 20, 0)
         self.top_bar.addStretch()
 
+        self.stop_button = QPushButton("停止生成")
+        self.stop_button.setFixedHeight(28)
+        self.stop_button.setStyleSheet("QPushButton { padding: 4px 12px; }")
+        self.stop_button.clicked.connect(self.stop_current_response)
+        self.top_bar.addWidget(self.stop_button)
+
         self.api_saver_button = QPushButton("设置API密钥")
         self.api_saver_button.setFixedHeight(28)
         self.api_saver_button.setStyleSheet("QPushButton { padding: 4px 12px; }")
@@ -347,9 +404,41 @@ class MainWindow(QMainWindow):
         send_btn.clicked.connect(
             partial(self.send_structured_message, input_box, chat_list)
         )
-        layout.addWidget(send_btn, alignment=Qt.AlignmentFlag.AlignRight)
+
+        # 本机运行测试数据的开关，没有沙箱，默认关闭
+        run_tests_box = QCheckBox("在本机运行测试数据（无沙箱）")
+        set_font(run_tests_box)
+        run_tests_box.setToolTip(
+            "分析完成后在本机编译、运行原代码和修正后的代码，检验模型给出的测试数据。\n"
+            "只限制了运行时间和内存，代码以你的权限运行，可以读写文件、访问网络，请只对可信的代码开启。"
+        )
+        run_tests_box.toggled.connect(partial(self.set_run_tests, run_tests_box))
+
+        bottom_layout = QHBoxLayout()
+        layout.addLayout(bottom_layout)
+        bottom_layout.addWidget(run_tests_box)
+        bottom_layout.addStretch()
+        bottom_layout.addWidget(send_btn)
         return chat_widget, input_box, chat_list
 
+    def set_run_tests(self, checkbox, checked):
+        """开启本机运行测试数据前提示没有沙箱，需要用户确认"""
+        if checked and not self.run_tests_locally:
+            reply = QMessageBox.warning(
+                self,
+                "在本机运行测试数据",
+                "测试代码将直接在本机运行，没有沙箱隔离，只限制了运行时间和内存，"
+                "可以读写文件、访问网络。\n\n确定只对可信的代码开启吗？",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                QMessageBox.StandardButton.No,
+            )
+            if reply != QMessageBox.StandardButton.Yes:
+                checkbox.setChecked(False)
+                return
+        self.run_tests_locally = checked
+        if self.structured_agent is not None:
+            self.structured_agent.run_tests = checked
+
     def create_chat_window(self):
         chat_widget = QWidget()
         layout = QVBoxLayout()
@@ -514,6 +603,7 @@ class MainWindow(QMainWindow):
 				}"""
         )
         self.img_path_edit.setPlaceholderText("请选择图片路径")
+        self.img_path_edit.textEdited.connect(self.clear_captured_image)
         set_font(self.img_path_edit)
         bottom_layout.addWidget(self.img_path_edit)
 
@@ -541,6 +631,13 @@ class MainWindow(QMainWindow):
         img_btn.clicked.connect(self.select_img_path)
         bottom_layout.addWidget(img_btn)
 
+        screenshot_btn = QPushButton("截图")
+        screenshot_btn.setFixedSize(80, 35)
+        screenshot_btn.setStyleSheet(img_btn.styleSheet())
+        set_font(screenshot_btn)
+        screenshot_btn.clicked.connect(self.open_screenshot)
+        bottom_layout.addWidget(screenshot_btn)
+
         send_btn = QPushButton("发送")
         send_btn.setFixedSize(100, 30)
         set_font(send_btn)
@@ -588,8 +685,43 @@ class MainWindow(QMainWindow):
                 filetypes=[("图片文件", "*.jpg *.jpeg *.png *.bmp")],
             )
         if file_path:
+            self.clear_captured_image()
             self.img_path_edit.setText(file_path)
 
+    def open_screenshot(self):
+        """打开截图窗口，剪贴板中的截图直接在内存中交给ImageAgent"""
+        self.screenshot_window = Screenshot()
+        self.screenshot_window.image_signal.connect(self.set_captured_image)
+        self.screenshot_window.show()
+
+    def set_captured_image(self, buffer):
+        self.captured_image = buffer
+        self.img_path_edit.setText(f"[剪贴板截图 {buffer.size[0]}x{buffer.size[1]}]")
+
+    def clear_captured_image(self, *args):
+        """改为使用图片路径"""
+        self.captured_image = None
+
+    def start_region_capture(self):
+        """隐藏主窗口后框选截图"""
+        self.hide()
+        QTimer.singleShot(200, self.region_capture.start)  # 等窗口从屏幕上消失
+
+    def on_region_captured(self, buffer):
+        """跳转到图片页面，用输入框中的问题（没有时用默认问题）直接提问"""
+        self.showNormal()
+        self.activateWindow()
+        name = "ChattingWindow3"
+        chat_list = self.chat_lists[name]
+        input_box = self.chat_inputs[name]
+        question = input_box.toPlainText().strip() if self.current_page_name() == name else ""
+        self.navigate_to(name, self.main_stack)
+        self.set_captured_image(buffer)
+        if chat_list.waiting_for_ai or self.image_agent is None:
+            return  # 上一个回答还没结束或agent还在加载，只保存截图
+        input_box.setPlainText(question or CAPTURE_QUESTION)
+        self.send_message(input_box, chat_list)
+
     def create_rag_window(self):
         chat_widget = QWidget()
         layout = QVBoxLayout()
@@ -657,6 +789,19 @@ class MainWindow(QMainWindow):
         bottom_layout.setSpacing(0)
         layout.addLayout(bottom_layout)
 
+        # 本窗口的语义缓存开关，默认关闭，关闭时清空已保存的回答
+        semantic_box = QCheckBox("相似问题复用回答")
+        set_font(semantic_box)
+        semantic_box.setToolTip(
+            "新对话的第一个问题与之前的问题足够相似（代码部分完全相同）时，直接显示之前的回答，不再调用API。\n"
+            "取消勾选会清空本窗口保存的回答。"
+        )
+        semantic_box.setChecked(SemanticCache.instance().is_enabled(chat_list.id))
+        semantic_box.toggled.connect(
+            lambda checked: SemanticCache.instance().set_enabled(chat_list.id, checked)
+        )
+        bottom_layout.addWidget(semantic_box)
+
         spacer = QSpacerItem(0, 0, QSizePolicy.Expanding, QSizePolicy.Minimum)
         bottom_layout.addItem(spacer)
 
@@ -750,16 +895,21 @@ class MainWindow(QMainWindow):
 
         # 页面3
         self.chatting_window_3, input_box3, chat_list3 = self.create_image_window()
-        self.chat_inputs["ChattingWindow1"] = input_box3
-        self.chat_lists["ChattingWindow1"] = chat_list3
+        self.chat_inputs["ChattingWindow3"] = input_box3
+        self.chat_lists["ChattingWindow3"] = chat_list3
         self.add_page(self.main_stack, self.chatting_window_3, "ChattingWindow3")
 
         # 页面4
         self.chatting_window_4, input_box4, chat_list4 = self.create_rag_window()
-        self.chat_inputs["ChattingWindow2"] = input_box4
-        self.chat_lists["ChattingWindow2"] = chat_list4
+        self.chat_inputs["ChattingWindow4"] = input_box4
+        self.chat_lists["ChattingWindow4"] = chat_list4
         self.add_page(self.main_stack, self.chatting_window_4, "ChattingWindow4")
 
+        # 流式回复按窗口id分发给各页面
+        for chat_list in (chat_list1, chat_list2, chat_list3, chat_list4):
+            Signals.instance().agent_stream_signal.connect(chat_list.receive_stream)
+            Signals.instance().agent_status_signal.connect(chat_list.receive_status)
+
     def add_page(self, stack: QStackedWidget, widget: QWidget, name: str):
         """ "
         向 stack 中添加页面
@@ -778,12 +928,19 @@ class MainWindow(QMainWindow):
                 # 重复点击，不切换，不清空
                 return
 
+            # 离开的页面停止生成，回来时会被清空，继续生成没有意义
+            current_name = self.current_page_name()
+            if current_name in self.chat_lists:
+                self.cancel_window(self.chat_lists[current_name].id)
+                self.chat_lists[current_name].stop_ai_response()
+
             # 切换页面
             stack.setCurrentIndex(target_index)
 
-            # 清空聊天内容
+            # 清空聊天内容，并取消该页面还在进行的请求
             if name in self.chat_lists:
-                self.chat_lists[name].clear()  # 调用 QListWidget 的 clear 方法
+                self.cancel_window(self.chat_lists[name].id)
+                self.chat_lists[name].reset()
             if name in self.chat_inputs:
                 if isinstance(self.chat_inputs[name], tuple):
                     for box in self.chat_inputs[name]:
@@ -793,6 +950,39 @@ class MainWindow(QMainWindow):
         else:
             print(f"MainWindow @ navigate_to: 错误：未知页面 {name}!")
 
+    def current_page_name(self):
+        """当前显示页面的名称"""
+        for name, index in self.main_stack_map.items():
+            if index == self.main_stack.currentIndex():
+                return name
+        return None
+
+    def cancel_window(self, id: int):
+        """取消窗口id正在进行的AI请求，关闭连接并丢弃之后的输出"""
+        if id == 0:
+            if self.structured_agent is not None:
+                self.structured_agent.cancel()
+        elif id == 2:
+            if self.image_agent is not None:
+                self.image_agent.cancel()
+        elif self.chat_agent is not None:
+            self.chat_agent.cancel(id)
+
+    def stop_current_response(self):
+        """停止当前页面正在生成的回答"""
+        name = self.current_page_name()
+        if name in self.chat_lists:
+            log.info(f"用户停止了{name}的回答")
+            self.cancel_window(self.chat_lists[name].id)
+            self.chat_lists[name].stop_ai_response()
+
+    def closeEvent(self, event: QCloseEvent):
+        """关闭窗口时取消所有进行中的请求"""
+        for chat_list in self.chat_lists.values():
+            self.cancel_window(chat_list.id)
+            chat_list.stop_ai_response()
+        super().closeEvent(event)
+
     def setup_sidebar_animation(self) -> None:
         """侧边栏展开动画设置"""
         self.animations["sidebar"] = QPropertyAnimation(self.sidebar, b"maximumWidth")
@@ -858,7 +1048,10 @@ class MainWindow(QMainWindow):
         # print("in send_message!")
         text = input_box.toPlainText().strip()
         if chat_list.id == 2:
-            chat_list.img_path = self.img_path_edit.text()
+            if self.captured_image is not None:
+                chat_list.img_path = self.captured_image
+            else:
+                chat_list.img_path = self.img_path_edit.text()
         if text:
             text = self.filter_sensitive_words(text)
             input_box.clear()
@@ -866,8 +1059,10 @@ class MainWindow(QMainWindow):
                 if chat_list.id == 3:
                     chat_list.rag_query = self.rag_storage.query(text)
                 chat_list.receive_message(text)
-            except:
-                chat_list.show_API_error()
+            except Exception as e:
+                # 模型调用的错误在后台线程中处理，这里只会是检索、读图等本地错误
+                log.exception(f"窗口{chat_list.id}发送消息失败")
+                chat_list.show_API_error(f"发送失败: {e}")
                 return
 
     def send_structured_message(self, input_box: tuple, chat_list: ChatList):
@@ -877,37 +1072,17 @@ class MainWindow(QMainWindow):
         if question and code and lang:
             input_box[0].clear()
             input_box[1].clear()
-            lang = lang.lower()
-            if not (
-                lang == "c++"
-                or lang == "java"
-                or lang == "python"
-                or lang == "cpp"
-                or lang == "c"
-                or lang == "javascript"
-                or lang == "c#"
-            ):
+            if not is_supported_language(lang):
                 chat_list.get_ai_response(
-                    data_list=["目前", "不", "支持", "debug", f"{lang}", "语言"]
+                    data_list=["目前", "不", "支持", "debug", f"{lang.lower()}", "语言"]
                 )
                 return
-            prompt = f"""
-我正在做如下{lang}编程题：
-
-{question}
-
-以下是我写的代码：
-
-{code}
-
-请按以下四个方面分析并输出：
-1. 对题目的分析
-2. 我的错误代码的问题
-3. 正确的代码
-4. 两组测试数据（含输入、原代码输出和期望输出）
-"""
+            prompt = build_debug_prompt(question, code, lang)
+            if self.structured_agent is not None and not chat_list.waiting_for_ai:
+                self.structured_agent.set_submission(question, code, lang)  # 本地检查和运行测试数据
             try:
                 chat_list.receive_message(prompt)
-            except:
-                chat_list.show_API_error()
+            except Exception as e:
+                log.exception("Debug窗口发送消息失败")
+                chat_list.show_API_error(f"发送失败: {e}")
                 return
@@ -0,0 +1,207 @@
+import itertools
+import logging
+import os
+import re
+import threading
+
+import requests
+
+from .HttpClient import HttpClient
+from .RateLimiter import PRIORITY_BACKGROUND, RateLimiter
+from .StreamEngine import EngineTask
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUDGET = 3000  # 每个窗口历史记录的token上限
+DEFAULT_SUMMARY_MODEL = "Qwen/Qwen2.5-7B-Instruct"  # 用于压缩历史的便宜模型
+KEEP_RECENT_MESSAGES = 2  # 压缩时原样保留的最近消息数（一问一答）
+SUMMARY_WAIT_TIMEOUT = 20  # 发送新问题前最多等待摘要完成的时间（秒）
+
+_TOKENIZER_PATH = os.path.join(os.path.dirname(__file__), "embedding_model", "tokenizer.json")
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+
+class TokenCounter:
+    """用本地的分词器估计token数，分词器不可用时按字符数粗略估计"""
+
+    def __init__(self, tokenizer_path=_TOKENIZER_PATH):
+        try:
+            from tokenizers import Tokenizer
+
+            self._tokenizer = Tokenizer.from_file(tokenizer_path)
+        except Exception as e:
+            log.warning(f"无法加载本地分词器，按字符数估计token: {e}")
+            self._tokenizer = None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        cjk = len(_CJK.findall(text))
+        return cjk + (len(text) - cjk) // 4 + 1
+
+    def count_messages(self, messages: list) -> int:
+        # 每条消息额外算上角色等格式开销
+        return sum(self.count(m["content"]) + 4 for m in messages)
+
+
+class SummaryTask(EngineTask):
+    """在后台调用便宜的模型，把较早的对话压缩成摘要"""
+
+    def __init__(self, memory, window_id, generation, summary, messages):
+        super().__init__(window_id=window_id)
+        self.trace.model = memory.summary_model
+        self.memory = memory
+        self.generation = generation  # 开始摘要时窗口记忆的代数，窗口被清空后结果作废
+        self.summary = summary
+        self.messages = messages
+
+    def run(self):
+        conversation = "\n".join(f"{m['role']}: {m['content']}" for m in self.messages)
+        prompt = (
+            f"已有摘要：\n{self.summary or '无'}\n\n新的对话：\n{conversation}\n\n"
+            "请把已有摘要和新的对话合并成一段简洁的摘要，保留题目、代码要点、已得出的结论"
+            "和用户尚未解决的问题，供后续对话参考。只输出摘要本身。"
+        )
+        new_summary = None
+        messages = [{"role": "user", "content": prompt}]
+        limiter = RateLimiter.instance()
+        estimated = limiter.estimate(messages, 600)
+        # 摘要优先级最低，排队时被取消则直接截断
+        if limiter.acquire(estimated, PRIORITY_BACKGROUND, is_cancelled=self.is_cancelled):
+            actual = estimated
+            try:
+                response = HttpClient.instance().post_json(
+                    f"{self.memory.base_url}/v1/chat/completions",
+                    {
+                        "model": self.memory.summary_model,
+                        "messages": messages,
+                        "max_tokens": 600,
+                        "temperature": 0.3,
+                    },
+                    headers={"Authorization": f"Bearer {self.memory.api_key}"},
+                    timeout=SUMMARY_WAIT_TIMEOUT,
+                )
+                new_summary = response["choices"][0]["message"]["content"].strip()
+                actual = response.get("usage", {}).get("total_tokens", actual)
+            except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+                log.warning(f"窗口{self.window_id}的历史摘要失败，将直接截断: {e}")
+            finally:
+                limiter.settle(estimated, actual)
+        self.memory._finish_summary(self.window_id, self.generation, len(self.messages), new_summary)
+
+
+class WindowMemory:
+    def __init__(self, budget, generation):
+        self.budget = budget
+        self.generation = generation  # 每次新建（包括清空后重建）都不同
+        self.summary = ""  # 较早对话的摘要
+        self.messages = []  # 尚未压缩的消息
+        self.summarizing = threading.Event()  # 置位表示没有进行中的摘要
+        self.summarizing.set()
+
+
+class ConversationMemory:
+    """
+    按token预算管理每个窗口的对话历史
+    超出预算时在后台把较早的对话压缩成摘要，下一次提问前等待摘要完成
+    """
+
+    def __init__(
+        self,
+        model,
+        budget=DEFAULT_BUDGET,
+        summary_model=DEFAULT_SUMMARY_MODEL,
+        counter=None,
+    ):
+        """
+        :param model: 主模型，用于获取接口地址和密钥
+        :param budget: 默认的每窗口token预算
+        :param summary_model: 用于压缩历史的模型
+        """
+        self.base_url = model._url
+        self.api_key = model._api_key
+        self.budget = budget
+        self.summary_model = summary_model
+        self.counter = counter or TokenCounter()
+        self._windows = {}
+        self._generations = itertools.count()
+        self._lock = threading.Lock()
+
+    def _window(self, id: int) -> WindowMemory:
+        if id not in self._windows:
+            self._windows[id] = WindowMemory(self.budget, next(self._generations))
+        return self._windows[id]
+
+    def set_budget(self, id: int, budget: int):
+        """单独设置某个窗口的token预算"""
+        with self._lock:
+            self._window(id).budget = budget
+
+    def _tokens(self, window: WindowMemory) -> int:
+        return self.counter.count(window.summary) + self.counter.count_messages(window.messages)
+
+    def append(self, id: int, user_content: str, ai_content: str):
+        """记录一轮对话，超出预算时在后台开始压缩"""
+        with self._lock:
+            window = self._window(id)
+            window.messages.append({"role": "user", "content": user_content})
+            window.messages.append({"role": "assistant", "content": ai_content})
+            if self._tokens(window) <= window.budget or not window.summarizing.is_set():
+                return
+            older = window.messages[:-KEEP_RECENT_MESSAGES]
+            if not older:
+                return
+            window.summarizing.clear()
+            summary = window.summary
+            generation = window.generation
+        log.info(f"窗口{id}的历史超出预算，开始在后台压缩{len(older)}条消息")
+        SummaryTask(self, id, generation, summary, older).start()
+
+    def _finish_summary(self, id: int, generation: int, count: int, new_summary):
+        with self._lock:
+            window = self._windows.get(id)
+            if window is None or window.generation != generation:
+                log.info(f"窗口{id}的历史在摘要完成前已被清空，丢弃摘要")
+                return
+            if new_summary is not None:
+                window.summary = new_summary
+                del window.messages[:count]
+                log.info(f"窗口{id}的历史压缩完成，当前约{self._tokens(window)}个token")
+            window.summarizing.set()
+
+    def get_messages(self, id: int) -> list:
+        """
+        返回发送给模型的历史消息（摘要 + 最近的消息），不超过预算
+        有进行中的摘要时先等待，会阻塞，应在后台线程调用
+        """
+        with self._lock:
+            window = self._window(id)
+        if not window.summarizing.wait(SUMMARY_WAIT_TIMEOUT):
+            log.warning(f"窗口{id}的历史摘要超时，直接截断")
+        with self._lock:
+            if self._windows.get(id) is not window:
+                return []  # 等待期间历史被清空
+            messages = list(window.messages)
+            summary = window.summary
+            budget = window.budget
+        # 摘要失败或仍然超出预算时，从最早的消息开始丢弃
+        used = self.counter.count(summary)
+        kept = []
+        for message in reversed(messages):
+            used += self.counter.count_messages([message])
+            if used > budget and kept:
+                break
+            kept.append(message)
+        kept.reverse()
+        if summary:
+            kept.insert(0, {"role": "system", "content": f"以下是之前对话的摘要：\n{summary}"})
+        return kept
+
+    def clear(self, id: int):
+        """清空窗口的历史，进行中的摘要完成后被丢弃"""
+        with self._lock:
+            window = self._windows.pop(id, None)
+        if window is not None:
+            window.summarizing.set()  # 不再让等待这次摘要的请求阻塞
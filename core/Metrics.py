@@ -0,0 +1,270 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# 指标文件放在项目根目录的 cache/ 下
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_METRICS_PATH = os.path.join(os.path.dirname(script_dir), "cache", "metrics.json")
+
+# 设为端口号（如9464）时在127.0.0.1上以Prometheus文本格式提供指标，None表示关闭
+PROMETHEUS_PORT = None
+
+WRITE_INTERVAL = 5.0  # 两次写指标文件之间的最短间隔（秒）
+
+_SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+# 指标名 -> (说明, 分桶上界)
+METRICS = {
+    "queue_seconds": ("提交到StreamEngine后排队等待的时间", _SECONDS_BUCKETS),
+    "connect_seconds": ("开始执行到收到响应头的时间（含建连）", _SECONDS_BUCKETS),
+    "ttft_seconds": ("开始执行到产出第一个token的时间", _SECONDS_BUCKETS),
+    "tokens_per_second": ("第一个token之后的生成速度（按流式分片计）", _RATE_BUCKETS),
+    "parse_seconds": ("解析模型输出（SSE或结构化JSON）累计用时", _SECONDS_BUCKETS),
+    "preprocess_seconds": ("上传前的图片预处理（裁剪、缩放、编码）用时", _SECONDS_BUCKETS),
+    "ocr_seconds": ("图片路由前的本地OCR用时", _SECONDS_BUCKETS),
+    "request_seconds": ("提交到请求结束的总时间", _SECONDS_BUCKETS),
+    "render_seconds": ("聊天窗口单次渲染用时", _SECONDS_BUCKETS),
+    "ui_first_token_seconds": ("用户发送到窗口显示第一段回答的时间", _SECONDS_BUCKETS),
+    "end_to_end_seconds": ("用户发送到窗口显示完整回答的时间", _SECONDS_BUCKETS),
+}
+
+
+class Histogram:
+    """累计分桶直方图，另外保留最近的样本用于计算分位数"""
+
+    def __init__(self, buckets, max_samples=1000):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def quantile(self, q: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    延迟指标，只有一个实例
+    按 (指标名, 窗口id, 模型) 聚合成直方图，写入本地指标文件，可选地通过本机HTTP端口导出
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "Metrics":
+        with Metrics._lock:
+            if Metrics._instance is None:
+                Metrics._instance = Metrics()
+        return Metrics._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "Metrics":
+        """用指定参数重建共享实例（如基准测试时不写指标文件）"""
+        with Metrics._lock:
+            Metrics._instance = Metrics(**kwargs)
+        return Metrics._instance
+
+    def __init__(self, path=DEFAULT_METRICS_PATH):
+        """
+        :param path: 指标文件路径（JSON），None表示不写文件
+        """
+        self.path = path
+        self._histograms = {}  # (指标名, 窗口id, 模型) -> Histogram
+        self._labels = {}  # 窗口id -> 汇总指标时代替窗口id的标签
+        self._data_lock = threading.Lock()
+        self._last_write = 0.0
+        self._server = None
+
+    def set_label(self, window_id, label: str):
+        """
+        该窗口之后创建的请求按label汇总指标，用于服务模式中每个请求（对话）新建的窗口，
+        避免每个窗口id各占一组直方图；窗口不再使用时调用 clear_label
+        """
+        with self._data_lock:
+            self._labels[window_id] = label
+
+    def clear_label(self, window_id):
+        with self._data_lock:
+            self._labels.pop(window_id, None)
+
+    def label_for(self, window_id):
+        """汇总指标时使用的窗口标签，没有设置标签时为窗口id本身"""
+        with self._data_lock:
+            return self._labels.get(window_id, window_id)
+
+    def observe(self, name: str, value: float, window_id=None, model=""):
+        if name not in METRICS:
+            raise KeyError(f"未定义的指标: {name}")
+        key = (name, "" if window_id is None else str(window_id), str(model or ""))
+        with self._data_lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(METRICS[name][1])
+            histogram.observe(value)
+
+    def snapshot(self) -> list:
+        """所有直方图的摘要，按指标名、窗口、模型排序"""
+        with self._data_lock:
+            items = sorted(self._histograms.items())
+            return [
+                {"metric": name, "window": window, "model": model, **histogram.summary()}
+                for (name, window, model), histogram in items
+            ]
+
+    def write_file(self, force=False):
+        """把摘要写入指标文件，非force时距上次写入不足WRITE_INTERVAL秒则跳过"""
+        if self.path is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_write < WRITE_INTERVAL:
+            return
+        self._last_write = now
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"updated": time.time(), "metrics": self.snapshot()},
+                    f,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning(f"写入指标文件失败: {e}")
+
+    def prometheus_text(self) -> str:
+        """Prometheus文本格式（histogram类型）"""
+        lines = []
+        with self._data_lock:
+            items = sorted(self._histograms.items())
+            described = set()
+            for (name, window, model), histogram in items:
+                metric = f"bugsy_{name}"
+                if name not in described:
+                    described.add(name)
+                    lines.append(f"# HELP {metric} {METRICS[name][0]}")
+                    lines.append(f"# TYPE {metric} histogram")
+                labels = f'window="{window}",model="{model}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=PROMETHEUS_PORT):
+        """在127.0.0.1:port的 /metrics 上提供Prometheus文本格式的指标"""
+        if self._server is not None or not port:
+            return
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # 不把每次抓取都打到日志里
+
+        try:
+            self._server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        except OSError as e:
+            log.warning(f"无法在端口{port}上提供指标: {e}")
+            return
+        threading.Thread(
+            target=self._server.serve_forever, name="MetricsServer", daemon=True
+        ).start()
+        log.info(f"指标已在 http://127.0.0.1:{port}/metrics 上提供")
+
+    def shutdown(self):
+        """写出最终的指标文件并关闭HTTP端口，程序退出时调用"""
+        self.write_file(force=True)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+class RequestTrace:
+    """
+    一次请求在各阶段的时间点，由处理请求的后台任务记录，结束时汇总进Metrics
+    时间点：created（提交）、started（开始执行）、headers（收到响应头）、first_token、finished
+    """
+
+    def __init__(self, window_id, model=""):
+        # 创建时确定标签，请求结束前窗口可能已被释放
+        self.window_id = Metrics.instance().label_for(window_id)
+        self.model = model
+        self.marks = {"created": time.perf_counter()}
+        self.durations = {}  # 累计型阶段（如解析）的总用时
+        self.tokens = 0
+
+    def mark(self, name: str):
+        """记录时间点，同名时间点只记录第一次（如对冲请求中先到的响应头）"""
+        self.marks.setdefault(name, time.perf_counter())
+
+    def add(self, name: str, seconds: float):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def _between(self, start, end):
+        if start in self.marks and end in self.marks:
+            return self.marks[end] - self.marks[start]
+        return None
+
+    def finish(self):
+        """计算各阶段用时并记录到Metrics"""
+        self.mark("finished")
+        metrics = Metrics.instance()
+        spans = {
+            "queue_seconds": self._between("created", "started"),
+            "connect_seconds": self._between("started", "headers"),
+            "ttft_seconds": self._between("started", "first_token"),
+            "request_seconds": self._between("created", "finished"),
+            "parse_seconds": self.durations.get("parse"),
+            "preprocess_seconds": self.durations.get("preprocess"),
+            "ocr_seconds": self.durations.get("ocr"),
+        }
+        generating = self._between("first_token", "finished")
+        if generating and self.tokens > 1:
+            spans["tokens_per_second"] = (self.tokens - 1) / generating
+        for name, value in spans.items():
+            if value is not None:
+                metrics.observe(name, value, self.window_id, self.model)
+        metrics.write_file()
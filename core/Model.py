@@ -11,6 +11,15 @@ env_path = os.path.join(script_dir, "API_KEY.env")
 model = None
 vision_model = None
 
+# 对冲请求：主模型在delay_ms毫秒内没有产出任何token时，向备用接口/模型发送同样的请求，
+# 先产出token的一方胜出，另一方被取消。被对冲的请求同样消耗输入token和限流额度，默认关闭，例如：
+# HEDGE_CONFIG = {"url": "https://api.siliconflow.cn", "model_type": "deepseek-ai/DeepSeek-R1", "delay_ms": 4000}
+HEDGE_CONFIG = None
+
+# 主模型重试用尽或熔断时自动切换到的备用模型（与主模型使用相同的接口和密钥）
+FALLBACK_MODEL_TYPE = "deepseek-ai/DeepSeek-V3"
+FALLBACK_VISION_MODEL_TYPE = "Qwen/Qwen2.5-VL-32B-Instruct"
+
 def load_api_key():
     load_dotenv(dotenv_path=env_path, override=True)
     return os.getenv("API_KEY")
@@ -42,5 +51,15 @@ def init_models():
     )
     return _model, _vision_model
 
+def create_fallback(primary, model_type):
+    """用与primary相同的接口、密钥和参数创建备用模型"""
+    return ModelFactory.create(
+        model_platform=ModelPlatformType.OPENAI_COMPATIBLE_MODEL,
+        model_type=model_type,
+        url=primary._url,
+        api_key=primary._api_key,
+        model_config_dict=dict(primary.model_config_dict),
+    )
+
 # 启动时初始化一次
 model, vision_model = init_models()
\ No newline at end of file
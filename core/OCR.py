@@ -0,0 +1,281 @@
+"""
+图片问答前的本地OCR路由：识别出的文字可信、且图片中几乎只有文字（代码、报错截图）时，
+把文字交给更快的文本模型回答，只有图表、界面等真正需要看图的才发给视觉模型
+OCR后端可替换，只在CPU上运行；默认使用tesseract（需安装 pytesseract 和 tesseract 程序），不可用时全部走视觉模型
+"""
+
+import io
+import logging
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from PIL import Image, ImageChops, ImageDraw
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+log = logging.getLogger(__name__)
+
+MIN_CONFIDENCE = 0.80  # 按字符数加权的平均识别置信度
+MIN_COVERAGE = 0.85  # 非背景像素落在文字框内的比例，图表的线条、色块会拉低该值
+MIN_CHARS = 20  # 文字太少时（如只有标签的示意图）仍交给视觉模型
+INK_TOLERANCE = 48  # 与背景色的差异超过该值的像素视为前景
+BOX_PADDING = 2
+CACHE_SIZE = 64
+
+TEXT_ROUTE = "text"
+VISION_ROUTE = "vision"
+
+
+@dataclass
+class OCRWord:
+    text: str
+    box: tuple  # (left, top, right, bottom)
+    confidence: float  # 0~1
+    line: tuple  # 所在行的编号，同一行的词相同
+
+
+@dataclass
+class OCRResult:
+    words: list = field(default_factory=list)
+
+    @property
+    def confidence(self) -> float:
+        chars = sum(len(word.text) for word in self.words)
+        if not chars:
+            return 0.0
+        return sum(word.confidence * len(word.text) for word in self.words) / chars
+
+    @property
+    def text(self) -> str:
+        """按行拼接，并按词的横坐标还原行首缩进（代码截图的缩进有意义）"""
+        if not self.words:
+            return ""
+        char_width = statistics.median(
+            (word.box[2] - word.box[0]) / len(word.text) for word in self.words
+        )
+        left = min(word.box[0] for word in self.words)
+        lines = OrderedDict()
+        for word in self.words:
+            lines.setdefault(word.line, []).append(word)
+        result = []
+        for words in lines.values():
+            indent = round((words[0].box[0] - left) / char_width) if char_width else 0
+            result.append(" " * indent + " ".join(word.text for word in words))
+        return "\n".join(result)
+
+
+class OCRBackend:
+    """OCR后端的接口，替换时实现 available 和 recognize（在后台线程中调用，只能使用CPU）"""
+
+    name = "none"
+
+    def available(self) -> bool:
+        return False
+
+    def recognize(self, image: Image.Image) -> OCRResult:
+        raise NotImplementedError
+
+
+class TesseractBackend(OCRBackend):
+    name = "tesseract"
+
+    def __init__(self, languages=("eng", "chi_sim")):
+        """:param languages: 优先使用的语言包，本机没有安装的会被忽略"""
+        self.languages = languages
+        self._lang = None
+
+    def available(self) -> bool:
+        if pytesseract is None:
+            return False
+        if self._lang is None:
+            try:
+                installed = set(pytesseract.get_languages())
+            except (pytesseract.TesseractNotFoundError, OSError):
+                return False
+            self._lang = "+".join(lang for lang in self.languages if lang in installed) or "eng"
+        return True
+
+    def recognize(self, image: Image.Image) -> OCRResult:
+        data = pytesseract.image_to_data(
+            image, lang=self._lang, config="--psm 6", output_type=pytesseract.Output.DICT
+        )
+        result = OCRResult()
+        for i, text in enumerate(data["text"]):
+            confidence = float(data["conf"][i])
+            if not text.strip() or confidence < 0:
+                continue
+            left, top = data["left"][i], data["top"][i]
+            result.words.append(
+                OCRWord(
+                    text,
+                    (left, top, left + data["width"][i], top + data["height"][i]),
+                    confidence / 100,
+                    (data["block_num"][i], data["par_num"][i], data["line_num"][i]),
+                )
+            )
+        return result
+
+
+def text_coverage(image: Image.Image, words) -> float:
+    """非背景像素中落在文字框内的比例（背景色取左上角像素）"""
+    gray = image.convert("L")
+    background = Image.new("L", gray.size, gray.getpixel((0, 0)))
+    ink = ImageChops.difference(gray, background).point(
+        lambda value: 255 if value > INK_TOLERANCE else 0
+    )
+    total = ink.histogram()[255]
+    if not total:
+        return 0.0
+    boxes = Image.new("L", gray.size, 0)
+    draw = ImageDraw.Draw(boxes)
+    for word in words:
+        left, top, right, bottom = word.box
+        draw.rectangle(
+            (left - BOX_PADDING, top - BOX_PADDING, right + BOX_PADDING, bottom + BOX_PADDING), fill=255
+        )
+    return ImageChops.multiply(ink, boxes).histogram()[255] / total
+
+
+def build_ocr_prompt(text: str, question: str) -> str:
+    return (
+        "以下是用户截图中通过OCR识别出的文字，可能有个别字符识别错误，请结合上下文理解：\n"
+        f"```\n{text}\n```\n\n{question}"
+    )
+
+
+@dataclass
+class RouteDecision:
+    route: str  # TEXT_ROUTE / VISION_ROUTE
+    reason: str
+    text: str = ""
+    confidence: float = 0.0
+    coverage: float = 0.0
+    text_free: bool = False  # OCR成功且几乎没有识别出文字（图表、照片等），可以按感知哈希近似匹配缓存
+
+
+class OCRRouter:
+    """
+    OCR路由，只有一个实例，识别结果按图片内容的哈希缓存
+    同时统计各路线的次数和用时，估计走文本模型节省的时间
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "OCRRouter":
+        with OCRRouter._lock:
+            if OCRRouter._instance is None:
+                OCRRouter._instance = OCRRouter()
+        return OCRRouter._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "OCRRouter":
+        """用指定参数重建共享实例（如换用其他OCR后端）"""
+        with OCRRouter._lock:
+            OCRRouter._instance = OCRRouter(**kwargs)
+        return OCRRouter._instance
+
+    def __init__(
+        self,
+        backend: OCRBackend = None,
+        enabled=True,
+        min_confidence=MIN_CONFIDENCE,
+        min_coverage=MIN_COVERAGE,
+        min_chars=MIN_CHARS,
+    ):
+        """:param backend: OCR后端，None表示使用tesseract"""
+        self.backend = backend if backend is not None else TesseractBackend()
+        self.enabled = enabled and self.backend.available()
+        self.min_confidence = min_confidence
+        self.min_coverage = min_coverage
+        self.min_chars = min_chars
+        self._cache = OrderedDict()  # 图片哈希 -> RouteDecision
+        self._stats_lock = threading.Lock()
+        self.routes = {TEXT_ROUTE: 0, VISION_ROUTE: 0}
+        self.ocr_seconds = 0.0
+        self._latency = {TEXT_ROUTE: [], VISION_ROUTE: []}  # 各路线最近的完整回答用时
+        if enabled and not self.enabled:
+            log.info("未找到可用的OCR后端，图片问答全部使用视觉模型")
+
+    def route(self, prepared) -> RouteDecision:
+        """
+        :param prepared: ImagePrep.PreparedImage
+        """
+        if not self.enabled:
+            return self._count(RouteDecision(VISION_ROUTE, "OCR未启用"))
+        with self._stats_lock:
+            decision = self._cache.get(prepared.key)
+            if decision is not None:
+                self._cache.move_to_end(prepared.key)
+        if decision is None:
+            decision = self._decide(prepared)
+            with self._stats_lock:
+                self._cache[prepared.key] = decision
+                while len(self._cache) > CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        return self._count(decision)
+
+    def _decide(self, prepared) -> RouteDecision:
+        start = time.perf_counter()
+        try:
+            image = Image.open(io.BytesIO(prepared.data)).convert("RGB")
+            result = self.backend.recognize(image)
+            coverage = text_coverage(image, result.words)
+        except Exception as e:
+            log.warning(f"OCR失败，改用视觉模型: {e}")
+            return RouteDecision(VISION_ROUTE, f"OCR失败: {e}")
+        finally:
+            with self._stats_lock:
+                self.ocr_seconds += time.perf_counter() - start
+
+        text = result.text
+        confidence = result.confidence
+        if len(text.replace(" ", "")) < self.min_chars:
+            return RouteDecision(VISION_ROUTE, "文字太少", text, confidence, coverage, text_free=True)
+        if confidence < self.min_confidence:
+            reason = f"识别置信度{confidence:.0%}偏低"
+        elif coverage < self.min_coverage:
+            reason = f"文字只覆盖{coverage:.0%}的内容，可能含有图表"
+        else:
+            return RouteDecision(TEXT_ROUTE, "纯文字截图", text, confidence, coverage)
+        return RouteDecision(VISION_ROUTE, reason, text, confidence, coverage)
+
+    def _count(self, decision: RouteDecision) -> RouteDecision:
+        with self._stats_lock:
+            self.routes[decision.route] += 1
+        log.info(f"图片路由: {decision.route}（{decision.reason}）")
+        return decision
+
+    def record_latency(self, route: str, seconds: float):
+        """记录一次完整回答的用时（从提问到回答结束）"""
+        with self._stats_lock:
+            samples = self._latency[route]
+            samples.append(seconds)
+            del samples[:-100]
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            averages = {
+                route: sum(samples) / len(samples) if samples else None
+                for route, samples in self._latency.items()
+            }
+            saved = None
+            if averages[TEXT_ROUTE] is not None and averages[VISION_ROUTE] is not None:
+                # 走文本模型的请求如果改走视觉模型，平均多花的时间
+                saved = self.routes[TEXT_ROUTE] * (averages[VISION_ROUTE] - averages[TEXT_ROUTE])
+            return {
+                "backend": self.backend.name if self.enabled else None,
+                "routes": dict(self.routes),
+                "ocr_seconds": round(self.ocr_seconds, 3),
+                "average_seconds": {
+                    route: None if value is None else round(value, 3) for route, value in averages.items()
+                },
+                "saved_seconds": None if saved is None else round(saved, 3),
+            }
@@ -3,9 +3,33 @@ from camel.retrievers import VectorRetriever
 from camel.storages.vectordb_storages import QdrantStorage
 from .FileReader import extract_text_auto
 from .common import *
+import threading
 
 log = logging.getLogger(__name__)
 
+_encoder = None
+_encoder_lock = threading.Lock()
+
+
+def get_encoder() -> SentenceTransformerEncoder:
+    """加载本地的bge-small-zh embedding模型，整个进程只加载一次"""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = SentenceTransformerEncoder(
+                model_name=os.path.join(os.path.dirname(__file__), "embedding_model")
+            )
+    return _encoder
+
+
+def build_rag_prompt(material: str, question: str) -> str:
+    """RAG窗口和服务模式共用的提示词，material为 RAGStorage.query 的结果"""
+    return f"""
+                仅根据我提供的材料回答问题：
+                材料：{material}
+                问题：{question}
+                """
+
 
 class RAGStorage:
     """用于RAG"""
@@ -27,7 +51,7 @@ class RAGStorage:
         """
 
         # embedding模型
-        self.encoder = SentenceTransformerEncoder(model_name="core\embedding_model")
+        self.encoder = get_encoder()
 
         self.similarity_threshold = similarity_threshold
         self.top_k = top_k
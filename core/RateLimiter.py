@@ -0,0 +1,179 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# API密钥的限额（所有agent共用），按SiliconFlow控制台中的数值设置
+RPM_LIMIT = 1000  # 每分钟请求数
+TPM_LIMIT = 50000  # 每分钟token数（输入+输出）
+
+EXPECTED_OUTPUT_TOKENS = 1000  # 排队时按此估计回答的token数，结束后按实际用量结算
+NOTIFY_THRESHOLD = 0.5  # 预计等待超过该秒数时通知界面
+
+# 优先级，数值越小越先执行
+PRIORITY_DEBUG = 0
+PRIORITY_IMAGE = 1
+PRIORITY_CHAT = 2
+PRIORITY_BACKGROUND = 3  # 历史摘要等后台请求
+
+
+def priority_for_window(window_id) -> int:
+    if window_id == 0:
+        return PRIORITY_DEBUG
+    if window_id == 2:
+        return PRIORITY_IMAGE
+    return PRIORITY_CHAT
+
+
+class TokenBucket:
+    """令牌桶：容量为一分钟的限额，按每秒 limit/60 的速度匀速补充"""
+
+    def __init__(self, limit_per_minute):
+        self.capacity = float(limit_per_minute)
+        self.rate = limit_per_minute / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount) -> float:
+        """还需要等待多久才能取出amount个令牌（秒）"""
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount  # 结算时可能为负，之后的请求相应地多等
+
+    def give_back(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """
+    所有agent共用的客户端限流，只有一个实例
+    同时按请求数（RPM）和估计的token数（TPM）限流，超出时按优先级排队等待，而不是等服务端返回429
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "RateLimiter":
+        with RateLimiter._lock:
+            if RateLimiter._instance is None:
+                RateLimiter._instance = RateLimiter()
+        return RateLimiter._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "RateLimiter":
+        """用指定参数重建共享实例"""
+        with RateLimiter._lock:
+            RateLimiter._instance = RateLimiter(**kwargs)
+        return RateLimiter._instance
+
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT, counter=None):
+        """
+        :param counter: 估计token数的 Memory.TokenCounter，默认在第一次使用时创建
+        """
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._counter = counter
+        self._waiters = []  # 堆：(优先级, 序号, token数)
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self.waited_requests = 0
+        self.total_wait = 0.0
+
+    def estimate(self, messages, output_tokens=EXPECTED_OUTPUT_TOKENS) -> int:
+        """估计一次请求消耗的token数（输入 + 预计输出）"""
+        if self._counter is None:
+            from .Memory import TokenCounter
+
+            self._counter = TokenCounter()
+        return self._counter.count_messages(messages) + output_tokens
+
+    def _expected_wait(self, ticket) -> float:
+        """排在ticket之前（含ticket）的请求全部放行所需的时间"""
+        ahead = [w for w in self._waiters if w <= ticket]
+        return max(
+            self.requests.delay(len(ahead)),
+            self.tokens.delay(sum(w[2] for w in ahead)),
+        )
+
+    def acquire(self, tokens, priority=PRIORITY_CHAT, on_wait=None, is_cancelled=None) -> bool:
+        """
+        等待直到可以发出请求，会阻塞，应在后台线程调用
+        :param tokens: 估计的token数，见 estimate()
+        :param on_wait: 需要排队时调用一次 on_wait(预计等待秒数)，用于在界面上提示
+        :param is_cancelled: 返回True时放弃排队
+        :return: 是否获得许可（被取消时为False）
+        """
+        tokens = min(tokens, self.tokens.capacity)  # 超过整分钟限额的请求也要能执行
+        ticket = (priority, next(self._seq), tokens)
+        notified = False
+        start = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiters, ticket)
+            try:
+                while True:
+                    if is_cancelled is not None and is_cancelled():
+                        return False
+                    if self._waiters[0] == ticket:
+                        delay = max(self.requests.delay(1), self.tokens.delay(tokens))
+                        if delay <= 0:
+                            self.requests.take(1)
+                            self.tokens.take(tokens)
+                            break
+                    else:
+                        delay = self._expected_wait(ticket)
+                    if not notified and on_wait is not None and delay > NOTIFY_THRESHOLD:
+                        notified = True
+                        on_wait(delay)
+                    self._condition.wait(min(max(delay, 0.05), 0.5))
+            finally:
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                self._condition.notify_all()
+        waited = time.monotonic() - start
+        if waited > NOTIFY_THRESHOLD:
+            self.waited_requests += 1
+            self.total_wait += waited
+            log.info(f"限流：请求排队{waited:.1f}秒（优先级{priority}）")
+        return True
+
+    def try_acquire(self, tokens) -> bool:
+        """不等待：没有请求在排队且额度足够时立即获得许可，否则返回False（用于对冲等可有可无的请求）"""
+        tokens = min(tokens, self.tokens.capacity)
+        with self._condition:
+            if self._waiters or self.requests.delay(1) > 0 or self.tokens.delay(tokens) > 0:
+                return False
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            return True
+
+    def settle(self, estimated, actual):
+        """请求结束后按实际用量结算token桶（多退少补）"""
+        with self._condition:
+            if actual < estimated:
+                self.tokens.give_back(estimated - actual)
+            else:
+                self.tokens.take(actual - estimated)
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "queued": len(self._waiters),
+                "waited_requests": self.waited_requests,
+                "total_wait": self.total_wait,
+                "request_budget": self.requests.level,
+                "token_budget": self.tokens.level,
+            }
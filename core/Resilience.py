@@ -0,0 +1,211 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+
+log = logging.getLogger(__name__)
+
+MAX_RETRIES = 3  # 可重试错误的最大重试次数
+BASE_DELAY = 1.0  # 第一次重试前的最长等待（秒），之后按2的幂增长
+MAX_DELAY = 20.0  # 单次等待的上限（秒）
+
+
+class LLMError(Exception):
+    """模型调用错误的基类，retryable 表示稍后重试可能成功"""
+
+    retryable = False
+    user_message = "模型调用失败"
+
+    def __init__(self, detail="", status_code=None, retry_after=None):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+        self.retry_after = retry_after  # 服务端通过Retry-After给出的等待时间（秒）
+
+    def __str__(self):
+        status = f"（状态码 {self.status_code}）" if self.status_code else ""
+        return f"{self.user_message}{status}: {self.detail}" if self.detail else self.user_message + status
+
+
+class RateLimitError(LLMError):
+    retryable = True
+    user_message = "请求过于频繁，已被限流"
+
+
+class ServerError(LLMError):
+    retryable = True
+    user_message = "模型服务暂时不可用"
+
+
+class NetworkError(LLMError):
+    retryable = True
+    user_message = "网络连接失败或超时"
+
+
+class AuthError(LLMError):
+    user_message = "API密钥无效或没有权限，请重新设置API密钥"
+
+
+class BadRequestError(LLMError):
+    user_message = "请求参数有误"
+
+
+class ParseError(LLMError):
+    user_message = "模型输出格式有误，无法解析"
+
+
+class CircuitOpenError(LLMError):
+    user_message = "该模型接口近期连续失败，已暂停调用"
+
+
+def _retry_after(headers):
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def classify_status(status_code: int, detail="", headers=None) -> LLMError:
+    """根据HTTP状态码归类错误"""
+    retry_after = _retry_after(headers or {})
+    if status_code == 429:
+        return RateLimitError(detail, status_code, retry_after)
+    if status_code in (401, 403):
+        return AuthError(detail, status_code)
+    if status_code >= 500 or status_code == 408:
+        return ServerError(detail, status_code, retry_after)
+    return BadRequestError(detail, status_code)
+
+
+def classify_exception(e: Exception) -> LLMError:
+    """把requests、openai（camel内部使用）等抛出的异常归类为LLMError"""
+    if isinstance(e, LLMError):
+        return e
+    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None:
+        return classify_status(e.response.status_code, e.response.text, e.response.headers)
+    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+        return NetworkError(str(e))
+    # openai.APIStatusError 等带有 status_code 属性
+    status_code = getattr(e, "status_code", None)
+    if isinstance(status_code, int):
+        response = getattr(e, "response", None)
+        return classify_status(status_code, str(e), getattr(response, "headers", None))
+    name = type(e).__name__
+    if "Timeout" in name or "Connection" in name:
+        return NetworkError(str(e))
+    if isinstance(e, requests.exceptions.RequestException):
+        return NetworkError(str(e))
+    return LLMError(f"{name}: {e}")
+
+
+def backoff_delay(attempt: int, retry_after=None) -> float:
+    """第attempt次重试前的等待时间：带全抖动的指数退避，服务端给出Retry-After时以其为下限"""
+    delay = random.uniform(0, min(MAX_DELAY, BASE_DELAY * 2**attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, MAX_DELAY))
+    return delay
+
+
+class CircuitBreaker:
+    """
+    每个接口（地址+模型）一个熔断器
+    连续失败达到阈值后断开，一段时间内直接拒绝调用；冷却后放行一次试探，成功则恢复
+    """
+
+    _breakers = {}
+    _registry_lock = threading.Lock()
+
+    @staticmethod
+    def for_endpoint(url, model_type) -> "CircuitBreaker":
+        key = f"{url}|{model_type}"
+        with CircuitBreaker._registry_lock:
+            if key not in CircuitBreaker._breakers:
+                CircuitBreaker._breakers[key] = CircuitBreaker(key)
+            return CircuitBreaker._breakers[key]
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        """
+        :param failure_threshold: 连续失败多少次后断开
+        :param reset_timeout: 断开后多久放行试探请求（秒）
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True  # 半开：只放行一个试探请求
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                log.info(f"熔断器 {self.name} 恢复")
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.failures >= self.failure_threshold):
+                log.warning(f"熔断器 {self.name} 断开（连续失败{self.failures}次）")
+                self.opened_at = time.monotonic()
+            self._probing = False
+
+    def record_ignored(self):
+        """与接口是否可用无关的错误（如请求参数有误、输出格式有误）：不计入失败，只结束试探"""
+        with self._lock:
+            self._probing = False
+
+
+def call_with_retry(func, models, wait=time.sleep, should_retry=None, max_retries=MAX_RETRIES):
+    """
+    依次对models中的模型调用func(model)并返回结果
+    可重试的错误按抖动指数退避重试；重试用尽、熔断或遇到与模型有关的错误时切换到下一个模型
+    :param models: 模型列表（需有 _url 和 model_type），第一个为主模型，之后为备用模型（None会被跳过）
+    :param wait: 等待函数，返回True表示在等待中被取消，此时停止重试
+    :param should_retry: 可选，should_retry(error)返回False时既不重试也不切换模型（如流式回答已输出了一部分）
+    :raises LLMError: 所有模型都失败时抛出最后一个错误
+    """
+    should_retry = should_retry or (lambda error: True)
+    error = None
+    models = [m for m in models if m is not None]
+    for model in models:
+        breaker = CircuitBreaker.for_endpoint(model._url, model.model_type)
+        for attempt in range(max_retries + 1):
+            if not breaker.allow():
+                error = CircuitOpenError(str(model.model_type))
+                break
+            try:
+                result = func(model)
+            except Exception as e:
+                error = classify_exception(e)
+                # 只有限流、服务端和网络错误说明接口不可用，其余错误换一次请求也一样，不触发熔断
+                if error.retryable:
+                    breaker.record_failure()
+                else:
+                    breaker.record_ignored()
+                log.warning(f"{model.model_type} 调用失败（第{attempt + 1}次）: {error}")
+                if not error.retryable or attempt == max_retries or not should_retry(error):
+                    break
+                if wait(backoff_delay(attempt, error.retry_after)):
+                    raise error
+                continue
+            breaker.record_success()
+            return result
+        if isinstance(error, AuthError) or not should_retry(error):
+            raise error  # 密钥问题换模型也无济于事
+        if model is not models[-1]:
+            log.warning(f"{model.model_type} 不可用，切换到备用模型")
+    raise error or LLMError("没有可用的模型")
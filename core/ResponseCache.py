@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# 缓存文件放在项目根目录的 cache/ 下
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(script_dir), "cache", "llm_cache.sqlite")
+
+
+def normalize_messages(messages: list) -> list:
+    """只保留影响回答的字段，并去掉首尾空白，使仅有空白差异的相同问题得到相同的key"""
+    return [
+        {"role": m.get("role", "user"), "content": str(m.get("content", "")).strip()}
+        for m in messages
+    ]
+
+
+def make_key(model: str, params: dict, messages: list) -> str:
+    """由模型、采样参数和消息列表的哈希组成缓存key"""
+    messages_hash = hashlib.sha256(
+        json.dumps(normalize_messages(messages), ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+    raw = json.dumps(
+        {"model": model, "params": params, "messages": messages_hash},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    磁盘上的LLM响应缓存（SQLite），只有一个实例
+    按流式输出的分片保存回答，命中时可以按原来的流式路径重放
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "ResponseCache":
+        with ResponseCache._lock:
+            if ResponseCache._instance is None:
+                ResponseCache._instance = ResponseCache()
+        return ResponseCache._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "ResponseCache":
+        """用指定参数重建共享实例（如基准测试时使用临时文件）"""
+        with ResponseCache._lock:
+            ResponseCache._instance = ResponseCache(**kwargs)
+        return ResponseCache._instance
+
+    def __init__(
+        self,
+        path=DEFAULT_CACHE_PATH,
+        max_entries=2000,
+        max_bytes=50 * 1024 * 1024,
+        ttl=7 * 24 * 3600,
+    ):
+        """
+        :param path: SQLite文件路径
+        :param max_entries: 最多保存的回答条数，超出时按最近最少使用淘汰
+        :param max_bytes: 所有回答的总大小上限（字节）
+        :param ttl: 回答的有效期（秒），过期后视为未命中
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                chunks TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)"
+        )
+        self._db.commit()
+
+    def get(self, key: str):
+        """返回缓存的分片列表，未命中或已过期时返回None"""
+        now = time.time()
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT chunks, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._db.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (now, key)
+            )
+            self._db.commit()
+            self.hits += 1
+        log.info(f"LLM响应缓存命中 (命中 {self.hits} / 未命中 {self.misses})")
+        return json.loads(row[0])
+
+    def put(self, key: str, chunks: list):
+        """保存一次完整的回答"""
+        data = json.dumps(chunks, ensure_ascii=False)
+        size = len(data.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)",
+                (key, data, size, now, now),
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        """删除过期条目，再按最近最少使用淘汰到条数和大小上限以内（调用方持有锁）"""
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT key, size FROM responses ORDER BY last_access"
+        ).fetchall()
+        removed = []
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            removed.append((key,))
+            count -= 1
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", removed)
+        log.info(f"LLM响应缓存淘汰了 {len(removed)} 条")
+
+    def stats(self) -> dict:
+        with self._db_lock:
+            count, total = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": count, "bytes": total}
+
+    def clear(self):
+        with self._db_lock:
+            self._db.execute("DELETE FROM responses")
+            self._db.commit()
@@ -0,0 +1,118 @@
+import json
+import logging
+from collections import namedtuple
+from json.decoder import scanstring
+
+log = logging.getLogger(__name__)
+
+# 一个增量：content为正式回答，reasoning_content为推理模型（如DeepSeek-R1）的思考过程
+Delta = namedtuple("Delta", ["content", "reasoning_content"])
+
+_DATA_PREFIX = b"data:"
+_DONE = b"[DONE]"
+
+
+class SSEParser:
+    """
+    增量解析 /v1/chat/completions 返回的server-sent events流
+    数据直接追加到一个复用的bytearray中，按行切分时只记录位置；
+    每行只定位并解码需要的 delta.content / delta.reasoning_content 字段，不构建完整的JSON对象
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.done = False  # 是否已收到 data: [DONE]
+        self.error = None  # 服务端在流中返回的错误信息
+
+    def feed(self, data: bytes) -> list:
+        """
+        送入一段网络数据，返回其中已完整的增量（Delta列表）
+        不完整的最后一行留在缓冲区中，等待下一段数据
+        """
+        if self.done:
+            return []
+        buffer = self._buffer
+        buffer += data
+        deltas = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end < 0:
+                break
+            delta = self._parse_line(buffer, start, end)
+            start = end + 1
+            if delta is not None:
+                deltas.append(delta)
+            if self.done:
+                break
+        # 一次性丢弃已处理的部分，避免逐行拷贝
+        del buffer[:start]
+        return deltas
+
+    def close(self) -> list:
+        """流结束时处理缓冲区中没有换行结尾的最后一行"""
+        if self.done or not self._buffer:
+            return []
+        return self.feed(b"\n")
+
+    def _parse_line(self, buffer: bytearray, start: int, end: int):
+        if end > start and buffer[end - 1] == 0x0D:  # 去掉 \r
+            end -= 1
+        if not buffer.startswith(_DATA_PREFIX, start, end):
+            return None  # 空行、注释行和 event:/id: 等字段都不需要
+        start += len(_DATA_PREFIX)
+        while start < end and buffer[start] == 0x20:
+            start += 1
+        if buffer.startswith(_DONE, start, end):
+            self.done = True
+            return None
+
+        line = buffer[start:end].decode("utf-8")
+        delta_pos = line.find('"delta"')
+        if delta_pos < 0:
+            if '"error"' in line:
+                self.error = line
+                log.warning(f"流中返回错误: {line}")
+            return None
+        try:
+            content = self._find_string(line, '"content"', delta_pos)
+            reasoning = self._find_string(line, '"reasoning_content"', delta_pos)
+        except ValueError:
+            return self._parse_line_slow(line)
+        if not content and not reasoning:
+            return None
+        return Delta(content or "", reasoning or "")
+
+    @staticmethod
+    def _find_string(line: str, key: str, pos: int):
+        """
+        在pos之后查找 key 对应的字符串值
+        值为null或不存在时返回None，值不是字符串时抛出ValueError交给慢速路径处理
+        """
+        key_pos = line.find(key, pos)
+        if key_pos < 0:
+            return None
+        i = key_pos + len(key)
+        length = len(line)
+        while i < length and line[i] in " :":
+            i += 1
+        if line.startswith("null", i):
+            return None
+        if i >= length or line[i] != '"':
+            raise ValueError(f"{key} 不是字符串")
+        value, _ = scanstring(line, i + 1)
+        return value
+
+    @staticmethod
+    def _parse_line_slow(line: str):
+        """格式与预期不符时退回完整的JSON解析"""
+        try:
+            delta = json.loads(line).get("choices", [{}])[0].get("delta", {})
+        except (json.JSONDecodeError, IndexError, AttributeError) as e:
+            log.warning(f"SSE数据解析错误: {e}, 原始数据: {line}")
+            return None
+        content = str(delta.get("content") or "")
+        reasoning = str(delta.get("reasoning_content") or "")
+        if not content and not reasoning:
+            return None
+        return Delta(content, reasoning)
@@ -1,16 +1,17 @@
-import tempfile
 from .common import *
-from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QMessageBox, QGraphicsPixmapItem
+from PySide6.QtWidgets import QGraphicsView, QGraphicsScene, QMessageBox
 from PySide6.QtGui import QPixmap, QImage
-from PIL import Image
+from .ImagePrep import PixelBuffer
+
+MIN_SELECTION = 4  # 小于该边长（逻辑像素）的框选视为误触
 
 
 class Screenshot(QWidget):
 	"""
 	接口:1)调用:打开一个新窗口来调用，进行图片选择
-    2)发送信号:通过self.image_signal来发送图片,类型:pil
+    2)发送信号:通过self.image_signal来发送图片,类型:ImagePrep.PixelBuffer（直接引用QImage的像素内存）
 	"""
-	image_signal = Signal(object)  # 传输PIL.Image对象给ImageAgent
+	image_signal = Signal(object)  # 传输PixelBuffer给ImageAgent
 
 	def __init__(self):
 		super().__init__()
@@ -19,13 +20,12 @@ class Screenshot(QWidget):
 
 		# 初始化变量
 		self.save_path = os.path.expanduser("~/Pictures")
-		self.current_image_path = None
-		self.temp_image_path = os.path.join(tempfile.gettempdir(), f"qtshot_{os.getpid()}.png")
+		self.current_image = None  # 剪贴板中的截图（RGBA8888格式的QImage）
 
 		# 主界面
 		layout = QVBoxLayout(self)
 
-		_label = QLabel('    请使用系统截图工具（如Win+Shift+S）截图后返回本程序')
+		_label = QLabel('    点击“框选截图”直接截取屏幕区域，也可以使用系统截图工具（如Win+Shift+S）截图到剪贴板')
 		_label.setWordWrap(True)
 		layout.addWidget(_label)
 
@@ -38,8 +38,12 @@ class Screenshot(QWidget):
 		btn_layout = QHBoxLayout()
 		layout.addLayout(btn_layout)
 		# 截图按钮
+		self.region_btn = QPushButton("框选截图")
+		self.region_btn.clicked.connect(self.capture_region)
+		btn_layout.addWidget(self.region_btn)
+
 		self.capture_btn = QPushButton("刷新")
-		self.capture_btn.clicked.connect(self.capture_to_clipboard)
+		self.capture_btn.clicked.connect(self.check_clipboard)
 		btn_layout.addWidget(self.capture_btn)
 
 		# 发送按钮
@@ -47,9 +51,13 @@ class Screenshot(QWidget):
 		self.copy_btn.clicked.connect(self.picture_processing)
 		btn_layout.addWidget(self.copy_btn)
 
-		# 剪贴板监控定时器
-		self.clipboard_timer = QTimer()
-		self.clipboard_timer.timeout.connect(self.check_clipboard)
+		# 剪贴板内容变化时立即读取，不再定时轮询
+		QApplication.clipboard().dataChanged.connect(self.check_clipboard)
+
+		# 框选截图，截取期间隐藏本窗口
+		self.region_capture = RegionCapture()
+		self.region_capture.captured.connect(self.on_region_captured)
+		self.region_capture.cancelled.connect(self.show)
 
 		# 样式设置
 		self.setStyleSheet("""
@@ -69,101 +77,219 @@ class Screenshot(QWidget):
             QGraphicsView { border: 1px solid #ddd; }
         """)
 
-		# 跟踪所有临时文件
-		self.temp_files = []
-
-	def capture_to_clipboard(self):
-		"""调用系统截图工具（需提前截图到剪贴板）"""
-		self.clipboard_timer.start(500)  # 开始监控剪贴板
+		# 打开时剪贴板里可能已经有截图
+		self.check_clipboard()
 
 	def check_clipboard(self):
-		"""检查剪贴板中是否有图像"""
+		"""检查剪贴板中是否有图像，有则在内存中保存并预览"""
 		clipboard = QApplication.clipboard()
 		mime_data = clipboard.mimeData()
+		if mime_data is None or not mime_data.hasImage():
+			return
 
-		if mime_data.hasImage():
-			# 获取图像并转换为QPixmap
-			image = clipboard.image()
-			if not image.isNull():
-				# 保存到临时文件
-				if image.save(self.temp_image_path, "PNG"):
-					self.current_image_path = self.temp_image_path
-					pixmap = QPixmap.fromImage(image)
+		image = clipboard.image()
+		if image.isNull():
+			return
+		self.set_image(image)
+		print(f"收到剪贴板截图：{image.width()}x{image.height()}")
 
-					# 更新界面
-					self.preview_scene.clear()
-					pixmap_item = self.preview_scene.addPixmap(pixmap)
-					self.preview_view.fitInView(pixmap_item, Qt.KeepAspectRatio)  # 自动缩放适配视图
+	def set_image(self, image: QImage):
+		"""保存并预览截图"""
+		# 只转换一次格式，之后预处理直接读取这块内存
+		if image.format() != QImage.Format.Format_RGBA8888:
+			image = image.convertToFormat(QImage.Format.Format_RGBA8888)
+		self.current_image = image
 
-					self.clipboard_timer.stop()  # 找到图像后停止监控
-					self.temp_files.append(self.temp_image_path)  # 记录新临时文件
+		# 更新界面
+		self.preview_scene.clear()
+		pixmap_item = self.preview_scene.addPixmap(QPixmap.fromImage(image))
+		self.preview_view.fitInView(pixmap_item, Qt.KeepAspectRatio)  # 自动缩放适配视图
 
-					# 打印调试信息
-					print(f"截图已保存到：{self.temp_image_path}")
+	def capture_region(self):
+		"""隐藏本窗口后框选截图"""
+		self.hide()
+		QTimer.singleShot(200, self.region_capture.start)  # 等窗口从屏幕上消失
+
+	def on_region_captured(self, buffer):
+		self.set_image(buffer.owner)
+		self.show()
 
 	def picture_processing(self):
-		"""将当前图像转换为PIL.Image并通过信号传输"""
-		items = self.preview_scene.items()
-		if items and isinstance(items[0], QGraphicsPixmapItem):
-			# 获取QPixmap
-			qt_pixmap = items[0].pixmap()
-
-			# 转换为QImage
-			qt_image = qt_pixmap.toImage()
-
-			# 转换为PIL.Image
-			pil_image = self.qt_image_to_pil(qt_image)
-			if pil_image == 0:
-				QMessageBox.warning(self, '警告', '所选的图像为空图像')
-				return
-			elif pil_image == 1:
-				QMessageBox.warning(self, '警告', '图像转换失败')
-				return
-
-			# 发送图片
-			self.send_image_signal(pil_image)
-
-			# 保留原有功能：同时复制到系统剪贴板
-			QApplication.clipboard().setPixmap(qt_pixmap)
-
-			# 关闭窗口
-			self.close()
-
-	def send_image_signal(self, pil_image):
-		"""通过信号发送PIL.Image对象"""
-		self.image_signal.emit(pil_image)
-
-	def qt_image_to_pil(self, qt_image):
-		"""将图像转化为pil类型，以发送给AI"""
-		if qt_image.isNull():
-			return 0
+		"""把当前图像的像素内存包装为PixelBuffer并通过信号传输"""
+		buffer = self.qt_image_to_buffer(self.current_image)
+		if buffer is None:
+			QMessageBox.warning(self, '警告', '所选的图像为空图像')
+			return
+
+		# 发送图片
+		self.send_image_signal(buffer)
+
+		# 关闭窗口
+		self.close()
+
+	def send_image_signal(self, buffer):
+		"""通过信号发送PixelBuffer"""
+		self.image_signal.emit(buffer)
+
+	@staticmethod
+	def qt_image_to_buffer(qt_image):
+		"""
+		通过memoryview直接引用QImage的像素内存，不复制（QImage由PixelBuffer持有，保证内存有效）
+		:return: PixelBuffer，图像为空时返回None
+		"""
+		if qt_image is None or qt_image.isNull():
+			return None
 		if qt_image.format() != QImage.Format.Format_RGBA8888:
 			qt_image = qt_image.convertToFormat(QImage.Format.Format_RGBA8888)
-			if qt_image.isNull():
-				return 1
-		return Image.frombytes(
-			"RGBA",
+		return PixelBuffer(
+			qt_image.constBits(),
 			(qt_image.width(), qt_image.height()),
-			qt_image.constBits().tobytes(),
-			'raw', "RGBA"
+			qt_image.bytesPerLine(),
+			"RGBA",
+			owner=qt_image,
 		)
 
 	def closeEvent(self, event):
-		"""重写关闭事件处理"""
-		for file in self.temp_files:
-			try:
-				if os.path.exists(file):
-					os.unlink(file)
-			except Exception as e:
-				print(f"删除临时文件失败: {e}")
+		"""重写关闭事件处理：停止监听剪贴板"""
+		try:
+			QApplication.clipboard().dataChanged.disconnect(self.check_clipboard)
+		except (TypeError, RuntimeError):
+			pass  # 已经断开
 		super().closeEvent(event)
 
 
+class _ScreenOverlay(QWidget):
+	"""覆盖一块屏幕的全屏窗口，显示冻结的屏幕画面，在上面拖动鼠标框选区域"""
+
+	def __init__(self, screen, pixmap: QPixmap, controller):
+		super().__init__(None, Qt.WindowType.FramelessWindowHint | Qt.WindowType.WindowStaysOnTopHint | Qt.WindowType.Tool)
+		self.screen_pixmap = pixmap  # 设备像素的屏幕画面（devicePixelRatio为该屏幕的缩放比例）
+		self.controller = controller
+		self.origin = None
+		self.selection = QRect()  # 逻辑像素
+		self.setAttribute(Qt.WidgetAttribute.WA_DeleteOnClose)
+		self.setCursor(Qt.CursorShape.CrossCursor)
+		self.setScreen(screen)
+		self.setGeometry(screen.geometry())
+
+	def paintEvent(self, event):
+		painter = QPainter(self)
+		painter.drawPixmap(self.rect(), self.screen_pixmap)
+		painter.fillRect(self.rect(), QColor(0, 0, 0, 100))
+		if not self.selection.isEmpty():
+			# 选中的区域恢复原亮度
+			painter.drawPixmap(self.selection, self.screen_pixmap, self.device_rect(self.selection))
+			painter.setPen(QPen(QColor("#07C160"), 2))
+			painter.drawRect(self.selection)
+			size = self.device_rect(self.selection).size()
+			painter.setPen(QColor("white"))
+			painter.drawText(self.selection.topLeft() + QPoint(4, -6), f"{size.width()} x {size.height()}")
+		else:
+			painter.setPen(QColor("white"))
+			painter.drawText(
+				self.rect(), Qt.AlignmentFlag.AlignCenter,
+				"拖动鼠标框选区域，双击或按Enter截取整个屏幕，Esc取消"
+			)
+
+	def device_rect(self, rect: QRect) -> QRect:
+		"""逻辑像素的区域换算为屏幕画面中的设备像素区域（HiDPI屏幕上按缩放比例放大）"""
+		ratio = self.screen_pixmap.devicePixelRatio()
+		return QRect(
+			round(rect.x() * ratio), round(rect.y() * ratio),
+			round(rect.width() * ratio), round(rect.height() * ratio)
+		).intersected(self.screen_pixmap.rect())
+
+	def mousePressEvent(self, event: QMouseEvent):
+		if event.button() == Qt.MouseButton.LeftButton:
+			self.origin = event.position().toPoint()
+			self.selection = QRect()
+		elif event.button() == Qt.MouseButton.RightButton:
+			self.controller.cancel()
+
+	def mouseMoveEvent(self, event: QMouseEvent):
+		if self.origin is not None:
+			self.selection = QRect(self.origin, event.position().toPoint()).normalized()
+			self.update()
+
+	def mouseReleaseEvent(self, event: QMouseEvent):
+		if event.button() != Qt.MouseButton.LeftButton or self.origin is None:
+			return
+		self.origin = None
+		if self.selection.width() < MIN_SELECTION or self.selection.height() < MIN_SELECTION:
+			self.selection = QRect()
+			self.update()
+			return
+		self.controller.finish(self.screen_pixmap.copy(self.device_rect(self.selection)))
+
+	def mouseDoubleClickEvent(self, event: QMouseEvent):
+		self.controller.finish(self.screen_pixmap)
+
+	def keyPressEvent(self, event):
+		if event.key() == Qt.Key.Key_Escape:
+			self.controller.cancel()
+		elif event.key() in (Qt.Key.Key_Return, Qt.Key.Key_Enter):
+			if self.selection.isEmpty():
+				self.controller.finish(self.screen_pixmap)
+			else:
+				self.controller.finish(self.screen_pixmap.copy(self.device_rect(self.selection)))
+
+
+class RegionCapture(QObject):
+	"""
+	框选截图：先用QScreen.grabWindow冻结每块屏幕的画面，再在每块屏幕上覆盖一层窗口供框选
+	截图保持设备像素（HiDPI屏幕上不缩小），只在内存中传递，由ImageAgent的预处理编码一次
+	框选区域即感兴趣区域（ROI）；不框选时截取整块屏幕
+	"""
+	captured = Signal(object)  # PixelBuffer，其owner为RGBA8888格式的QImage
+	cancelled = Signal()
+
+	def __init__(self):
+		super().__init__()
+		self.overlays = []
+
+	def start(self) -> bool:
+		"""
+		:return: 是否成功截取屏幕画面（如部分Wayland环境不允许截屏）
+		"""
+		self.close_overlays()
+		# 先截取所有屏幕，再显示覆盖层，避免覆盖层出现在画面中
+		grabs = [(screen, screen.grabWindow(0)) for screen in QApplication.screens()]
+		grabs = [(screen, pixmap) for screen, pixmap in grabs if not pixmap.isNull()]
+		if not grabs:
+			print("无法截取屏幕画面，请使用系统截图工具截图到剪贴板")
+			self.cancelled.emit()
+			return False
+		for screen, pixmap in grabs:
+			overlay = _ScreenOverlay(screen, pixmap, self)
+			self.overlays.append(overlay)
+			overlay.showFullScreen()
+		self.overlays[0].activateWindow()
+		return True
+
+	def finish(self, pixmap: QPixmap):
+		self.close_overlays()
+		buffer = Screenshot.qt_image_to_buffer(pixmap.toImage())
+		if buffer is None:
+			self.cancelled.emit()
+			return
+		print(f"框选截图：{buffer.size[0]}x{buffer.size[1]}")
+		self.captured.emit(buffer)
+
+	def cancel(self):
+		self.close_overlays()
+		self.cancelled.emit()
+
+	def close_overlays(self):
+		for overlay in self.overlays:
+			overlay.close()
+		self.overlays = []
+
+
 if __name__ == "__main__":
 	app = QApplication([])
 	window = Screenshot()
 
-	window.image_signal.connect(lambda img: print(f"接收到PIL.Image对象，尺寸: {img.size}"))
+	window.image_signal.connect(lambda img: print(f"接收到PixelBuffer，尺寸: {img.size}"))
 
 	window.show()
 	app.exec()
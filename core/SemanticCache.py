@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.92  # 余弦相似度不低于该值时视为同一个问题
+DEFAULT_WINDOWS = ()  # 默认关闭，需用 set_enabled 或 configure 对窗口单独开启
+
+_FENCED = re.compile(r"```.*?(?:```|$)", re.S)
+_INLINE = re.compile(r"`[^`\n]+`")
+_CODE_CHARS = re.compile(r"[=(){}\[\];<>+\-*/%#]")  # 出现在行中时按代码对待的半角符号
+
+
+def split_prompt(prompt: str):
+    """
+    把问题拆成 (自然语言部分, 代码部分)
+    代码部分包括```代码块、`行内代码`和含有代码符号的行，只差一个字符的代码可能是完全不同的错误，
+    只能精确比较；自然语言部分才用向量比较相似度
+    """
+    code = _FENCED.findall(prompt) + _INLINE.findall(prompt)
+    text = []
+    for line in _INLINE.sub(" ", _FENCED.sub("\n", prompt)).splitlines():
+        if _CODE_CHARS.search(line):
+            code.append(line)
+        elif line.strip():
+            text.append(line.strip())
+    return "\n".join(text), "\n".join(line.rstrip() for line in code).strip()
+
+
+def code_key(code: str) -> str:
+    return hashlib.sha256(code.encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """
+    语义回答缓存，只有一个实例
+    问题中的代码部分必须完全相同，自然语言部分用RAG同一个bge-small-zh模型编码成向量，
+    与之前的问题比较相似度，足够相似时直接返回之前的回答，不再调用API
+    每个窗口有独立的向量索引，默认关闭，需要对窗口单独开启
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "SemanticCache":
+        with SemanticCache._lock:
+            if SemanticCache._instance is None:
+                SemanticCache._instance = SemanticCache()
+        return SemanticCache._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "SemanticCache":
+        """用指定参数重建共享实例（如开启某些窗口的语义缓存）"""
+        with SemanticCache._lock:
+            SemanticCache._instance = SemanticCache(**kwargs)
+        return SemanticCache._instance
+
+    def __init__(
+        self,
+        encoder=None,
+        threshold=DEFAULT_THRESHOLD,
+        max_entries=500,
+        enabled_windows=DEFAULT_WINDOWS,
+    ):
+        """
+        :param encoder: camel的embedding模型，默认与RAG共用同一个
+        :param threshold: 命中所需的最低余弦相似度
+        :param max_entries: 每个窗口最多保存的问题数，超出时淘汰最早的
+        :param enabled_windows: 默认开启语义缓存的窗口id
+        """
+        self._encoder = encoder
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.enabled_windows = set(enabled_windows)
+        self._indexes = {}  # 窗口id -> OrderedDict(问题 -> (代码哈希, 向量, 回答分片))
+        self._index_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def encoder(self):
+        if self._encoder is None:
+            from .RAG import get_encoder
+
+            self._encoder = get_encoder()
+        return self._encoder
+
+    def set_enabled(self, window_id: int, enabled=True):
+        """对某个窗口开启或关闭语义缓存"""
+        if enabled:
+            self.enabled_windows.add(window_id)
+        else:
+            self.enabled_windows.discard(window_id)
+            self.invalidate(window_id)
+
+    def is_enabled(self, window_id: int) -> bool:
+        return window_id in self.enabled_windows
+
+    def _embed(self, text: str):
+        """自然语言部分编码成单位向量，没有自然语言时返回None"""
+        if not text:
+            return None
+        vector = np.asarray(self.encoder.embed_list([text])[0], dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _key(self, prompt: str):
+        """返回 (代码哈希, 自然语言向量)"""
+        text, code = split_prompt(prompt)
+        return code_key(code), self._embed(text)
+
+    @staticmethod
+    def _similarity(a, b) -> float:
+        if a is None or b is None:
+            return 1.0 if a is None and b is None else 0.0
+        return float(a @ b)
+
+    def _nearest(self, index: OrderedDict, key: str, vector):
+        """在代码完全相同的问题中找自然语言最相似的，返回 (相似度, 问题)，没有时返回 (0, None)"""
+        best = (0.0, None)
+        for prompt, (stored_key, stored_vector, _) in index.items():
+            if stored_key != key:
+                continue
+            score = self._similarity(stored_vector, vector)
+            if best[1] is None or score > best[0]:
+                best = (score, prompt)
+        return best
+
+    def lookup(self, window_id: int, prompt: str):
+        """返回最相似问题的回答分片，没有足够相似的问题时返回None"""
+        if not self.is_enabled(window_id):
+            return None
+        key, vector = self._key(prompt)
+        with self._index_lock:
+            index = self._indexes.get(window_id, OrderedDict())
+            score, nearest = self._nearest(index, key, vector)
+            if nearest is None or score < self.threshold:
+                self.misses += 1
+                return None
+            index.move_to_end(nearest)
+            self.hits += 1
+            chunks = index[nearest][2]
+        log.info(
+            f"语义缓存命中(窗口{window_id}, 相似度{score:.3f}): {prompt!r} ≈ {nearest!r}"
+        )
+        return chunks
+
+    def store(self, window_id: int, prompt: str, chunks: list):
+        """保存一次完整的回答"""
+        if not self.is_enabled(window_id) or not chunks:
+            return
+        key, vector = self._key(prompt)
+        with self._index_lock:
+            index = self._indexes.setdefault(window_id, OrderedDict())
+            index[prompt.strip()] = (key, vector, list(chunks))
+            index.move_to_end(prompt.strip())
+            while len(index) > self.max_entries:
+                index.popitem(last=False)
+
+    def invalidate(self, window_id=None, prompt=None) -> int:
+        """
+        删除缓存，返回删除的条数
+        :param window_id: 为None时作用于所有窗口
+        :param prompt: 为None时清空，否则只删除与该问题足够相似的条目
+        """
+        key, vector = self._key(prompt) if prompt is not None else (None, None)
+        removed = 0
+        with self._index_lock:
+            ids = list(self._indexes) if window_id is None else [window_id]
+            for id in ids:
+                index = self._indexes.get(id)
+                if not index:
+                    continue
+                if prompt is None:
+                    removed += len(index)
+                    index.clear()
+                    continue
+                for p in [
+                    p
+                    for p, (k, v, _) in index.items()
+                    if k == key and self._similarity(v, vector) >= self.threshold
+                ]:
+                    del index[p]
+                    removed += 1
+        log.info(f"语义缓存删除了 {removed} 条")
+        return removed
+
+    def stats(self) -> dict:
+        with self._index_lock:
+            entries = {id: len(index) for id, index in self._indexes.items()}
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+            "enabled_windows": sorted(self.enabled_windows),
+        }
@@ -0,0 +1,707 @@
+"""
+无界面的服务模式：在一个常驻进程中运行文字、RAG、Debug和图片四个agent，通过本机HTTP和WebSocket提供流式接口
+多个客户端共用同一个已加载的embedding模型、回答缓存和keep-alive连接池
+
+用法（在项目根目录执行）:
+    python -m core.Server --port 8080 --per-client 2
+
+HTTP（请求体为JSON；默认以SSE流式返回 data: {"content": ...} / data: {"error": ...}，最后为 data: [DONE]；
+请求体中 "stream": false 时等待完成后返回 {"content": ..., "errors": [...]}）:
+    POST /api/chat   {"message": ..., "conversation": 可选，相同的对话共享历史记录，空闲30分钟后删除}
+    POST /api/rag    {"question": ..., "conversation": 可选}
+    POST /api/debug  {"problem": ..., "code": ..., "language": ...}
+    POST /api/image  {"image": base64编码的图片, "question": ...}
+    GET  /api/status 排队和并发情况、各缓存的命中情况
+    DELETE /api/semantic_cache  清空语义缓存（可选 {"window": 窗口id, "prompt": 只删除与该问题相似的回答}）
+
+WebSocket（GET /ws）: 每条消息为 {"id": 客户端自定的请求id, "agent": "chat"/"rag"/"debug"/"image", 其余字段同上}，
+服务端逐条返回 {"id", "content"} 或 {"id", "error"}，结束时返回 {"id", "done": true}；发送 {"id", "cancel": true} 取消请求
+
+客户端以请求头 X-Client-Id 区分（缺省为IP地址），每个客户端同时进行的请求数受限；
+收到 SIGINT/SIGTERM 后不再受理新请求，等待进行中的请求完成（最长 --grace 秒）后退出
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import itertools
+import json
+import logging
+import queue
+import signal
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+from PySide6.QtCore import QCoreApplication, QObject, QTimer, Signal
+
+from .Agent_1 import MyChatAgent
+from .Agent_2 import StructuredAgentThread, build_debug_prompt, is_supported_language
+from .HttpClient import HttpClient
+from .ImageAgent import ImageWorker
+from .ImageCache import ImageCache
+from .Metrics import Metrics
+from .RAG import build_rag_prompt
+from .RateLimiter import RateLimiter
+from .SemanticCache import SemanticCache
+from .Signals import Signals
+from .SingleFlight import SingleFlight
+from .StreamEngine import StreamEngine
+
+log = logging.getLogger(__name__)
+
+FIRST_WINDOW_ID = 1000  # 服务模式的请求使用的窗口id起点，与界面中的窗口互不干扰
+METRICS_LABEL = "server-"  # 服务模式的请求按 server-<agent> 汇总指标，不按每个请求的窗口id
+AGENTS = ("chat", "rag", "debug", "image")
+DEFAULT_MAX_PENDING = 64  # 同时受理（排队和执行中）的请求总数上限
+DEFAULT_PER_CLIENT = 2  # 每个客户端同时进行的请求数上限
+DEFAULT_GRACE = 30  # 退出时等待进行中的请求完成的最长时间（秒）
+MAX_BODY_BYTES = 20 * 1024 * 1024  # 请求体（含base64图片）的大小上限
+CONVERSATION_TTL = 30 * 60  # 对话空闲超过该时间（秒）后删除历史记录
+MAX_CONVERSATIONS = 256  # 最多保留的对话数，超出时删除最久未使用的
+
+_WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B85"
+
+
+class ServiceError(Exception):
+    """请求无法受理，status为返回给客户端的HTTP状态码"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Job:
+    """一次请求：由主线程交给agent处理，输出放入队列，由处理连接的线程读取"""
+
+    def __init__(self, client, agent, message, conversation=None, image=None):
+        self.client = client
+        self.agent = agent
+        self.message = message  # 发给agent的完整提示词（图片请求为问题）
+        self.conversation = conversation
+        self.image = image
+        self.window_id = None
+        self.worker = None
+        self.events = queue.Queue()  # ("content" / "error", 文本)，("done", None) 表示结束
+        self.done = threading.Event()
+
+    def put(self, kind, value):
+        if not self.done.is_set():
+            self.events.put((kind, value))
+
+    def fail(self, message):
+        self.put("error", message)
+        self.finish()
+
+    def finish(self):
+        if not self.done.is_set():
+            self.done.set()
+            self.events.put(("done", None))
+
+    def iter_events(self):
+        while True:
+            kind, value = self.events.get()
+            if kind == "done":
+                return
+            yield kind, value
+
+
+class Admission:
+    """请求受理：限制总数和每个客户端的并发数，退出时停止受理并等待进行中的请求"""
+
+    def __init__(self, max_pending=DEFAULT_MAX_PENDING, per_client=DEFAULT_PER_CLIENT):
+        self.max_pending = max_pending
+        self.per_client = per_client
+        self.active = {}  # 客户端 -> 进行中的请求数
+        self.total = 0
+        self.rejected = 0
+        self.draining = False
+        self._condition = threading.Condition()
+
+    def acquire(self, client):
+        with self._condition:
+            error = None
+            if self.draining:
+                error = ServiceError(503, "服务正在关闭")
+            elif self.total >= self.max_pending:
+                error = ServiceError(503, "服务繁忙，请稍后重试")
+            elif self.active.get(client, 0) >= self.per_client:
+                error = ServiceError(429, f"每个客户端最多同时进行{self.per_client}个请求")
+            if error is not None:
+                self.rejected += 1
+                raise error
+            self.active[client] = self.active.get(client, 0) + 1
+            self.total += 1
+
+    def release(self, client):
+        with self._condition:
+            self.active[client] -= 1
+            if not self.active[client]:
+                del self.active[client]
+            self.total -= 1
+            self._condition.notify_all()
+
+    def drain(self):
+        with self._condition:
+            self.draining = True
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            return {
+                "active_requests": self.total,
+                "max_pending": self.max_pending,
+                "per_client": self.per_client,
+                "clients": dict(self.active),
+                "rejected": self.rejected,
+                "draining": self.draining,
+            }
+
+    def wait_idle(self, timeout) -> bool:
+        with self._condition:
+            return self._condition.wait_for(lambda: self.total == 0, timeout)
+
+
+class AgentHub(QObject):
+    """
+    在主线程中持有各个agent，把连接线程提交的Job转交给对应的agent，并把输出放回Job
+    agent和worker的Qt信号都在主线程中处理，与界面中的用法相同
+    """
+
+    submitted = Signal(object)
+    cancel_requested = Signal(object)
+    quit_requested = Signal()
+
+    def __init__(
+        self,
+        chat_agent,
+        rag_storage,
+        model,
+        vision_model,
+        fallback_model=None,
+        fallback_vision_model=None,
+    ):
+        super().__init__()
+        self.chat_agent = chat_agent
+        self.rag_storage = rag_storage
+        self.model = model
+        self.vision_model = vision_model
+        self.fallback_model = fallback_model
+        self.fallback_vision_model = fallback_vision_model
+        self._ids = itertools.count(FIRST_WINDOW_ID)
+        self._jobs = {}  # 窗口id -> 进行中的文字/RAG请求
+        self._conversations = OrderedDict()  # (客户端, agent, 对话) -> (窗口id, 最近使用时间)，按使用顺序排列
+        self._rag_lock = threading.Lock()
+
+        # 跨线程emit，由Qt排队到主线程执行
+        self.submitted.connect(self._start)
+        self.cancel_requested.connect(self._cancel)
+        Signals.instance().agent_stream_signal.connect(self._on_stream)
+        # 服务空闲时也定期清理过期的对话
+        self._expire_timer = QTimer(self)
+        self._expire_timer.timeout.connect(self._expire_conversations)
+        self._expire_timer.start(60 * 1000)
+
+    def prepare(self, client, agent, payload) -> Job:
+        """在连接线程中校验参数并构建提示词（RAG检索和图片解码较慢，不放在主线程）"""
+
+        def field(name):
+            value = payload.get(name)
+            if not isinstance(value, str) or not value.strip():
+                raise ServiceError(400, f"缺少字段 {name}")
+            return value
+
+        conversation = payload.get("conversation")
+        if agent == "chat":
+            return Job(client, agent, field("message"), conversation)
+        if agent == "rag":
+            question = field("question")
+            with self._rag_lock:
+                material = self.rag_storage.query(question)
+            return Job(client, agent, build_rag_prompt(material, question), conversation)
+        if agent == "debug":
+            language = field("language")
+            if not is_supported_language(language):
+                raise ServiceError(400, f"目前不支持debug {language} 语言")
+            return Job(client, agent, build_debug_prompt(field("problem"), field("code"), language))
+        if agent == "image":
+            try:
+                image = base64.b64decode(field("image"))
+                Image.open(io.BytesIO(image)).verify()
+            except (ValueError, OSError) as e:
+                raise ServiceError(400, f"无法解析图片: {e}")
+            # 直接把编码后的数据交给ImageWorker，预处理结果按内容哈希缓存
+            return Job(client, agent, field("question"), image=image)
+        raise ServiceError(404, f"未知的agent: {agent}")
+
+    def _window_for(self, job: Job) -> int:
+        if job.conversation is None:
+            return next(self._ids)
+        self._expire_conversations()
+        key = (job.client, job.agent, str(job.conversation))
+        window_id = self._conversations[key][0] if key in self._conversations else next(self._ids)
+        self._conversations[key] = (window_id, time.monotonic())
+        self._conversations.move_to_end(key)
+        return window_id
+
+    def _expire_conversations(self):
+        """删除空闲超时的对话，对话数超出上限时再删除最久未使用的（进行中的对话除外）"""
+        now = time.monotonic()
+        for key, (window_id, last_used) in list(self._conversations.items()):
+            if window_id in self._jobs:
+                continue
+            if now - last_used < CONVERSATION_TTL and len(self._conversations) < MAX_CONVERSATIONS:
+                break  # 按使用顺序排列，之后的都更新
+            del self._conversations[key]
+            self._forget_window(window_id)
+
+    def _forget_window(self, window_id: int):
+        self.chat_agent.memory.clear(window_id)
+        self.chat_agent.prompt.pop(window_id, None)
+        Metrics.instance().clear_label(window_id)
+
+    def _release(self, job: Job):
+        """请求结束：没有对话的请求不会再使用它的窗口，删除历史记录"""
+        if job.conversation is None and job.window_id is not None:
+            self._forget_window(job.window_id)
+        job.finish()
+
+    def _start(self, job: Job):
+        if job.done.is_set():
+            return  # 开始前已被取消
+        if job.agent in ("chat", "rag"):
+            job.window_id = self._window_for(job)
+            Metrics.instance().set_label(job.window_id, METRICS_LABEL + job.agent)
+            previous = self._jobs.pop(job.window_id, None)
+            if previous is not None:
+                previous.fail("同一对话有新的请求，本请求已被取代")
+            self._jobs[job.window_id] = job
+            self.chat_agent.receive_message(job.message, job.window_id)
+            return
+        job.window_id = next(self._ids)
+        Metrics.instance().set_label(job.window_id, METRICS_LABEL + job.agent)
+        if job.agent == "debug":
+            job.worker = StructuredAgentThread(
+                self.model, job.message, job.window_id, self.fallback_model
+            )
+            job.worker.result_ready.connect(partial(self._on_result, job))
+        else:
+            job.worker = ImageWorker(
+                self.vision_model,
+                job.image,
+                job.message,
+                self.fallback_vision_model,
+                id=job.window_id,
+            )
+            job.worker.message_received.connect(partial(self._on_image_stream, job))
+            job.worker.finished.connect(lambda _id, job=job: self._release(job))
+        job.worker.start()
+
+    def _on_stream(self, id: int, content: str):
+        job = self._jobs.get(id)
+        if job is None:
+            return  # 界面窗口或已取消的请求
+        if content == "<EOS>":
+            del self._jobs[id]
+            self._release(job)
+        elif content.startswith("[ERROR]"):
+            job.put("error", content[len("[ERROR]"):].strip())
+        else:
+            job.put("content", content)
+
+    def _on_image_stream(self, job: Job, _id: int, content: str):
+        if content.startswith("[ERROR]"):
+            job.put("error", content[len("[ERROR]"):].strip())
+        else:
+            job.put("content", content)
+
+    def _on_result(self, job: Job, result: list, *args):
+        for item in result:
+            item = str(item)
+            if item.startswith("[ERROR]"):
+                job.put("error", item[len("[ERROR]"):].strip())
+            else:
+                job.put("content", item)
+        self._release(job)
+
+    def _cancel(self, job: Job):
+        if job.done.is_set():
+            return
+        if job.agent in ("chat", "rag"):
+            if self._jobs.get(job.window_id) is job:
+                del self._jobs[job.window_id]
+                self.chat_agent.cancel(job.window_id)
+        elif job.worker is not None:
+            StreamEngine.instance().cancel(job.worker)
+        self._release(job)
+
+
+class WebSocketConnection:
+    """最简的WebSocket帧读写（RFC 6455），只用于本服务"""
+
+    TEXT, BINARY, CLOSE, PING, PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+
+    def __init__(self, rfile, wfile):
+        self.rfile = rfile
+        self.wfile = wfile
+        self._send_lock = threading.Lock()
+
+    def _read_exact(self, size) -> bytes:
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise ConnectionError("WebSocket连接已断开")
+        return data
+
+    def receive(self):
+        """读取一条完整的消息（合并分片），返回 (opcode, 内容)"""
+        message = b""
+        message_opcode = None
+        while True:
+            first, second = self._read_exact(2)
+            opcode = first & 0x0F
+            length = second & 0x7F
+            if length == 126:
+                length = struct.unpack("!H", self._read_exact(2))[0]
+            elif length == 127:
+                length = struct.unpack("!Q", self._read_exact(8))[0]
+            if len(message) + length > MAX_BODY_BYTES:
+                raise ValueError("WebSocket消息过大")
+            mask = self._read_exact(4) if second & 0x80 else None
+            payload = self._read_exact(length)
+            if mask and length:
+                key = int.from_bytes((mask * (length // 4 + 1))[:length], "big")
+                payload = (int.from_bytes(payload, "big") ^ key).to_bytes(length, "big")
+            if opcode >= 0x8:
+                return opcode, payload  # 控制帧不会分片
+            if opcode:
+                message_opcode = opcode
+            message += payload
+            if first & 0x80:
+                return message_opcode, message
+
+    def send(self, opcode, payload: bytes):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 1 << 16:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        with self._send_lock:
+            self.wfile.write(header + payload)
+            self.wfile.flush()
+
+    def send_json(self, data):
+        self.send(self.TEXT, json.dumps(data, ensure_ascii=False).encode("utf-8"))
+
+
+class BugsyService:
+    """本机HTTP和WebSocket接口，负责受理请求、转发流式输出和优雅退出"""
+
+    def __init__(
+        self,
+        hub: AgentHub,
+        host="127.0.0.1",
+        port=8080,
+        max_pending=DEFAULT_MAX_PENDING,
+        per_client=DEFAULT_PER_CLIENT,
+    ):
+        self.hub = hub
+        self.admission = Admission(max_pending, per_client)
+        self._jobs = set()  # 进行中的请求，超时退出时统一取消
+        self._jobs_lock = threading.Lock()
+        self._shutting_down = threading.Event()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+
+    def serve(self):
+        threading.Thread(target=self.httpd.serve_forever, name="BugsyService", daemon=True).start()
+        host, port = self.httpd.server_address[:2]
+        log.info(f"Bugsy服务已在 http://{host}:{port} 上运行")
+
+    def submit(self, client, agent, payload) -> Job:
+        """受理请求并交给主线程处理，无法受理时抛出ServiceError"""
+        if agent not in AGENTS:
+            raise ServiceError(404, f"未知的agent: {agent}")
+        self.admission.acquire(client)
+        try:
+            job = self.hub.prepare(client, agent, payload)
+        except BaseException:
+            self.admission.release(client)
+            raise
+        with self._jobs_lock:
+            self._jobs.add(job)
+        self.hub.submitted.emit(job)
+        return job
+
+    def cancel(self, job: Job):
+        self.hub.cancel_requested.emit(job)
+
+    def finish(self, job: Job):
+        """连接线程读完（或放弃）请求的输出后调用"""
+        with self._jobs_lock:
+            if job not in self._jobs:
+                return
+            self._jobs.discard(job)
+        if not job.done.is_set():
+            self.cancel(job)
+        self.admission.release(job.client)
+
+    def status(self) -> dict:
+        return {
+            **self.admission.snapshot(),
+            "engine_tasks": StreamEngine.instance().active_count(),
+            "coalescing": SingleFlight.instance().stats(),
+            "rate_limit": RateLimiter.instance().stats(),
+            "image_cache": ImageCache.instance().stats(),
+            "semantic_cache": SemanticCache.instance().stats(),
+        }
+
+    def shutdown(self, grace=DEFAULT_GRACE):
+        """停止受理新请求，等待进行中的请求完成，超时后取消剩余请求，然后退出事件循环"""
+        if self._shutting_down.is_set():
+            return
+        self._shutting_down.set()
+        log.info(f"Bugsy服务开始关闭，最多等待{grace}秒")
+        self.admission.drain()
+        if not self.admission.wait_idle(grace):
+            with self._jobs_lock:
+                jobs = list(self._jobs)
+            log.warning(f"仍有{len(jobs)}个请求未完成，取消")
+            for job in jobs:
+                self.cancel(job)
+            self.admission.wait_idle(5)
+        self.httpd.shutdown()
+        self.hub.quit_requested.emit()
+
+    def handle_websocket(self, handler):
+        key = handler.headers.get("Sec-WebSocket-Key")
+        if not key:
+            handler.send_error(400, "缺少 Sec-WebSocket-Key")
+            return
+        accept = base64.b64encode(hashlib.sha1((key + _WS_GUID).encode("ascii")).digest())
+        handler.send_response(101, "Switching Protocols")
+        handler.send_header("Upgrade", "websocket")
+        handler.send_header("Connection", "Upgrade")
+        handler.send_header("Sec-WebSocket-Accept", accept.decode("ascii"))
+        handler.end_headers()
+        handler.close_connection = True
+
+        connection = WebSocketConnection(handler.rfile, handler.wfile)
+        client = handler.client_id()
+        jobs = {}  # 请求id -> Job
+        try:
+            while True:
+                opcode, data = connection.receive()
+                if opcode == connection.CLOSE:
+                    connection.send(connection.CLOSE, data[:2])
+                    break
+                if opcode == connection.PING:
+                    connection.send(connection.PONG, data)
+                    continue
+                if opcode != connection.TEXT:
+                    continue
+                try:
+                    request = json.loads(data)
+                    request_id = request.get("id")
+                except (ValueError, AttributeError):
+                    connection.send_json({"error": "消息必须是JSON对象"})
+                    continue
+                if request.get("cancel"):
+                    if request_id in jobs:
+                        self.cancel(jobs[request_id])
+                    continue
+                try:
+                    job = self.submit(client, request.get("agent"), request)
+                except ServiceError as e:
+                    connection.send_json({"id": request_id, "error": e.message, "status": e.status})
+                    continue
+                jobs[request_id] = job
+                threading.Thread(
+                    target=self._forward_websocket,
+                    args=(connection, request_id, job, jobs),
+                    daemon=True,
+                ).start()
+        except (ConnectionError, OSError, ValueError) as e:
+            log.debug(f"WebSocket连接结束: {e}")
+        finally:
+            for job in list(jobs.values()):
+                self.cancel(job)
+
+    def _forward_websocket(self, connection, request_id, job, jobs):
+        try:
+            for kind, value in job.iter_events():
+                connection.send_json({"id": request_id, kind: value})
+            connection.send_json({"id": request_id, "done": True})
+        except OSError:
+            self.cancel(job)
+        finally:
+            if jobs.get(request_id) is job:
+                del jobs[request_id]
+            self.finish(job)
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                log.debug(f"{self.address_string()} {format % args}")
+
+            def client_id(self) -> str:
+                return self.headers.get("X-Client-Id") or self.client_address[0]
+
+            def send_json(self, status, data):
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/api/status":
+                    self.send_json(200, service.status())
+                elif self.path == "/ws" and self.headers.get("Upgrade", "").lower() == "websocket":
+                    service.handle_websocket(self)
+                else:
+                    self.send_json(404, {"error": "未知的路径"})
+
+            def do_DELETE(self):
+                if self.path.rstrip("/") != "/api/semantic_cache":
+                    self.send_json(404, {"error": "未知的路径"})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                try:
+                    payload = json.loads(self.rfile.read(min(length, MAX_BODY_BYTES)) or b"{}")
+                    if not isinstance(payload, dict):
+                        raise ValueError
+                except ValueError:
+                    self.send_json(400, {"error": "请求体必须是JSON对象"})
+                    return
+                removed = SemanticCache.instance().invalidate(payload.get("window"), payload.get("prompt"))
+                self.send_json(200, {"removed": removed})
+
+            def do_POST(self):
+                agent = self.path.rstrip("/").rsplit("/", 1)[-1]
+                if not self.path.startswith("/api/") or agent not in AGENTS:
+                    self.send_json(404, {"error": "未知的路径"})
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                if length > MAX_BODY_BYTES:
+                    self.send_json(413, {"error": "请求体过大"})
+                    self.close_connection = True
+                    return
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                    if not isinstance(payload, dict):
+                        raise ValueError
+                except ValueError:
+                    self.send_json(400, {"error": "请求体必须是JSON对象"})
+                    return
+                try:
+                    job = service.submit(self.client_id(), agent, payload)
+                except ServiceError as e:
+                    self.send_json(e.status, {"error": e.message})
+                    return
+                try:
+                    if payload.get("stream", True):
+                        self.stream(job)
+                    else:
+                        content, errors = [], []
+                        for kind, value in job.iter_events():
+                            (content if kind == "content" else errors).append(value)
+                        self.send_json(200, {"content": "".join(content), "errors": errors})
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # 客户端断开，finish中会取消请求
+                finally:
+                    service.finish(job)
+
+            def stream(self, job: Job):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for kind, value in job.iter_events():
+                    event = json.dumps({kind: value}, ensure_ascii=False)
+                    self.write_chunk(f"data: {event}\n\n".encode("utf-8"))
+                self.write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bugsy服务模式")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING, help="同时受理的请求总数上限")
+    parser.add_argument("--per-client", type=int, default=DEFAULT_PER_CLIENT, help="每个客户端的并发请求数上限")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时进行的模型请求数")
+    parser.add_argument("--grace", type=float, default=DEFAULT_GRACE, help="退出时等待进行中请求的秒数")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    app = QCoreApplication(sys.argv[:1])
+
+    from .Model import (
+        FALLBACK_MODEL_TYPE,
+        FALLBACK_VISION_MODEL_TYPE,
+        HEDGE_CONFIG,
+        create_fallback,
+        model,
+        vision_model,
+    )
+    from .RAG import RAGStorage
+
+    StreamEngine.configure(max_concurrency=args.concurrency)
+    HttpClient.configure(pool_maxsize=max(16, args.concurrency))
+    HttpClient.instance().preconnect(model._url)
+    fallback_model = create_fallback(model, FALLBACK_MODEL_TYPE)
+    hub = AgentHub(
+        MyChatAgent(model, hedge=HEDGE_CONFIG, fallback_model=fallback_model),
+        RAGStorage(similarity_threshold=0.6, top_k=1),
+        model,
+        vision_model,
+        fallback_model,
+        create_fallback(vision_model, FALLBACK_VISION_MODEL_TYPE),
+    )
+    service = BugsyService(hub, args.host, args.port, args.max_pending, args.per_client)
+    hub.quit_requested.connect(app.quit)
+
+    def request_shutdown(signum, frame):
+        threading.Thread(target=service.shutdown, args=(args.grace,), daemon=True).start()
+
+    signal.signal(signal.SIGINT, request_shutdown)
+    signal.signal(signal.SIGTERM, request_shutdown)
+    # Qt事件循环中Python的信号处理函数只在执行Python代码时运行，定时唤醒一下
+    wakeup = QTimer()
+    wakeup.timeout.connect(lambda: None)
+    wakeup.start(200)
+
+    service.serve()
+    app.exec()
+    StreamEngine.instance().shutdown()
+    Metrics.instance().shutdown()
+    log.info("Bugsy服务已退出")
+
+
+if __name__ == "__main__":
+    main()
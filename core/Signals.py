@@ -15,10 +15,12 @@ class Signals(QObject):
     chat_agent_response_signal = Signal(list)  # AI回复的信号
     to_debug_agent_signal = Signal(str)
     debug_agent_response_signal = Signal(list)
-    to_image_agent_signal = Signal(str, str)
+    to_image_agent_signal = Signal(object, str)  # (图片路径或内存中的图片, 问题)
     image_agent_response_signal = Signal(list)
     to_rag_agent_signal = Signal(str)
     rag_agent_response_signal = Signal(list)
+    agent_stream_signal = Signal(int, str)  # 流式回复的信号：(窗口id, 增量内容)，"<EOS>"表示结束
+    agent_status_signal = Signal(int, str)  # 请求状态（如限流排队）的信号：(窗口id, 提示文字)
 
     @staticmethod
     def instance() -> "Signals":
@@ -64,3 +66,15 @@ class Signals(QObject):
 
     def send_rag_agent_response(self, content):
         self.rag_agent_response_signal.emit(content)
+
+    def send_agent_stream(self, id, content):
+        """
+        向窗口id对应的ChatList发送一段流式回复
+        """
+        self.agent_stream_signal.emit(id, content)
+
+    def send_agent_status(self, id, text):
+        """
+        在窗口id对应的ChatList的等待提示中显示请求状态，可在后台线程调用
+        """
+        self.agent_status_signal.emit(id, text)
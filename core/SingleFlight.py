@@ -0,0 +1,129 @@
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Flight:
+    """
+    一次共享的上游流式请求
+    领头的请求把分片写入flight，其余相同的请求从头按顺序读取；
+    所有参与者都离开（取消）后调用 on_abandoned 关闭上游连接
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []  # 已产出的内容（包括错误提示），按到达顺序
+        self.finished = False
+        self.complete = False
+        self.subscribers = 1  # 仍在等待输出的参与者数，包括领头的请求
+        self.on_abandoned = None
+        self._condition = threading.Condition()
+
+    def try_join(self) -> bool:
+        """加入还在进行中的flight，已结束或已被放弃时返回False"""
+        with self._condition:
+            if self.finished or self.subscribers == 0:
+                return False
+            self.subscribers += 1
+            return True
+
+    def leave(self):
+        """参与者被取消；最后一个参与者离开时放弃上游请求"""
+        with self._condition:
+            self.subscribers -= 1
+            abandoned = self.subscribers == 0 and not self.finished
+        if abandoned and self.on_abandoned is not None:
+            self.on_abandoned()
+
+    def has_subscribers(self) -> bool:
+        with self._condition:
+            return self.subscribers > 0
+
+    def publish(self, content: str):
+        with self._condition:
+            self.chunks.append(content)
+            self._condition.notify_all()
+
+    def finish(self, complete: bool):
+        with self._condition:
+            self.finished = True
+            self.complete = complete
+            self._condition.notify_all()
+
+    def iter_chunks(self, stop):
+        """
+        从头产出所有分片，直到flight结束
+        :param stop: 返回True时提前结束（参与者被取消）
+        """
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.chunks) and not self.finished:
+                    self._condition.wait(0.5)
+                    if stop():
+                        return
+                new = self.chunks[index:]
+                finished = self.finished
+            index += len(new)
+            for content in new:
+                if stop():
+                    return
+                yield content
+            if finished:
+                return
+
+
+class SingleFlight:
+    """
+    相同请求的合并，只有一个实例
+    模型、参数和消息都相同的请求同时进行时只向上游发送一次，其余请求共享同一个流式输出
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "SingleFlight":
+        with SingleFlight._lock:
+            if SingleFlight._instance is None:
+                SingleFlight._instance = SingleFlight()
+        return SingleFlight._instance
+
+    def __init__(self):
+        self._flights = {}  # key -> 进行中的Flight
+        self._flights_lock = threading.Lock()
+        self.upstream_requests = 0  # 实际发出的请求数
+        self.coalesced_requests = 0  # 合并到已有请求上、节省的请求数
+
+    def join(self, key):
+        """
+        :param key: 请求的key，与 ResponseCache.make_key 相同
+        :return: (Flight, 是否为领头的请求)；领头的请求负责发出请求、写入分片并在结束时调用 done()
+        """
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.try_join():
+                self.coalesced_requests += 1
+                log.info(f"合并相同的进行中请求，已节省{self.coalesced_requests}次调用")
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            self.upstream_requests += 1
+            return flight, True
+
+    def done(self, flight: Flight, complete: bool):
+        """领头的请求结束，之后相同的请求不再合并到这个flight上"""
+        with self._flights_lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.finish(complete)
+
+    def stats(self) -> dict:
+        with self._flights_lock:
+            in_flight = len(self._flights)
+        return {
+            "upstream_requests": self.upstream_requests,
+            "coalesced_requests": self.coalesced_requests,
+            "in_flight": in_flight,
+        }
@@ -0,0 +1,150 @@
+"""
+调用模型之前的本地语法检查：Python用内置的compile，C/C++、Java、JavaScript在装有相应工具时
+分别用 gcc/g++ -fsyntax-only、javac、node --check
+结果按代码的哈希缓存，同一份代码重复提交时不再检查
+"""
+
+import hashlib
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from .TestRunner import normalize_language
+
+log = logging.getLogger(__name__)
+
+CHECK_TIMEOUT = 15
+CACHE_SIZE = 256
+DIAGNOSTICS_LIMIT = 2000  # 交给模型和显示的诊断信息最多保留的字符数
+
+_JAVA_CLASS = re.compile(r"public\s+(?:final\s+)?class\s+(\w+)")
+
+# 语言 -> (工具, 源文件名, 检查命令)；{src} 替换为源文件路径，{dir} 替换为临时目录
+CHECKERS = {
+    "c": ("gcc", "main.c", ["gcc", "-fsyntax-only", "{src}"]),
+    "c++": ("g++", "main.cpp", ["g++", "-fsyntax-only", "-std=c++17", "{src}"]),
+    "java": ("javac", "{name}.java", ["javac", "-encoding", "UTF-8", "-d", "{dir}", "{src}"]),
+    "javascript": ("node", "main.js", ["node", "--check", "{src}"]),
+}
+
+
+@dataclass
+class CheckResult:
+    ok: bool
+    tool: str  # 使用的检查工具
+    diagnostics: str = ""  # 编译器的错误信息（已去掉临时目录）
+
+
+def _code_key(code: str, language: str) -> str:
+    return hashlib.sha256(f"{language}\0{code}".encode("utf-8")).hexdigest()
+
+
+def _truncate(text: str) -> str:
+    text = text.strip()
+    return text if len(text) <= DIAGNOSTICS_LIMIT else text[:DIAGNOSTICS_LIMIT] + "\n…"
+
+
+def check_python(code: str) -> CheckResult:
+    try:
+        compile(code, "main.py", "exec", dont_inherit=True)
+    except SyntaxError as e:
+        lines = [f"main.py 第{e.lineno}行: {type(e).__name__}: {e.msg}"]
+        if e.text:
+            lines.append(e.text.rstrip("\n"))
+            if e.offset:
+                lines.append(" " * (e.offset - 1) + "^")
+        return CheckResult(False, "python", "\n".join(lines))
+    except ValueError as e:  # 代码中含有空字符等
+        return CheckResult(False, "python", str(e))
+    return CheckResult(True, "python")
+
+
+def check_with_tool(code: str, language: str):
+    """用外部编译器检查，本机没有相应工具或检查超时时返回None"""
+    tool, source_name, command = CHECKERS[language]
+    if shutil.which(tool) is None:
+        return None
+    match = _JAVA_CLASS.search(code)
+    source_name = source_name.format(name=match.group(1) if match else "Main")
+    with tempfile.TemporaryDirectory(prefix="bugsy_check_") as directory:
+        source = os.path.join(directory, source_name)
+        with open(source, "w", encoding="utf-8") as f:
+            f.write(code)
+        try:
+            completed = subprocess.run(
+                [part.format(src=source, dir=directory) for part in command],
+                cwd=directory,
+                capture_output=True,
+                text=True,
+                errors="replace",
+                timeout=CHECK_TIMEOUT,
+            )
+        except subprocess.TimeoutExpired:
+            log.warning(f"{tool} 检查超时")
+            return None
+        output = (completed.stderr or completed.stdout).replace(directory + os.sep, "")
+    # node 会附上调用栈和版本号，对定位错误没有帮助
+    output = "\n".join(
+        line for line in output.splitlines() if not line.startswith("    at ") and not line.startswith("Node.js v")
+    )
+    if completed.returncode == 0:
+        return CheckResult(True, tool)
+    return CheckResult(False, tool, _truncate(output))
+
+
+class StaticChecker:
+    """本地语法检查，只有一个实例，结果按 (语言, 代码) 的哈希缓存在内存中"""
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "StaticChecker":
+        with StaticChecker._lock:
+            if StaticChecker._instance is None:
+                StaticChecker._instance = StaticChecker()
+        return StaticChecker._instance
+
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self.checks = 0
+        self.hits = 0
+        self.errors_found = 0
+
+    def check(self, code: str, language: str):
+        """
+        :return: CheckResult；不支持的语言或本机没有检查工具时返回None
+        """
+        language = normalize_language(language)
+        if language is None or (language != "python" and language not in CHECKERS):
+            return None
+        key = _code_key(code, language)
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+
+        result = check_python(code) if language == "python" else check_with_tool(code, language)
+        with self._cache_lock:
+            self.checks += 1
+            if result is None:
+                return None  # 检查超时，下次再试
+            if not result.ok:
+                self.errors_found += 1
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def stats(self) -> dict:
+        with self._cache_lock:
+            return {"checks": self.checks, "cache_hits": self.hits, "errors_found": self.errors_found}
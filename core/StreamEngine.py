@@ -0,0 +1,130 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PySide6.QtCore import QObject
+
+from .Metrics import RequestTrace
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 4  # 同时进行的LLM请求数上限，超出的请求排队等待
+
+
+class EngineTask(QObject):
+    """
+    在StreamEngine中执行的任务基类，替代原来每个请求一个的QThread子类
+    子类实现run()，并通过自身的Qt信号把结果送回主线程（跨线程emit由Qt自动排队，线程安全）
+    """
+
+    def __init__(self, window_id=None):
+        """
+        :param window_id: 发起请求的窗口id，用于日志和指标
+        """
+        super().__init__()
+        self.window_id = window_id
+        self._cancel_event = threading.Event()
+        self.trace = RequestTrace(window_id)  # 各阶段用时，子类负责设置模型名和记录中间时间点
+
+    def start(self):
+        """提交到共享引擎执行，保持与QThread.start()相同的用法"""
+        StreamEngine.instance().submit(self)
+
+    def cancel(self):
+        """请求取消，run()应在合适的位置检查 is_cancelled() 并尽快返回"""
+        self._cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def wait_cancelled(self, timeout) -> bool:
+        """等待timeout秒（如重试前的退避），期间被取消则提前返回True"""
+        return self._cancel_event.wait(timeout)
+
+    def run(self):
+        raise NotImplementedError
+
+
+class StreamEngine:
+    """
+    所有LLM请求共用的后台执行器，只有一个实例
+    用固定大小的线程池承载所有进行中的流式请求，限制并发数，并支持统一取消
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def instance() -> "StreamEngine":
+        with StreamEngine._lock:
+            if StreamEngine._instance is None:
+                StreamEngine._instance = StreamEngine()
+        return StreamEngine._instance
+
+    @staticmethod
+    def configure(**kwargs) -> "StreamEngine":
+        """用指定参数重建共享实例，需在提交第一个任务前调用"""
+        with StreamEngine._lock:
+            if StreamEngine._instance is not None:
+                StreamEngine._instance.shutdown()
+            StreamEngine._instance = StreamEngine(**kwargs)
+        return StreamEngine._instance
+
+    def __init__(self, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        :param max_concurrency: 同时执行的任务数上限
+        """
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrency, thread_name_prefix="StreamEngine"
+        )
+        self._tasks = {}  # EngineTask -> Future
+        self._tasks_lock = threading.Lock()
+
+    def submit(self, task: EngineTask):
+        """提交任务，返回对应的Future"""
+        with self._tasks_lock:
+            future = self._executor.submit(self._run, task)
+            self._tasks[task] = future
+        return future
+
+    def _run(self, task: EngineTask):
+        try:
+            if task.is_cancelled():
+                log.info(f"{type(task).__name__} 在开始前已被取消")
+                return
+            task.trace.mark("started")
+            task.run()
+            if not task.is_cancelled():
+                task.trace.finish()
+        except Exception:
+            log.exception(f"{type(task).__name__} 执行出错")
+        finally:
+            with self._tasks_lock:
+                self._tasks.pop(task, None)
+
+    def cancel(self, task: EngineTask):
+        """取消单个任务：排队中的直接移除，执行中的设置取消标记"""
+        log.info(f"取消 {type(task).__name__}(窗口{task.window_id})")
+        task.cancel()
+        with self._tasks_lock:
+            future = self._tasks.get(task)
+        if future is not None and future.cancel():
+            with self._tasks_lock:
+                self._tasks.pop(task, None)
+
+    def cancel_all(self):
+        with self._tasks_lock:
+            tasks = list(self._tasks)
+        for task in tasks:
+            self.cancel(task)
+
+    def active_count(self) -> int:
+        """排队中和执行中的任务总数"""
+        with self._tasks_lock:
+            return len(self._tasks)
+
+    def shutdown(self, wait=False):
+        """取消所有任务并关闭线程池，程序退出时调用"""
+        self.cancel_all()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,280 @@
+"""
+在本机并行运行结构化分析给出的测试数据，检验原代码和修正后的代码
+每个测试在独立的子进程中运行，限制CPU时间、内存和输出大小，并有墙钟超时
+注意没有沙箱：代码以当前用户的权限运行，可以读写文件、访问网络，因此默认关闭，见 StructuredAgent.run_tests
+"""
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+try:
+    import resource  # 只有类Unix系统提供，Windows上只有超时限制
+except ImportError:
+    resource = None
+
+log = logging.getLogger(__name__)
+
+CPU_TIME_LIMIT = 2  # 每个测试的CPU时间（秒）
+WALL_TIMEOUT = 5  # 每个测试的墙钟超时（秒），防止sleep或等待输入
+MEMORY_LIMIT_MB = 256
+OUTPUT_LIMIT = 64 * 1024  # 输出文件的最大字节数
+COMPILE_TIMEOUT = 30
+MAX_WORKERS = min(8, os.cpu_count() or 2)
+
+
+@dataclass
+class Toolchain:
+    source: str  # 源文件名，{name} 会替换为Java的类名
+    compile: list  # 编译命令，None表示解释执行；{src}、{dir}、{name} 会被替换
+    run: list  # 运行命令
+    address_limit: bool = True  # 是否限制地址空间（JVM和V8会预留大量虚拟内存，改用自身的堆上限）
+
+
+TOOLCHAINS = {
+    "python": Toolchain("main.py", None, [sys.executable, "-I", "{src}"]),
+    "c": Toolchain("main.c", ["gcc", "-O2", "-o", "{dir}/main", "{src}", "-lm"], ["{dir}/main"]),
+    "c++": Toolchain("main.cpp", ["g++", "-O2", "-std=c++17", "-o", "{dir}/main", "{src}"], ["{dir}/main"]),
+    "java": Toolchain(
+        "{name}.java",
+        ["javac", "-encoding", "UTF-8", "-d", "{dir}", "{src}"],
+        ["java", f"-Xmx{MEMORY_LIMIT_MB}m", "-cp", "{dir}", "{name}"],
+        address_limit=False,
+    ),
+    "javascript": Toolchain(
+        "main.js", None, ["node", f"--max-old-space-size={MEMORY_LIMIT_MB}", "{src}"], address_limit=False
+    ),
+}
+LANGUAGE_ALIASES = {"cpp": "c++", "js": "javascript", "py": "python"}
+
+_JAVA_CLASS = re.compile(r"public\s+(?:final\s+)?class\s+(\w+)")
+
+
+def normalize_language(language: str):
+    """返回 TOOLCHAINS 中的语言名，不支持运行时返回None"""
+    language = language.strip().lower()
+    language = LANGUAGE_ALIASES.get(language, language)
+    return language if language in TOOLCHAINS else None
+
+
+def missing_tool(toolchain: Toolchain):
+    """返回本机缺少的编译器或解释器名，齐全时返回None"""
+    for command in (toolchain.compile, toolchain.run):
+        if command and "{" not in command[0] and shutil.which(command[0]) is None:
+            return command[0]
+    return None
+
+
+def normalize_output(text: str) -> str:
+    """比较输出时忽略行尾空白和末尾的空行"""
+    return "\n".join(line.rstrip() for line in text.strip().splitlines())
+
+
+@dataclass
+class Program:
+    """编译好（或可直接解释执行）的一份代码"""
+
+    label: str
+    command: list = None
+    directory: str = None  # 源文件和编译产物所在的目录，运行时的工作目录
+    address_limit: bool = True
+    error: str = None  # 编译失败或缺少工具链时的说明
+
+
+@dataclass
+class RunResult:
+    status: str  # ok / timeout / runtime_error / output_limit / not_run
+    output: str = ""
+    detail: str = ""  # stderr的末尾或其他说明
+    elapsed: float = 0.0
+
+    def matches(self, expected: str) -> bool:
+        return self.status == "ok" and normalize_output(self.output) == normalize_output(expected)
+
+
+@dataclass
+class CaseResult:
+    index: int
+    case: dict  # 模型给出的 {input, origin_output, expected_output}
+    fixed: RunResult  # 修正后的代码
+    original: RunResult  # 用户的原代码
+
+    @property
+    def fixed_passed(self) -> bool:
+        """修正后的代码输出了期望结果"""
+        return self.fixed.matches(self.case.get("expected_output", ""))
+
+    @property
+    def original_as_described(self) -> bool:
+        """原代码的实际输出与模型描述的一致"""
+        return self.original.matches(self.case.get("origin_output", ""))
+
+
+def _limit_resources(address_limit):
+    """
+    子进程exec之前执行的限制，只做setrlimit系统调用：
+    本进程有多个线程，fork后的子进程中不能加锁、分配内存或导入模块，否则可能死锁
+    """
+
+    def apply():
+        resource.setrlimit(resource.RLIMIT_CPU, (CPU_TIME_LIMIT, CPU_TIME_LIMIT + 1))
+        resource.setrlimit(resource.RLIMIT_FSIZE, (OUTPUT_LIMIT, OUTPUT_LIMIT))
+        if address_limit:
+            limit = MEMORY_LIMIT_MB * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    return apply
+
+
+def _tail(text: str, limit=500) -> str:
+    text = text.strip()
+    return text if len(text) <= limit else "…" + text[-limit:]
+
+
+class TestRunner:
+    """
+    编译用户代码和修正后的代码，在线程池中并行运行每组测试数据（每次运行是一个受限的子进程）
+    每完成一组测试就回调一次，可随时取消
+    """
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.max_workers = max_workers
+        self._cancelled = threading.Event()
+        self._processes = set()
+        self._processes_lock = threading.Lock()
+
+    def cancel(self):
+        """停止运行，结束所有正在运行的子进程"""
+        self._cancelled.set()
+        with self._processes_lock:
+            processes = list(self._processes)
+        for process in processes:
+            self._kill(process)
+
+    @staticmethod
+    def _kill(process):
+        try:
+            if resource is not None:
+                os.killpg(process.pid, 9)
+            else:
+                process.kill()
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    def run(self, language, user_code, correct_code, cases, on_case, on_compile_error=None) -> list:
+        """
+        :param cases: 测试数据列表，每项为 {input, origin_output, expected_output}
+        :param on_case: 每完成一组测试调用 on_case(CaseResult)，在线程池的线程中调用
+        :param on_compile_error: 编译失败或缺少工具链时调用 on_compile_error(Program)，此时相应的运行结果为 not_run
+        :return: 按顺序的CaseResult列表（被取消时只包含已完成的）
+        """
+        toolchain = TOOLCHAINS[normalize_language(language)]
+        tool = missing_tool(toolchain)
+        if tool is not None:
+            if on_compile_error is not None:
+                on_compile_error(Program("toolchain", error=f"本机未安装 {tool}，无法运行测试"))
+            return []
+        with tempfile.TemporaryDirectory(prefix="bugsy_tests_") as root, ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="TestRunner"
+        ) as executor:
+            compiles = {
+                label: executor.submit(self._compile, label, code, toolchain, os.path.join(root, label))
+                for label, code in (("original", user_code), ("fixed", correct_code))
+            }
+            programs = {label: future.result() for label, future in compiles.items()}
+            for program in programs.values():
+                if program.error is not None and on_compile_error is not None:
+                    on_compile_error(program)
+
+            def run_case(index, case):
+                fixed = self._execute(programs["fixed"], case.get("input", ""))
+                original = self._execute(programs["original"], case.get("input", ""))
+                result = CaseResult(index, case, fixed, original)
+                if not self._cancelled.is_set():
+                    on_case(result)
+                return result
+
+            futures = [executor.submit(run_case, i, case) for i, case in enumerate(cases)]
+            return [f.result() for f in futures if not self._cancelled.is_set()]
+
+    def _compile(self, label, code, toolchain: Toolchain, directory) -> Program:
+        os.makedirs(directory)
+        match = _JAVA_CLASS.search(code)
+        name = match.group(1) if match else "Main"
+        source = os.path.join(directory, toolchain.source.format(name=name))
+        with open(source, "w", encoding="utf-8") as f:
+            f.write(code)
+
+        def fill(command):
+            return [part.format(src=source, dir=directory, name=name) for part in command]
+
+        if toolchain.compile is not None:
+            try:
+                completed = subprocess.run(
+                    fill(toolchain.compile),
+                    cwd=directory,
+                    capture_output=True,
+                    text=True,
+                    errors="replace",
+                    timeout=COMPILE_TIMEOUT,
+                )
+            except subprocess.TimeoutExpired:
+                return Program(label, error="编译超时")
+            if completed.returncode != 0:
+                message = (completed.stderr or completed.stdout).replace(directory + os.sep, "")
+                return Program(label, error=_tail(message))
+        return Program(label, fill(toolchain.run), directory, toolchain.address_limit)
+
+    def _execute(self, program: Program, stdin: str) -> RunResult:
+        if program.command is None or self._cancelled.is_set():
+            return RunResult("not_run", detail=program.error or "已取消")
+        with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+            kwargs = {}
+            if resource is not None:
+                kwargs["preexec_fn"] = _limit_resources(program.address_limit)
+                kwargs["start_new_session"] = True  # 超时时连同子进程一起结束（killpg）
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                program.command,
+                cwd=program.directory,
+                stdin=subprocess.PIPE,
+                stdout=stdout,
+                stderr=stderr,
+                **kwargs,
+            )
+            with self._processes_lock:
+                self._processes.add(process)
+            timed_out = False
+            try:
+                data = stdin if stdin.endswith("\n") else stdin + "\n"
+                process.communicate(data.encode("utf-8"), timeout=WALL_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                self._kill(process)
+                process.wait()
+            except BrokenPipeError:
+                process.wait()  # 程序没有读完输入就退出了
+            finally:
+                with self._processes_lock:
+                    self._processes.discard(process)
+            elapsed = time.perf_counter() - start
+            stdout.seek(0)
+            stderr.seek(0)
+            output = stdout.read().decode("utf-8", errors="replace")
+            errors = stderr.read().decode("utf-8", errors="replace")
+
+        if timed_out or process.returncode in (-9, -24):  # SIGKILL / SIGXCPU
+            return RunResult("timeout", output, f"超过{CPU_TIME_LIMIT}秒CPU时间或{WALL_TIMEOUT}秒运行时间", elapsed)
+        if process.returncode == -25:  # SIGXFSZ
+            return RunResult("output_limit", output, f"输出超过{OUTPUT_LIMIT // 1024}KB", elapsed)
+        if process.returncode != 0:
+            return RunResult("runtime_error", output, _tail(errors) or f"退出码 {process.returncode}", elapsed)
+        return RunResult("ok", output, _tail(errors), elapsed)
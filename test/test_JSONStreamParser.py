@@ -0,0 +1,59 @@
+"""
+JSONStreamParser 的回归测试（在项目根目录执行 python -m pytest test）
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.JSONRepair import decode_json
+from core.JSONStreamParser import JSONStreamParser
+
+# 模型常见的输出：代码块包裹，correct_code 中含有未转义的换行和制表符
+REPLY = (
+    "```json\n"
+    "{\n"
+    '  "problem_analysis": "求1到n的和",\n'
+    '  "error_reason": "range的上界少了1",\n'
+    '  "correct_code": "n = int(input())\n'
+    "total = 0\n"
+    "for i in range(1, n + 1):\n"
+    '\ttotal += i\nprint(total)",\n'
+    '  "test_cases": [{"input": "3", "expected_output": "6"}, {"input": "1", "expected_output": "1"}]\n'
+    "}\n"
+    "```"
+)
+
+
+def feed_in_chunks(parser, text, size):
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    return events
+
+
+def test_multiline_string_field_is_emitted_in_order():
+    for size in (1, 7, len(REPLY)):
+        parser = JSONStreamParser(item_keys=("test_cases",))
+        events = feed_in_chunks(parser, REPLY, size)
+        keys = [(key, index) for key, index, _ in events]
+        assert keys == [
+            ("problem_analysis", None),
+            ("error_reason", None),
+            ("correct_code", None),
+            ("test_cases", 0),
+            ("test_cases", 1),
+            ("test_cases", None),
+        ]
+        code = dict((key, value) for key, index, value in events if index is None)["correct_code"]
+        assert code.splitlines()[2:4] == ["for i in range(1, n + 1):", "\ttotal += i"]
+        assert parser.finished
+
+
+def test_stream_matches_decode_json():
+    parser = JSONStreamParser(item_keys=("test_cases",))
+    events = feed_in_chunks(parser, REPLY, 5)
+    fields = {key: value for key, index, value in events if index is None}
+    document, _ = decode_json(REPLY)
+    assert fields == document